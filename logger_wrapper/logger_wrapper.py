@@ -1,27 +1,163 @@
 """Logging setup."""
 
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
 
+# (level, name_appendix, dir_path, max_bytes, backup_count, when, json_lines)
+_Settings = Tuple[int, str, str, int, int, Optional[str], bool]
 
-def setup_logger(
-    level: int = logging.INFO, name_appendix: str = "", dir_path: str = "logs"
-) -> logging.Logger:
-    """Set up and return a logger with both terminal and file output."""
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)  # pragma: no cover
-    logger = logging.getLogger()
-    logger.setLevel(level)
-    current_time = datetime.now().strftime("%Y%m%dT%H%M%S")
-    log_file_path = os.path.join(dir_path, f"{current_time}_{name_appendix}.log")
-    handlers: list[logging.Handler] = [
-        logging.StreamHandler(),
-        logging.FileHandler(log_file_path),
-    ]
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format each record as a single line JSON object."""
+
+    def __init__(self, name_appendix: str = "") -> None:
+        super().__init__()
+        self.name_appendix = name_appendix
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Union[str, int]] = {
+            "time": self.formatTime(record),
+            "name": self.name_appendix,
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler leaving the formatting of records to the listener's thread.
+
+    The stock `prepare` formats the message and traceback in the calling thread, and folds
+    the traceback into the message. Records only cross threads here, so they are queued
+    as is, with their `args` and `exc_info`, for the listener's formatters to use.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _QueuedLogging:
+    """A queue handler on the root logger, drained by a background listener thread."""
+
+    def __init__(self, settings: _Settings, handlers: List[logging.Handler]) -> None:
+        self.settings = settings
+        self.handlers = handlers
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        self.queue_handler = _QueueHandler(log_queue)
+        self.listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+
+    def start(self) -> None:
+        """Start forwarding the records of the root logger to the handlers."""
+        logging.getLogger().addHandler(self.queue_handler)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Flush the queued records, then detach and close the handlers."""
+        logging.getLogger().removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+_active: Dict[str, _QueuedLogging] = {}  # the current setup, if any, under the key "root"
+
+
+def shutdown_logger() -> None:
+    """Write out all pending records and stop the background logging thread."""
+    setup = _active.pop("root", None)
+    if setup is not None:
+        setup.stop()
+
+
+atexit.register(shutdown_logger)
+
+
+def _file_handler(
+    log_file_path: str, max_bytes: int, backup_count: int, when: Optional[str]
+) -> logging.Handler:
+    if when is not None:
+        return logging.handlers.TimedRotatingFileHandler(
+            log_file_path, when=when, backupCount=backup_count
+        )
+    if max_bytes > 0:
+        return logging.handlers.RotatingFileHandler(
+            log_file_path, maxBytes=max_bytes, backupCount=backup_count
+        )
+    return logging.FileHandler(log_file_path)
+
+
+def _handlers(settings: _Settings) -> List[logging.Handler]:
+    """Return the terminal and file handlers.
+
+    Without rotation, the file handler writes to a new timestamped file. With rotation, it
+    appends to the same file across runs, so that rotation bounds the size of the log dir.
+    """
+    level, name_appendix, dir_path, max_bytes, backup_count, when, json_lines = settings
+    if when is not None or max_bytes > 0:
+        file_name = f"{name_appendix or 'rclone_wrapper'}.log"
+    else:
+        file_name = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}_{name_appendix}.log"
+    log_file_path = os.path.join(dir_path, file_name)
+    stream_handler = logging.StreamHandler()
+    file_handler = _file_handler(log_file_path, max_bytes, backup_count, when)
     formatter = logging.Formatter(f"%(asctime)s - {name_appendix} - %(levelname)s - %(message)s")
+    stream_handler.setFormatter(formatter)
+    file_handler.setFormatter(JsonLinesFormatter(name_appendix) if json_lines else formatter)
+    handlers: List[logging.Handler] = [stream_handler, file_handler]
     for handler in handlers:
         handler.setLevel(level)
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+    return handlers
+
+
+def setup_logger(  # pylint: disable=too-many-arguments
+    level: int = logging.INFO,
+    name_appendix: str = "",
+    dir_path: str = "logs",
+    *,
+    max_bytes: int = 0,
+    backup_count: int = 0,
+    when: Optional[str] = None,
+    json_lines: bool = False,
+) -> logging.Logger:
+    """Set up and return a logger with both terminal and file output.
+
+    Logging calls only put records on a queue; formatting and I/O happen in a background
+    thread. Calling this again with the same arguments changes nothing, and with different
+    arguments replaces the previous setup, so handlers never pile up.
+
+    The log file is rotated by size if max_bytes > 0, or by time if `when` is given (see
+    `logging.handlers.TimedRotatingFileHandler`), keeping backup_count old files. A rotated
+    log file is named after name_appendix only, and successive runs append to it.
+    With json_lines, the log file gets one JSON object per record and line.
+    """
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    settings: _Settings = (
+        level,
+        name_appendix,
+        dir_path,
+        max_bytes,
+        backup_count,
+        when,
+        json_lines,
+    )
+    if "root" in _active and _active["root"].settings == settings:
+        return logger
+    shutdown_logger()
+
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)  # pragma: no cover
+    _active["root"] = _QueuedLogging(settings, _handlers(settings))
+    _active["root"].start()
     return logger
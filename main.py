@@ -5,53 +5,238 @@ import argparse
 import os
 import sys
 from types import SimpleNamespace
-from typing import Sequence
+from typing import Optional, Sequence
 
 from logger_wrapper.logger_wrapper import setup_logger
 from rclone_wrapper.comparison import compare_folders
 from rclone_wrapper.configuration import read_config
+from rclone_wrapper.daemon import forward, serve
+from rclone_wrapper.fanout import upload_to_remotes
+from rclone_wrapper.indexing import RemoteIndex
 from rclone_wrapper.mounting import mount, unmount
-from rclone_wrapper.navigation import navigate
-from rclone_wrapper.transferring import download, upload
+from rclone_wrapper.navigation import list_names, navigate, remote_exists
+from rclone_wrapper.planning import KINDS, execute_plans, load_plan, plan_transfer, save_plan
+from rclone_wrapper.searching import MODES, search
+from rclone_wrapper.transferring import download, sync, upload
+from rclone_wrapper.usage import disk_usage, heaviest
+from rclone_wrapper.warming import WarmUp
+from rclone_wrapper.watching import watch
 
-logger = setup_logger(name_appendix=__name__)
+LOCAL_COMMANDS = ("navigate", "watch", "daemon")  # never forwarded to a running daemon
+
+
+def _bandwidth(config: SimpleNamespace) -> Optional[str]:
+    """Return the optional bandwidth policy of the config, e.g. '08:00,2.5M 18:00,off'."""
+    bandwidth = getattr(config, "bandwidth", None)
+    return None if bandwidth is None else str(bandwidth)
+
+
+def _setup_logging(config: SimpleNamespace) -> None:
+    """Set up logging with the rotation of the config, e.g. {'max_bytes': 10485760}."""
+    settings = dict(getattr(config, "logging", None) or {})
+    setup_logger(
+        name_appendix=__name__,
+        max_bytes=int(settings.get("max_bytes", 0)),
+        backup_count=int(settings.get("backup_count", 0)),
+        when=settings.get("when"),
+        json_lines=bool(settings.get("json_lines", False)),
+    )
+
+
+def _warm_up(config: SimpleNamespace) -> WarmUp:
+    """Return the warm-up settings of the config, e.g. {'paths': ['datasets'], 'depth': 2}.
+
+    The hot dirs must be configured: warming up the whole remote would list all of it.
+    """
+    settings = dict(getattr(config, "warm_up", None) or {})
+    if not settings.get("paths"):
+        sys.exit("--warm-up needs the hot dirs under 'warm_up: paths' in the config.")
+    return WarmUp(
+        [str(path) for path in settings["paths"]],
+        settings.get("depth"),
+        int(settings.get("header_bytes", 0)),
+    )
 
 
 def _main_navigate(_: argparse.Namespace, config: SimpleNamespace) -> None:
     navigate(config.remote)
 
 
+def _main_ls(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    for name in list_names((args.remote_path or "").strip("/"), config.remote):
+        print(name)
+
+
+def _main_exists(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    mode = "dir" if args.dir else "file_or_dir"
+    if not remote_exists(config.remote, args.remote_path, mode):
+        sys.exit(1)
+
+
+def _main_daemon(_: argparse.Namespace, config: SimpleNamespace) -> None:
+    serve(lambda argv: _run(argv, config))
+
+
 def _main_mount(args: argparse.Namespace, config: SimpleNamespace) -> None:
-    mount(args.remote_path, args.mount_point, config.remote)
+    mount(
+        args.remote_path,
+        args.mount_point,
+        config.remote,
+        _bandwidth(config),
+        warm=_warm_up(config) if args.warm_up else None,
+    )
 
 
 def _main_unmount(args: argparse.Namespace, _: SimpleNamespace) -> None:
     unmount(args.mount_point)
 
 
+def _open_index(args: argparse.Namespace, config: SimpleNamespace) -> Optional[RemoteIndex]:
+    """Return the refreshed remote index if `--use-index` was requested, else None.
+
+    Its hashes are trusted for dedup lookups and comparisons, so the path is re-listed in
+    full rather than from the dirs whose modtime moved.
+    """
+    if not args.use_index:
+        return None
+    index = RemoteIndex(config.remote)
+    index.refresh(args.remote_path or "", full=True)
+    return index
+
+
+def _main_index(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    index = RemoteIndex(config.remote)
+    index.refresh(args.remote_path or "")
+    index.close()
+
+
+def _main_search(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    index = RemoteIndex(config.remote)
+    found = search(
+        index,
+        args.pattern,
+        args.mode,
+        prefix=args.remote_path or "",
+        kind=args.type,
+        refresh=args.refresh,
+    )
+    index.close()
+    for entry in found:
+        print(f"{entry.path}/" if entry.is_dir else entry.path)
+
+
+def _main_du(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    root = f"{config.remote}:{args.remote_path or ''}"
+    usage = disk_usage(root)
+    print(f"{usage[''].size:>16,} bytes {usage[''].files:>10,} files  {root}")
+    for entry in heaviest(usage, args.top):
+        print(f"{entry.size:>16,} bytes {entry.files:>10,} files  {entry.path}/")
+
+
 def _main_compare(args: argparse.Namespace, config: SimpleNamespace) -> None:
-    compare_folders(args.local_path, f"{config.remote}:{args.remote_path}")
+    index = _open_index(args, config)
+    compare_folders(args.local_path, f"{config.remote}:{args.remote_path}", index=index)
 
 
 def _main_upload(args: argparse.Namespace, config: SimpleNamespace) -> None:
-    upload(args.remote_path, args.local_path, config.remote)
+    index = _open_index(args, config)
+    if index is not None and args.dedup_root is not None:
+        index.refresh(args.dedup_root, full=True)  # dedup lookups read this subtree from it
+    report = upload(
+        args.remote_path,
+        args.local_path,
+        config.remote,
+        dedup_root=args.dedup_root,
+        index=index,
+        bandwidth=_bandwidth(config),
+        verify=args.verify,
+    )
+    if report is not None and not report.ok:
+        sys.exit(1)
+
+
+def _main_fanout(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    reports = upload_to_remotes(
+        args.remote_path, args.local_path, args.remotes, bandwidth=_bandwidth(config)
+    )
+    if reports is None or any(report.failed for report in reports.values()):
+        sys.exit(1)
 
 
 def _main_download(args: argparse.Namespace, config: SimpleNamespace) -> None:
-    download(args.remote_path, args.local_path, config.remote)
+    report = download(
+        args.remote_path, args.local_path, config.remote, _bandwidth(config), verify=args.verify
+    )
+    if report is not None and not report.ok:
+        sys.exit(1)
+
+
+def _main_sync(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    sync(
+        args.remote_path,
+        args.local_path,
+        config.remote,
+        delete=args.delete,
+        bandwidth=_bandwidth(config),
+    )
 
 
-def _parse_args(argv: Sequence[str]) -> argparse.Namespace:
+def _main_watch(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    watch(
+        args.remote_path,
+        args.local_path,
+        config.remote,
+        debounce=args.debounce,
+        bandwidth=_bandwidth(config),
+    )
+
+
+def _main_plan(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    index = _open_index(args, config)
+    plan = plan_transfer(
+        args.kind, args.remote_path, args.local_path, config.remote, delete=args.delete, index=index
+    )
+    if plan is not None:
+        print(plan.summary())
+        print(f"Plan stored in '{save_plan(plan, args.output)}'.")
+
+
+def _main_execute(args: argparse.Namespace, config: SimpleNamespace) -> None:
+    plans = [load_plan(plan_file) for plan_file in args.plan_files]
+    execute_plans(plans, bandwidth=_bandwidth(config))
+
+
+def _parse_args(  # pylint: disable=too-many-statements, too-many-locals
+    argv: Sequence[str],
+) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="rclone wrapper operations")
+    parser.add_argument(
+        "--local", action="store_true", help="Run here, even if a daemon is running"
+    )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     navigate_parser = subparsers.add_parser("navigate", help="Interactively navigate remote")
     navigate_parser.set_defaults(func=_main_navigate)
 
+    ls_parser = subparsers.add_parser("ls", help="List a remote dir (dirs end with '/')")
+    ls_parser.set_defaults(func=_main_ls)
+    ls_parser.add_argument("-r", "--remote-path", help="Remote dir to list (default: root)")
+
+    exists_parser = subparsers.add_parser("exists", help="Exit with 1 if a remote path is missing")
+    exists_parser.set_defaults(func=_main_exists)
+    exists_parser.add_argument("-r", "--remote-path", required=True, help="Remote path to check")
+    exists_parser.add_argument("--dir", action="store_true", help="Only accept a dir")
+
+    daemon_parser = subparsers.add_parser("daemon", help="Serve the other commands from here")
+    daemon_parser.set_defaults(func=_main_daemon)
+
     mount_parser = subparsers.add_parser("mount", help="Mount a remote path")
     mount_parser.set_defaults(func=_main_mount)
     mount_parser.add_argument("-r", "--remote-path", help="Remote path to mount")
     mount_parser.add_argument("-m", "--mount-point", help="Local mount point")
+    mount_parser.add_argument(
+        "-w", "--warm-up", action="store_true", help="Pre-load the hot dirs of the config"
+    )
 
     unmount_parser = subparsers.add_parser("unmount", help="Unmount a mount point")
     unmount_parser.set_defaults(func=_main_unmount)
@@ -61,27 +246,123 @@ def _parse_args(argv: Sequence[str]) -> argparse.Namespace:
     compare_parser.set_defaults(func=_main_compare)
     compare_parser.add_argument("-r", "--remote-path", help="Remote path")
     compare_parser.add_argument("-l", "--local-path", help="Local path")
+    compare_parser.add_argument(
+        "-i", "--use-index", action="store_true", help="Compare against the local remote index"
+    )
 
     upload_parser = subparsers.add_parser("upload", help="Upload local file/dir")
     upload_parser.set_defaults(func=_main_upload)
     upload_parser.add_argument("-r", "--remote-path", help="Remote path to upload to")
     upload_parser.add_argument("-l", "--local-path", help="Path to local file/dir to upload")
+    upload_parser.add_argument(
+        "-d", "--dedup-root", help="Remote dir to server-side copy already uploaded content from"
+    )
+    upload_parser.add_argument(
+        "-i", "--use-index", action="store_true", help="Read remote checks from the local index"
+    )
+    upload_parser.add_argument(
+        "--verify", action="store_true", help="Check the upload against hashes taken during it"
+    )
+
+    fanout_parser = subparsers.add_parser(
+        "fanout", help="Upload local file/dir to several remotes, reading it once"
+    )
+    fanout_parser.set_defaults(func=_main_fanout)
+    fanout_parser.add_argument("-r", "--remote-path", help="Path to upload to, on every remote")
+    fanout_parser.add_argument("-l", "--local-path", help="Path to local file/dir to upload")
+    fanout_parser.add_argument(
+        "-t", "--remotes", nargs="+", required=True, help="rclone remotes to upload to"
+    )
 
     download_parser = subparsers.add_parser("download", help="Download remote file/dir")
     download_parser.set_defaults(func=_main_download)
     download_parser.add_argument("-r", "--remote-path", help="Path to remote file/dir to download")
     download_parser.add_argument("-l", "--local-path", help="Local path to download to")
+    download_parser.add_argument(
+        "--verify", action="store_true", help="Check the download against hashes taken during it"
+    )
+
+    sync_parser = subparsers.add_parser("sync", help="Transfer only changes of an uploaded dir")
+    sync_parser.set_defaults(func=_main_sync)
+    sync_parser.add_argument("-r", "--remote-path", help="Remote path the dir was uploaded to")
+    sync_parser.add_argument("-l", "--local-path", help="Path to local dir to sync")
+    sync_parser.add_argument(
+        "--delete", action="store_true", help="Delete remote files that no longer exist locally"
+    )
+
+    watch_parser = subparsers.add_parser("watch", help="Continuously upload local changes")
+    watch_parser.set_defaults(func=_main_watch)
+    watch_parser.add_argument("-r", "--remote-path", help="Remote path to upload to")
+    watch_parser.add_argument("-l", "--local-path", help="Path to local dir to watch")
+    watch_parser.add_argument(
+        "--debounce", type=float, default=5.0, help="Seconds without changes ending a batch"
+    )
+
+    plan_parser = subparsers.add_parser("plan", help="Plan a transfer without running it")
+    plan_parser.set_defaults(func=_main_plan)
+    plan_parser.add_argument("-k", "--kind", choices=KINDS, help="Kind of transfer to plan")
+    plan_parser.add_argument("-r", "--remote-path", help="Remote path")
+    plan_parser.add_argument("-l", "--local-path", help="Local path")
+    plan_parser.add_argument("--delete", action="store_true", help="Plan deletions of a sync")
+    plan_parser.add_argument(
+        "-i", "--use-index", action="store_true", help="Read the remote from the local index"
+    )
+    plan_parser.add_argument("-o", "--output", help="Plan file (default: under plans/)")
+
+    execute_parser = subparsers.add_parser("execute", help="Run a previously stored plan")
+    execute_parser.set_defaults(func=_main_execute)
+    execute_parser.add_argument(
+        "-p",
+        "--plan-file",
+        dest="plan_files",
+        nargs="+",
+        help="Plan file(s) written by plan, destinations are validated all at once",
+    )
+
+    index_parser = subparsers.add_parser("index", help="Refresh the local index of the remote")
+    index_parser.set_defaults(func=_main_index)
+    index_parser.add_argument("-r", "--remote-path", help="Remote dir to index (default: root)")
+
+    du_parser = subparsers.add_parser("du", help="Show the heaviest dirs of a remote tree")
+    du_parser.set_defaults(func=_main_du)
+    du_parser.add_argument("-r", "--remote-path", help="Remote dir to measure (default: root)")
+    du_parser.add_argument("-n", "--top", type=int, default=20, help="Number of dirs to show")
+
+    search_parser = subparsers.add_parser("search", help="Find remote files/dirs by name")
+    search_parser.set_defaults(func=_main_search)
+    search_parser.add_argument("pattern", help="Name pattern to look for")
+    search_parser.add_argument(
+        "-m", "--mode", choices=MODES, default="glob", help="How to match the pattern"
+    )
+    search_parser.add_argument("-r", "--remote-path", help="Remote dir to search (default: root)")
+    search_parser.add_argument("-t", "--type", choices=("file", "dir"), help="Only files or dirs")
+    search_parser.add_argument(
+        "--refresh", action="store_true", help="Refresh the index before searching it"
+    )
 
     return parser.parse_args(argv)
 
 
-def main(argv: Sequence[str]) -> int:
-    """Main entry point for the rclone wrapper."""
+def _run(argv: Sequence[str], config: SimpleNamespace) -> int:
     args = _parse_args(argv)
-    config = read_config()
     args.func(args, config)
     return os.EX_OK
 
 
+def main(argv: Sequence[str]) -> int:
+    """Main entry point for the rclone wrapper.
+
+    Commands are forwarded to the daemon if one is running in the current dir.
+    """
+    args = _parse_args(argv)
+    config = read_config()
+    _setup_logging(config)
+    if not args.local and args.command not in LOCAL_COMMANDS:
+        exit_code = forward(argv)
+        if exit_code is not None:
+            return exit_code
+    return _run(argv, config)
+
+
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
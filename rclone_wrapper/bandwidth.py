@@ -0,0 +1,211 @@
+"""utilities for sharing a time-of-day bandwidth budget across concurrent rclone jobs"""
+
+import itertools
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from rclone_wrapper.remote_control import free_rc_addr, rc_call, rc_flags
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = "cache/jobs"
+REBALANCE_INTERVAL = 30.0  # seconds between re-computations of a transfer's share
+
+# rclone sizes are binary and default to KiB, see `rclone help flags bwlimit`
+_UNITS = {"B": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+# (minutes since midnight the slot starts at, bytes/s or None for unlimited)
+Timetable = List[Tuple[int, Optional[float]]]
+
+_entry_numbers = itertools.count()  # of the job entries of this process, see `register_job`
+
+
+def parse_rate(rate: str) -> Optional[float]:
+    """Parse an rclone bandwidth such as '2.5M' or 'off' into bytes/s (None if unlimited)."""
+    if rate.strip().lower() == "off":
+        return None
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([BKMGT]?)i?", rate.strip(), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid bandwidth '{rate}'.")
+    return float(match.group(1)) * _UNITS[match.group(2).upper() or "K"]
+
+
+def parse_timetable(spec: str) -> Timetable:
+    """Parse a bandwidth policy: a single rate, or a daily timetable like rclone's --bwlimit.
+
+    e.g. '2.5M' or '08:00,2.5M 18:00,off' (full speed between 18:00 and 08:00).
+    """
+    entries = spec.split()
+    if len(entries) == 1 and "," not in entries[0]:
+        return [(0, parse_rate(entries[0]))]
+    timetable: Timetable = []
+    for entry in entries:
+        start, _, rate = entry.partition(",")
+        match = re.fullmatch(r"(\d{1,2}):(\d{2})", start)
+        if match is None or not rate:
+            raise ValueError(f"Invalid bandwidth timetable entry '{entry}'.")
+        timetable.append((int(match.group(1)) * 60 + int(match.group(2)), parse_rate(rate)))
+    return sorted(timetable)
+
+
+def current_limit(timetable: Timetable, now: Optional[datetime] = None) -> Optional[float]:
+    """Return the limit in bytes/s (None if unlimited) of the timetable at `now`."""
+    now = now or datetime.now()
+    minutes = now.hour * 60 + now.minute
+    limit = timetable[-1][1]  # before the first slot of the day, the day's last slot applies
+    for start, slot_limit in timetable:
+        if start <= minutes:
+            limit = slot_limit
+    return limit
+
+
+def format_rate(rate: Optional[float]) -> str:
+    """Format bytes/s for rclone, rounded down to whole KiB/s (but at least 1 KiB/s)."""
+    return "off" if rate is None else f"{max(int(rate // 1024), 1)}K"
+
+
+def split_timetable(timetable: Timetable, num_jobs: int) -> str:
+    """Return the rclone --bwlimit timetable giving one of `num_jobs` jobs its share."""
+    return " ".join(
+        f"{start // 60:02d}:{start % 60:02d},"
+        f"{format_rate(None if limit is None else limit / num_jobs)}"
+        for start, limit in timetable
+    )
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, but owned by someone else
+    return True
+
+
+def register_job(pid: int, rc_addr: Optional[str] = None, *, jobs: int = 1) -> str:
+    """Record a running rclone job (or the process waiting on it) and return its entry file.
+
+    Jobs with an rc address are told apart by its port, as one process (e.g. the daemon)
+    may wait on several of them. Entries of several `jobs` at once (e.g. the streams of a
+    fanout) are numbered.
+    """
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    if rc_addr is not None:
+        name = f"{pid}_{rc_addr.rpartition(':')[2]}"
+    else:
+        name = str(pid) if jobs == 1 else f"{pid}_j{next(_entry_numbers)}"
+    job_file = os.path.join(JOBS_DIR, f"{name}.json")
+    with open(job_file, "w", encoding="utf-8") as f:
+        json.dump({"pid": pid, "rc_addr": rc_addr, "jobs": jobs}, f)
+    return job_file
+
+
+def active_jobs() -> int:
+    """Return the number of registered jobs still running, forgetting the finished ones."""
+    if not os.path.isdir(JOBS_DIR):
+        return 0
+    count = 0
+    for name in os.listdir(JOBS_DIR):
+        job_file = os.path.join(JOBS_DIR, name)
+        try:
+            with open(job_file, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            pid, jobs = entry["pid"], int(entry.get("jobs", 1))
+        except (OSError, ValueError, KeyError):
+            continue  # being written or removed concurrently
+        if _is_alive(pid):
+            count += jobs
+        else:
+            logger.debug("Forgetting finished job %d.", pid)
+            os.remove(job_file)
+    return count
+
+
+def _share(timetable: Timetable) -> str:
+    return format_rate(_divide(current_limit(timetable), max(active_jobs(), 1)))
+
+
+def _divide(limit: Optional[float], num_jobs: int) -> Optional[float]:
+    return None if limit is None else limit / num_jobs
+
+
+def _keep_share(timetable: Timetable, rc_addr: str, share: str, stop: threading.Event) -> None:
+    """Update the rclone on `rc_addr` whenever its share of the budget changes."""
+    while not stop.wait(REBALANCE_INTERVAL):
+        new_share = _share(timetable)
+        if new_share == share:
+            continue
+        try:
+            rc_call(rc_addr, "core/bwlimit", rate=new_share)
+            logger.info("Bandwidth limit changed from %s to %s.", share, new_share)
+            share = new_share
+        except subprocess.CalledProcessError:
+            logger.warning("Could not update the bandwidth limit, retrying later.")
+
+
+@contextmanager
+def throttled(spec: Optional[str]) -> Iterator[List[str]]:
+    """Yield the extra flags for an rclone transfer to take its share of the bandwidth policy.
+
+    While inside the context, the transfer is registered as an active job, and its limit
+    is kept at the current slot's budget divided by the number of active jobs, through
+    the rc API of the rclone process. Without a policy, no flags are added.
+    """
+    if spec is None:
+        yield []
+        return
+
+    timetable = parse_timetable(spec)
+    rc_addr = free_rc_addr()
+    job_file = register_job(os.getpid(), rc_addr)
+    share = _share(timetable)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_keep_share, args=(timetable, rc_addr, share, stop), daemon=True
+    )
+    thread.start()
+    logger.info("Bandwidth limit of this transfer: %s", share)
+    try:
+        yield ["--bwlimit", share, *rc_flags(rc_addr)]
+    finally:
+        stop.set()
+        thread.join()
+        os.remove(job_file)
+
+
+@contextmanager
+def fixed_shares(spec: Optional[str], num_jobs: int) -> Iterator[List[str]]:
+    """Yield the --bwlimit flags of `num_jobs` transfers without rc, each with a fixed share.
+
+    Like mounts, they cannot be told about later jobs, so their share is fixed when they
+    start. They are registered as `num_jobs` active jobs meanwhile, so that the other
+    transfers shrink their own share.
+    """
+    if spec is None:
+        yield []
+        return
+    flags = ["--bwlimit", split_timetable(parse_timetable(spec), active_jobs() + num_jobs)]
+    job_file = register_job(os.getpid(), jobs=num_jobs)
+    try:
+        yield flags
+    finally:
+        os.remove(job_file)
+
+
+def mount_flags(spec: Optional[str]) -> List[str]:
+    """Return the --bwlimit flags for a new mount to take its share of the bandwidth policy.
+
+    Unlike transfers, mounts outlive the wrapper, so their share is fixed when mounting,
+    as a timetable following the policy's time-of-day slots.
+    """
+    if spec is None:
+        return []
+    return ["--bwlimit", split_timetable(parse_timetable(spec), active_jobs() + 1)]
@@ -0,0 +1,61 @@
+"""utilities for running rclone operations on an explicit list of files"""
+
+import logging
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def files_from(relative_paths: Iterable[str]) -> Iterator[str]:
+    """Yield the path of a temporary file listing `relative_paths`, one per line."""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8") as f:
+        f.writelines(f"{path}\n" for path in relative_paths)
+        f.flush()
+        yield f.name
+
+
+def copy_files_from(
+    src_root: str,
+    dst: str,
+    relative_paths: Iterable[str],
+    flags: Sequence[str] = (),
+    *,
+    progress: bool = True,
+) -> None:
+    """Copy only `relative_paths` (relative to `src_root`) into `dst` with one rclone call.
+
+    `flags` are passed on to `rclone copy`. Without `progress`, rclone's log is not
+    interleaved with a progress display on stdout, and stays on stderr.
+    """
+    with files_from(relative_paths) as list_file:
+        subprocess.run(
+            [
+                "rclone",
+                "copy",
+                *(["--progress"] if progress else []),
+                "--checksum",
+                "--files-from",
+                list_file,
+                *flags,
+                src_root,
+                dst,
+            ],
+            check=True,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+
+def delete_files_from(root: str, relative_paths: Iterable[str]) -> None:
+    """Delete only `relative_paths` (relative to `root`) with one rclone call."""
+    with files_from(relative_paths) as list_file:
+        subprocess.run(
+            ["rclone", "delete", "--files-from", list_file, root],
+            check=True,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
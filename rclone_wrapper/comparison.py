@@ -3,26 +3,63 @@
 import logging
 import subprocess
 from datetime import datetime
+from typing import List, Optional
+
+from rclone_wrapper.deduplication import local_hashes
+from rclone_wrapper.indexing import RemoteIndex
+from rclone_wrapper.listing import Listing
 
 logger = logging.getLogger(__name__)
 
 
-def compare_folders(folder1: str, folder2: str) -> bool:
+def _compare_with_index(local_folder: str, remote_folder: str, index: RemoteIndex) -> List[str]:
+    """Return the differences between a local folder and its indexed remote counterpart.
+
+    Differences are reported like `rclone check --combined`: '- path' is missing on the
+    remote, '+ path' is missing locally and '* path' differs in content. The remote files
+    are read into a compact `Listing`, and only the differences are sorted.
+    """
+    prefix = remote_folder.partition(":")[2].strip("/")
+    local = local_hashes(local_folder, index.hash_type)
+    remote = Listing()
+    for entry in index.files(prefix):
+        remote.add(entry.path[len(prefix) :].lstrip("/"), entry.size, 0.0, False, entry.hash)
+    differences: List[str] = []
+    for path, file_hash in local.items():
+        row = remote.row(path)
+        if row is None:
+            differences.append(f"- {path}")
+        elif remote.file_hash(row) != file_hash:
+            differences.append(f"* {path}")
+    differences += [f"+ {path}" for path in remote.paths() if path not in local]
+    return sorted(differences, key=lambda difference: difference[2:])
+
+
+def compare_folders(folder1: str, folder2: str, index: Optional[RemoteIndex] = None) -> bool:
     """
     Compare two folders (local or remote) using rclone check with --checksum.
     Returns True if the folders are identical, False if differences are detected.
     If differences are detected and diff_file is provided, the output is stored in that file.
+    If an index of the remote of folder2 is given, folder1 must be local and its hashes are
+    compared against the index instead of re-listing the remote.
     """
     current_time = datetime.now().strftime("%Y%m%dT%H%M%S")
     diff_file = f"results/{current_time}_comparison.txt"
     command = ["rclone", "check", folder1, folder2, "--checksum"]
     try:
-        result = subprocess.run(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False
-        )
+        if index is not None:
+            differences = _compare_with_index(folder1, folder2, index)
+            identical = not differences
+            stdout, stderr = "\n".join(differences), ""
+        else:
+            result = subprocess.run(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False
+            )
+            identical = result.returncode == 0
+            stdout, stderr = result.stdout, result.stderr
 
         # no diff branch
-        if result.returncode == 0:
+        if identical:
             logger.info("Folders '%s' and '%s' are identical.", folder1, folder2)
             return True
 
@@ -33,9 +70,9 @@ def compare_folders(folder1: str, folder2: str) -> bool:
             f.write(f"Folder 1: {folder1}\n")
             f.write(f"Folder 2: {folder2}\n")
             f.write("STDOUT:\n")
-            f.write(result.stdout)
+            f.write(stdout)
             f.write("\nSTDERR:\n")
-            f.write(result.stderr)
+            f.write(stderr)
         logger.info("Differences stored in '%s'.", diff_file)
         return False
 
@@ -0,0 +1,197 @@
+"""utilities for serving the wrapper's commands from a long-lived local daemon"""
+
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, TextIO
+
+from rclone_wrapper.navigation import clear_caches
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = "cache/rclone_wrapper.sock"
+CACHE_TTL = 60.0  # seconds cached listings are kept for
+MAX_TRANSFERS = 2  # transfers run at once, later ones wait for a free slot
+TRANSFER_COMMANDS = ("upload", "download", "sync", "fanout", "execute")
+
+# a message to the client: {"out": stdout text}, {"log": log line} or {"exit": exit code}
+Send = Callable[[Dict[str, Any]], None]
+
+_request = threading.local()  # `send` of the request served by the current thread, if any
+
+
+class _ThreadStdout(io.TextIOBase):
+    """Stdout sending what a request's thread prints to its client, and the rest to `stdout`."""
+
+    def __init__(self, stdout: TextIO) -> None:
+        super().__init__()
+        self.stdout = stdout
+
+    def write(self, text: str) -> int:  # type: ignore[override]
+        send: Optional[Send] = getattr(_request, "send", None)
+        if send is None:
+            return self.stdout.write(text)
+        send({"out": text})
+        return len(text)
+
+    def flush(self) -> None:
+        self.stdout.flush()
+
+
+class _ForwardHandler(logging.Handler):
+    """Logging handler sending the records of one thread to its client."""
+
+    def __init__(self, send: Send) -> None:
+        super().__init__()
+        self.send = send
+        self.thread = threading.get_ident()
+        self.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.thread == self.thread:
+            self.send({"log": self.format(record)})
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serve one command: read its argv as a JSON line, stream back its output and exit code."""
+
+    server: "_Server"
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        try:
+            self.wfile.write(json.dumps(message).encode() + b"\n")
+            self.wfile.flush()
+        except OSError:
+            pass  # the client went away, the command still runs to completion
+
+    def handle(self) -> None:
+        try:
+            argv = [str(arg) for arg in json.loads(self.rfile.readline())["argv"]]
+        except (ValueError, KeyError, TypeError):
+            self._send({"log": "ERROR - Malformed request."})
+            self._send({"exit": 2})
+            return
+        self._send({"exit": self.server.dispatch(argv, self._send)})
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server running each command in its own thread, within the same process.
+
+    Config, listing caches and the rclone job registry are thus shared between commands.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, run: Callable[[List[str]], int]) -> None:
+        super().__init__(socket_path, _RequestHandler)
+        self.run = run
+        self.transfers = threading.BoundedSemaphore(MAX_TRANSFERS)
+
+    def _run_transfer(self, argv: List[str]) -> int:
+        # pylint: disable=consider-using-with  # released below, once the transfer ended
+        if not self.transfers.acquire(blocking=False):
+            logger.info("%d transfers already running, waiting for one to end...", MAX_TRANSFERS)
+            self.transfers.acquire()
+        try:
+            return self.run(argv)
+        finally:
+            self.transfers.release()
+            clear_caches()  # the remote changed
+
+    def dispatch(self, argv: List[str], send: Send) -> int:
+        """Run the command `argv` with its output and logs sent along, return its exit code."""
+        handler = _ForwardHandler(send)
+        logging.getLogger().addHandler(handler)
+        _request.send = send
+        try:
+            if argv and argv[0] in TRANSFER_COMMANDS:
+                return self._run_transfer(argv)
+            return self.run(argv)
+        except SystemExit as exc:  # e.g. argparse errors
+            return exc.code if isinstance(exc.code, int) else 1
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Command %s failed.", argv)
+            return 1
+        finally:
+            _request.send = None
+            logging.getLogger().removeHandler(handler)
+
+
+def _expire_caches(stop: threading.Event) -> None:
+    while not stop.wait(CACHE_TTL):
+        clear_caches()
+
+
+def is_running(socket_path: str = SOCKET_PATH) -> bool:
+    """Return True if a daemon is accepting connections on `socket_path`."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+
+
+def serve(run: Callable[[List[str]], int], socket_path: str = SOCKET_PATH) -> None:
+    """Serve commands on the Unix socket `socket_path` until interrupted.
+
+    `run` runs the command of an argv and returns its exit code. Transfers (see
+    TRANSFER_COMMANDS) wait for one of MAX_TRANSFERS slots, and cached listings are
+    forgotten after each of them and every CACHE_TTL seconds.
+    """
+    if is_running(socket_path):
+        logger.error("A daemon is already running on '%s'.", socket_path)
+        return
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # left over by a daemon that was killed
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+
+    stdout = sys.stdout
+    sys.stdout = _ThreadStdout(stdout)  # type: ignore[assignment]
+    stop = threading.Event()
+    threading.Thread(target=_expire_caches, args=(stop,), daemon=True).start()
+    try:
+        with _Server(socket_path, run) as server:
+            logger.info("Serving on '%s'...", socket_path)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                logger.info("Stopped serving on '%s'.", socket_path)
+    finally:
+        stop.set()
+        sys.stdout = stdout
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def forward(argv: Sequence[str], socket_path: str = SOCKET_PATH) -> Optional[int]:
+    """Run the command `argv` on the daemon and return its exit code.
+
+    Its output is printed to stdout and its logs to stderr, as they arrive. Returns None if
+    no daemon is running, for the caller to run the command itself.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        try:
+            sock.sendall(json.dumps({"argv": list(argv)}).encode() + b"\n")
+            with sock.makefile("r", encoding="utf-8") as responses:
+                for line in responses:
+                    message = json.loads(line)
+                    if "out" in message:
+                        sys.stdout.write(message["out"])
+                    elif "log" in message:
+                        print(message["log"], file=sys.stderr)
+                    else:
+                        return int(message["exit"])
+        except ConnectionError:
+            pass  # the daemon was stopped
+    logger.error("The daemon closed the connection before the command ended.")
+    return 1
@@ -0,0 +1,165 @@
+"""utilities for skipping re-uploads of content that already exists on the remote"""
+
+import functools
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from rclone_wrapper.batching import copy_files_from
+from rclone_wrapper.indexing import RemoteIndex
+from rclone_wrapper.listing import iter_lsjson, join_path
+
+logger = logging.getLogger(__name__)
+
+COPY_WORKERS = 8  # server-side copy calls run at once, as each mostly waits on the remote
+
+
+def local_hashes(local_path: str, hash_type: str = "md5") -> Dict[str, str]:
+    """Return a {relative path: hash} mapping for the local file/dir at `local_path`.
+
+    Paths are relative to `local_path` if it is a dir, or to its parent if it is a file.
+    """
+    command = ["rclone", "hashsum", hash_type, local_path]
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+        )
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "Failed to hash '%s': %s",
+            local_path,
+            exc.stderr.strip() if exc.stderr else "Unknown error",
+        )
+        raise
+
+    hashes: Dict[str, str] = {}
+    for line in result.stdout.splitlines():
+        if not line.strip():
+            continue
+        file_hash, relative_path = line.split("  ", 1)
+        hashes[relative_path] = file_hash.lower()
+    return hashes
+
+
+def remote_hash_index(
+    remote_root: str, hash_type: str = "md5", index: Optional[RemoteIndex] = None
+) -> Mapping[str, str]:
+    """Return a {hash: relative path} mapping of every file under `remote_root`.
+
+    `remote_root` is a full rclone path, e.g. 'gdrive:datasets'. Only the first path
+    seen for each hash is kept, since any copy is as good a server-side source as another.
+    If an index of the remote (with the same hash type) is given, the mapping looks hashes
+    up in it instead of being loaded.
+    """
+    remote, _, path = remote_root.partition(":")
+    if index is not None and index.remote == remote and index.hash_type == hash_type.lower():
+        return index.hash_index(path)
+
+    entries = iter_lsjson(remote_root, "-R", "--files-only", "--hash", "--hash-type", hash_type)
+    hash_to_path: Dict[str, str] = {}
+    for entry in entries:
+        file_hash = (entry.get("Hashes") or {}).get(hash_type.lower())
+        if file_hash:
+            hash_to_path.setdefault(file_hash.lower(), entry["Path"])
+    return hash_to_path
+
+
+def server_side_copy(src: str, dst: str) -> None:
+    """Copy a single remote object to another path on the same remote without re-uploading."""
+    try:
+        subprocess.run(
+            ["rclone", "copyto", src, dst],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "Failed to copy '%s' to '%s': %s",
+            src,
+            dst,
+            exc.stderr.strip() if exc.stderr else "Unknown error",
+        )
+        raise
+
+
+def _split(path: str) -> Tuple[str, str]:
+    """Split an rclone path into its parent dir and name, e.g. 'gdrive:a/b' -> 'gdrive:a', 'b'."""
+    parent, sep, name = path.rpartition("/")
+    if not sep:
+        remote, _, name = path.partition(":")
+        parent = f"{remote}:"
+    return parent, name
+
+
+def server_side_copies(copies: Sequence[Tuple[str, str]]) -> None:
+    """Server-side copy many (remote source, remote destination) objects.
+
+    Copies keeping their name are grouped per (source dir, destination dir), and each group
+    is copied with one `rclone copy --files-from`; renamed copies each need an `rclone
+    copyto`. These calls then run COPY_WORKERS at a time.
+    """
+    groups: Dict[Tuple[str, str], List[str]] = {}
+    calls: List[Callable[[], None]] = []
+    for src, dst in copies:
+        (src_dir, src_name), (dst_dir, dst_name) = _split(src), _split(dst)
+        if src_name == dst_name:
+            groups.setdefault((src_dir, dst_dir), []).append(src_name)
+        else:
+            calls.append(functools.partial(server_side_copy, src, dst))
+    calls += [
+        functools.partial(copy_files_from, src_dir, dst_dir, names)
+        for (src_dir, dst_dir), names in groups.items()
+    ]
+    with ThreadPoolExecutor(COPY_WORKERS) as pool:
+        for future in [pool.submit(call) for call in calls]:
+            future.result()
+
+
+def copy_deduplicated(  # pylint: disable=too-many-arguments
+    local_path: str,
+    target: str,
+    index_root: str,
+    hash_type: str = "md5",
+    *,
+    index: Optional[RemoteIndex] = None,
+    flags: Sequence[str] = (),
+    hashes: Optional[Mapping[str, str]] = None,
+) -> Tuple[int, int]:
+    """Copy `local_path` into the remote `target`, re-using content already on the remote.
+
+    Files whose hash already exists under `index_root` are server-side copied from there.
+    Of the rest, each distinct content is uploaded once and its duplicates are then
+    server-side copied from the uploaded object (in batches, see `server_side_copies`).
+
+    `flags` are passed on to the `rclone copy` uploading the new content. `hashes` are
+    the {relative path: hash} of `local_path` if already computed (see `local_hashes`).
+
+    Returns the number of (uploaded, server-side copied) files.
+    """
+    if hashes is None:
+        hashes = local_hashes(local_path, hash_type)
+    known = remote_hash_index(index_root, hash_type, index)
+    src_root = local_path if os.path.isdir(local_path) else os.path.dirname(local_path)
+
+    to_upload: Dict[str, str] = {}  # hash -> relative path, the single upload per content
+    to_copy: List[Tuple[str, str]] = []  # (remote source, relative destination path)
+    for relative_path, file_hash in sorted(hashes.items()):
+        if file_hash in known:
+            to_copy.append((join_path(index_root, known[file_hash]), relative_path))
+        elif file_hash in to_upload:
+            to_copy.append((join_path(target, to_upload[file_hash]), relative_path))
+        else:
+            to_upload[file_hash] = relative_path
+
+    if to_upload:
+        logger.info("Uploading %d file(s) with new content to '%s'...", len(to_upload), target)
+        copy_files_from(src_root, target, sorted(to_upload.values()), flags)
+
+    server_side_copies([(src, join_path(target, path)) for src, path in to_copy])
+    logger.info("Server-side copied %d file(s) already present on the remote.", len(to_copy))
+
+    return len(to_upload), len(to_copy)
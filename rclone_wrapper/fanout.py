@@ -0,0 +1,228 @@
+"""utilities for uploading to several remotes at once, reading the local source only once"""
+
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import IO, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple, cast
+
+from rclone_wrapper.bandwidth import fixed_shares
+from rclone_wrapper.listing import join_path
+from rclone_wrapper.transferring import _validate_remote_destination
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MAX_QUEUED_CHUNKS = 16  # per destination, bounding memory when one destination is slower
+FILE_WORKERS = 4  # files fanned out at once, overlapping the startup of their rclone calls
+
+
+class DestinationReport(NamedTuple):
+    """Outcome of a fan-out upload for one destination remote."""
+
+    remote: str
+    target: str  # rclone path the source was uploaded to
+    files: int  # number of files uploaded
+    bytes: int  # number of bytes uploaded
+    failed: Dict[str, str]  # {path relative to the source: error}
+
+
+class _Stream(threading.Thread):
+    """Thread piping queued chunks of one file into an `rclone rcat` to one destination."""
+
+    def __init__(self, command: List[str]) -> None:
+        super().__init__(name="rclone-wrapper-fanout", daemon=True)
+        self.chunks: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=MAX_QUEUED_CHUNKS)
+        self.stderr = tempfile.TemporaryFile("w+")
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            command, stdin=subprocess.PIPE, stderr=self.stderr, text=False
+        )
+
+    def run(self) -> None:
+        stdin = cast(IO[bytes], self.process.stdin)
+        broken = False
+        # keep draining the queue after rclone exited, so the reader never blocks on it
+        for chunk in iter(self.chunks.get, None):
+            if not broken:
+                try:
+                    stdin.write(chunk)
+                except BrokenPipeError:
+                    broken = True
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass  # rclone failed, its exit status tells why
+
+    def finish(self) -> Optional[str]:
+        """Wait for the upload to end and return its error, or None if it succeeded."""
+        self.join()
+        returncode = self.process.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read().strip()
+        self.stderr.close()
+        if returncode == 0:
+            return None
+        return stderr or f"rclone exited with status {returncode}"
+
+
+class _SourceFile(NamedTuple):
+    """File of a fan-out source."""
+
+    path: str  # relative to the source's root
+    size: int
+    modtime: str  # RFC 3339, as rclone's `mtime` metadata
+
+
+def _source_file(root: str, path: str) -> _SourceFile:
+    """Stat the file at `path` relative to `root`."""
+    stat = os.stat(os.path.join(root, path))
+    modtime = datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()
+    return _SourceFile(path, stat.st_size, modtime)
+
+
+def _source_files(local_path: str) -> Tuple[str, List[_SourceFile]]:
+    """Return the dir the source's files are relative to, and the files."""
+    if os.path.isfile(local_path):
+        root = os.path.dirname(local_path)
+        return root, [_source_file(root, os.path.basename(local_path))]
+    files = []
+    for dir_path, _, file_names in os.walk(local_path):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            files.append(_source_file(local_path, os.path.relpath(path, local_path)))
+    return local_path, sorted(files)
+
+
+def _fan_out_file(
+    path: str, source: _SourceFile, targets: Dict[str, str], flags: List[str]
+) -> Dict[str, str]:
+    """Read the file at `path` once, streaming it to every {remote: rclone path} concurrently.
+
+    rcat would stamp the uploads with the time they were made, so the local modtime is set
+    as their `mtime` metadata. Returns the error of every remote the file failed to upload to.
+    """
+    rcat = ["rclone", "rcat", "--size", str(source.size)]
+    rcat += ["--metadata", "--metadata-set", f"mtime={source.modtime}", *flags]
+    streams = {remote: _Stream([*rcat, target]) for remote, target in targets.items()}
+    for stream in streams.values():
+        stream.start()
+    read_error = None
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                for stream in streams.values():
+                    stream.chunks.put(chunk)
+    except OSError as exc:
+        read_error = f"Could not read '{path}': {exc}"  # rclone fails on the missing bytes
+    finally:
+        for stream in streams.values():
+            stream.chunks.put(None)
+    errors = {remote: stream.finish() for remote, stream in streams.items()}
+    if read_error is not None:
+        return {remote: read_error for remote in streams}
+    return {remote: error for remote, error in errors.items() if error is not None}
+
+
+def _upload_files(
+    src_root: str,
+    files: List[_SourceFile],
+    reports: Dict[str, DestinationReport],
+    flags: List[str],
+) -> None:
+    """Fan out the files of `src_root`, FILE_WORKERS at once, updating `reports` in place.
+
+    Results are recorded in the order of `files`, with at most FILE_WORKERS of them pending.
+    """
+    pending: Deque[Tuple[int, _SourceFile, "Future[Dict[str, str]]"]] = deque()
+
+    def record() -> None:
+        number, source, future = pending.popleft()
+        errors = future.result()
+        for remote, report in reports.items():
+            if remote in errors:
+                report.failed[source.path] = errors[remote]
+                logger.error(
+                    "Failed to upload '%s' to '%s': %s", source.path, remote, errors[remote]
+                )
+            else:
+                reports[remote] = report._replace(
+                    files=report.files + 1, bytes=report.bytes + source.size
+                )
+        logger.info("[%d/%d] %s (%d bytes)", number, len(files), source.path, source.size)
+
+    with ThreadPoolExecutor(FILE_WORKERS) as pool:
+        for number, source in enumerate(files, start=1):
+            targets = {remote: join_path(r.target, source.path) for remote, r in reports.items()}
+            future = pool.submit(
+                _fan_out_file, os.path.join(src_root, source.path), source, targets, flags
+            )
+            pending.append((number, source, future))
+            if len(pending) >= FILE_WORKERS:
+                record()
+        while pending:
+            record()
+
+
+def _validate_destinations(remote_path: str, local_path: str, remotes: Sequence[str]) -> bool:
+    """Return True if the destination is valid for uploading on every remote."""
+    invalid = [
+        remote
+        for remote in remotes
+        if not _validate_remote_destination(remote_path, local_path, remote)
+    ]
+    if invalid:
+        logger.error("Aborting, invalid destination(s) on: %s", ", ".join(invalid))
+    return not invalid
+
+
+def upload_to_remotes(
+    remote_path: str, local_path: str, remotes: Sequence[str], *, bandwidth: Optional[str] = None
+) -> Optional[Dict[str, DestinationReport]]:
+    """Upload a local file/dir into remote_path on each of `remotes`, reading it only once.
+
+    Like `upload`, the source is copied under its basename. Every destination is validated
+    before anything is transferred. Each file is then read once and streamed to all the
+    remotes concurrently with `rclone rcat`, FILE_WORKERS files at once. A file failing on
+    one remote does not stop the others. Returns a report per remote, or None if aborted.
+
+    Abort if:
+    * local_path does not exist.
+    * a dir as remote_path does not exist on one of the remotes.
+    * a file/dir with the same name as local_path already exists under one of them.
+    """
+    if not os.path.exists(local_path):
+        logger.error("Source '%s' does not exist.", local_path)
+        return None
+    if not _validate_destinations(remote_path, local_path, remotes):
+        return None
+
+    src_root, files = _source_files(local_path)
+    target_path = remote_path.rstrip("/")
+    if os.path.isdir(local_path):
+        target_path = f"{target_path}/{os.path.basename(os.path.normpath(local_path))}"
+    reports = {
+        remote: DestinationReport(remote, f"{remote}:{target_path}", 0, 0, {}) for remote in remotes
+    }
+
+    logger.info(
+        "Uploading '%s' to %s...", local_path, ", ".join(r.target for r in reports.values())
+    )
+    # every file being fanned out streams to each remote
+    streams = len(remotes) * min(FILE_WORKERS, len(files))
+    with fixed_shares(bandwidth, max(streams, 1)) as flags:
+        _upload_files(src_root, files, reports, flags)
+
+    for report in reports.values():
+        logger.info(
+            "'%s': %d file(s), %d bytes uploaded, %d failed.",
+            report.target,
+            report.files,
+            report.bytes,
+            len(report.failed),
+        )
+    return reports
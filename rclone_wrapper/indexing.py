@@ -0,0 +1,277 @@
+"""utilities for keeping a local, incrementally refreshed index of remote objects"""
+
+import logging
+import os
+import sqlite3
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from rclone_wrapper.listing import iter_lsjson, join_path
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = "cache"
+UPSERT_BATCH = 10000  # rows written per transaction while a listing streams in
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modtime TEXT NOT NULL,
+    hash TEXT,
+    is_dir INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_parent ON objects (parent);
+CREATE INDEX IF NOT EXISTS objects_hash ON objects (hash);
+CREATE INDEX IF NOT EXISTS objects_name ON objects (name);
+"""
+
+# (path, parent, size, modtime, hash, is_dir, case-folded name)
+_Row = Tuple[str, str, int, str, Any, int, str]
+
+
+class IndexEntry(NamedTuple):
+    """A remote object as recorded in the index; `path` is relative to the remote root."""
+
+    path: str
+    size: int
+    modtime: str
+    hash: Optional[str]
+    is_dir: bool
+
+
+def _parent(path: str) -> str:
+    return path.rpartition("/")[0]
+
+
+def _folded_name(path: str) -> str:
+    return path.rpartition("/")[2].casefold()
+
+
+def _under(prefix: str) -> Tuple[str, List[str]]:
+    """Return a SQL condition and its parameters matching every path below `prefix`.
+
+    Paths below 'a' sort from 'a/' up to (excluding) 'a0', '0' following '/': unlike LIKE,
+    the range is case-sensitive, as remotes are, and is looked up in the primary key.
+    """
+    if not prefix:
+        return "path <> ''", []
+    return "path >= ? AND path < ?", [f"{prefix}/", f"{prefix}0"]
+
+
+class RemoteIndex:
+    """Local SQLite index of the objects (path, size, modtime, hash) of one rclone remote.
+
+    The index is refreshed incrementally: a dir is only re-listed if it is new, or if its
+    modtime moved since the last refresh. The first refresh of a path, or a full one (see
+    `refresh`), lists it recursively in a single rclone call instead. The case-folded name
+    of each object is indexed too, for name searches (see `by_name`).
+    """
+
+    def __init__(self, remote: str, db_path: Optional[str] = None, hash_type: str = "md5") -> None:
+        if db_path is None:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            db_path = os.path.join(INDEX_DIR, f"{remote}.sqlite")
+        self.remote = remote
+        self.hash_type = hash_type.lower()
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._conn.close()
+
+    def refresh(self, path: str = "", *, full: bool = False) -> None:
+        """Bring the index of the remote dir `path` (and below) up to date.
+
+        A dir's modtime only moves when its direct entries are added, removed or renamed,
+        so an incremental refresh misses files overwritten in place and changes further
+        down: it is only good enough for advisory lookups such as `search`. With `full`,
+        the whole subtree is re-listed in one recursive call instead, which dedup lookups
+        and comparisons need since they trust the indexed hashes.
+
+        The entry of `path` itself is refreshed too, from a listing of its parent, so that
+        a refreshed sub-path is known to exist. Each dir (or batch of a recursive listing)
+        is committed on its own, so the database is never locked while rclone lists.
+        """
+        path = path.strip("/")
+        logger.info("Refreshing index of '%s:%s'...", self.remote, path)
+        if path and not self._refresh_entry(path):
+            logger.warning("'%s:%s' is not a dir, nothing to index below it.", self.remote, path)
+        elif full or self._is_empty(path):
+            self._list_recursively(path)
+        else:
+            self._refresh_dir(path)
+        logger.info("Index of '%s:%s' is up to date.", self.remote, path)
+
+    def _is_empty(self, path: str) -> bool:
+        row = self._conn.execute("SELECT 1 FROM objects WHERE parent = ? LIMIT 1", (path,))
+        return row.fetchone() is None
+
+    def _refresh_entry(self, path: str) -> bool:
+        """Upsert the entry of `path` from a listing of its parent, return True if it is a dir.
+
+        If `path` is gone from its parent, it is dropped from the index with everything below.
+        """
+        parent = _parent(path)
+        rows = [self._row(parent, entry) for entry in self._list(parent)]
+        with self._conn:
+            for row in rows:
+                if row[0] == path:
+                    self._upsert([row])
+                    return bool(row[5])
+            self._delete_tree(path)
+        return False
+
+    def _list(self, path: str, *flags: str) -> Iterator[Dict[str, Any]]:
+        return iter_lsjson(f"{self.remote}:{path}", "--hash", "--hash-type", self.hash_type, *flags)
+
+    def _row(self, path: str, entry: Dict[str, Any]) -> _Row:
+        full_path = join_path(path, entry["Path"]) if path else entry["Path"]
+        file_hash = (entry.get("Hashes") or {}).get(self.hash_type)
+        return (
+            full_path,
+            _parent(full_path),
+            max(int(entry.get("Size", 0)), 0),
+            entry.get("ModTime", ""),
+            file_hash.lower() if file_hash else None,
+            int(bool(entry.get("IsDir"))),
+            _folded_name(full_path),
+        )
+
+    def _upsert(self, rows: List[_Row]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO objects (path, parent, size, modtime, hash, is_dir, name) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def _delete_tree(self, path: str) -> None:
+        condition, params = _under(path)
+        self._conn.execute(f"DELETE FROM objects WHERE {condition}", params)
+        self._conn.execute("DELETE FROM objects WHERE path = ?", (path,))
+
+    def _list_recursively(self, path: str) -> None:
+        # rows are written in batches as the listing streams in, never holding it in memory;
+        # listed paths are kept in a temporary table, to then drop the rows no longer listed
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS listed (path TEXT PRIMARY KEY)")
+        with self._conn:
+            self._conn.execute("DELETE FROM listed")
+        entries = iter(self._list(path, "-R", "--fast-list"))
+        while rows := [self._row(path, entry) for entry in islice(entries, UPSERT_BATCH)]:
+            with self._conn:
+                self._upsert(rows)
+                self._conn.executemany(
+                    "INSERT INTO listed (path) VALUES (?)", ((row[0],) for row in rows)
+                )
+        condition, params = _under(path)
+        with self._conn:
+            self._conn.execute(
+                f"DELETE FROM objects WHERE {condition} "
+                "AND path NOT IN (SELECT path FROM temp.listed)",
+                params,
+            )
+
+    def _refresh_dir(self, path: str) -> None:
+        listed = {row[0]: row for row in (self._row(path, entry) for entry in self._list(path))}
+        known = {
+            row[0]: row[1]
+            for row in self._conn.execute(
+                "SELECT path, modtime FROM objects WHERE parent = ?", (path,)
+            )
+        }
+        with self._conn:
+            for gone in known.keys() - listed.keys():
+                self._delete_tree(gone)
+            self._upsert(list(listed.values()))
+        for child_path, row in listed.items():
+            if not row[5]:
+                continue
+            if child_path not in known:
+                self._list_recursively(child_path)
+            elif known[child_path] != row[3]:
+                self._refresh_dir(child_path)
+
+    def get(self, path: str) -> Optional[IndexEntry]:
+        """Return the indexed entry at `path`, or None if it is not in the index."""
+        row = self._conn.execute(
+            "SELECT path, size, modtime, hash, is_dir FROM objects WHERE path = ?",
+            (path.strip("/"),),
+        ).fetchone()
+        return IndexEntry(row[0], row[1], row[2], row[3], bool(row[4])) if row else None
+
+    def exists(self, path: str, mode: str) -> bool:
+        """Return True if `path` is indexed, as a dir if mode is 'dir', else as anything."""
+        if not path.strip("/"):
+            return True
+        entry = self.get(path)
+        return entry is not None and (mode != "dir" or entry.is_dir)
+
+    def entries(self, prefix: str = "") -> Iterator[IndexEntry]:
+        """Yield every indexed file and dir below the dir `prefix`, sorted by path."""
+        condition, params = _under(prefix.strip("/"))
+        rows = self._conn.execute(
+            "SELECT path, size, modtime, hash, is_dir FROM objects "
+            f"WHERE {condition} ORDER BY path",
+            params,
+        )
+        for row in rows:
+            yield IndexEntry(row[0], row[1], row[2], row[3], bool(row[4]))
+
+    def by_name(self, name_prefix: str = "", prefix: str = "") -> Iterator[IndexEntry]:
+        """Yield the entries below the dir `prefix` whose name starts with `name_prefix`.
+
+        Names are compared case-folded, and their range is looked up in the SQL index of
+        names, so a long prefix only reads the few matching rows. Sorted by path.
+        """
+        condition, params = _under(prefix.strip("/"))
+        query = f"SELECT path, size, modtime, hash, is_dir FROM objects WHERE {condition}"
+        if name_prefix:
+            # every name starting with the prefix sorts before the prefix followed by U+10FFFF
+            query += " AND name >= ? AND name < ?"
+            params += [name_prefix.casefold(), name_prefix.casefold() + "\U0010ffff"]
+        for row in self._conn.execute(f"{query} ORDER BY path", params):
+            yield IndexEntry(row[0], row[1], row[2], row[3], bool(row[4]))
+
+    def files(self, prefix: str = "") -> Iterator[IndexEntry]:
+        """Yield every indexed file below the dir `prefix`, sorted by path."""
+        return (entry for entry in self.entries(prefix) if not entry.is_dir)
+
+    def hash_index(self, prefix: str = "") -> Mapping[str, str]:
+        """Return a {hash: path relative to `prefix`} mapping of the files below `prefix`.
+
+        The mapping is looked up in the SQL index of hashes as it is read, instead of
+        being loaded: each hash maps to the first of its paths.
+        """
+        return _HashIndex(self._conn, prefix.strip("/"))
+
+
+class _HashIndex(Mapping[str, str]):
+    """{hash: relative path} of the indexed files below a prefix, read from SQL on access."""
+
+    def __init__(self, conn: sqlite3.Connection, prefix: str) -> None:
+        self.conn = conn
+        self.prefix = prefix
+        condition, self.params = _under(prefix)
+        self.where = f"is_dir = 0 AND hash IS NOT NULL AND {condition}"
+
+    def __getitem__(self, file_hash: str) -> str:
+        row = self.conn.execute(
+            f"SELECT path FROM objects WHERE hash = ? AND {self.where} ORDER BY path LIMIT 1",
+            [file_hash, *self.params],
+        ).fetchone()
+        if row is None:
+            raise KeyError(file_hash)
+        return str(row[0])[len(self.prefix) :].lstrip("/")
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.conn.execute(
+            f"SELECT DISTINCT hash FROM objects WHERE {self.where}", self.params
+        )
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        query = f"SELECT COUNT(DISTINCT hash) FROM objects WHERE {self.where}"
+        return int(self.conn.execute(query, self.params).fetchone()[0])
@@ -0,0 +1,259 @@
+"""utilities for listing local/remote paths using rclone"""
+
+import json
+import logging
+import re
+import subprocess
+import sys
+import tempfile
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def join_path(root: str, relative_path: str) -> str:
+    """Join a path relative to `root`, where `root` may be a bare remote such as 'gdrive:'."""
+    if not relative_path:
+        return root
+    if root.endswith(":"):
+        return f"{root}{relative_path}"
+    return f"{root.rstrip('/')}/{relative_path}"
+
+
+def lsjson(path: str, *flags: str) -> List[Dict[str, Any]]:
+    """Return the parsed output of `rclone lsjson` for `path` (local or remote)."""
+    command = ["rclone", "lsjson", path, *flags]
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+        )
+        entries: List[Dict[str, Any]] = json.loads(result.stdout or "[]")
+        return entries
+
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "Failed to list '%s': %s", path, exc.stderr.strip() if exc.stderr else "Unknown error"
+        )
+        raise
+
+    except (FileNotFoundError, PermissionError) as exc:
+        logger.error("Error running rclone for '%s': %s", path, exc)
+        raise
+
+
+def iter_lsjson(path: str, *flags: str) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of `rclone lsjson` for `path` one at a time, as rclone prints them.
+
+    Unlike `lsjson`, the output is never held in memory as a whole: rclone prints one entry
+    per line, and each line is parsed as soon as it is read.
+    """
+    command = ["rclone", "lsjson", path, *flags]
+    try:
+        with (
+            tempfile.TemporaryFile("w+") as stderr,
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True) as process,
+        ):
+            for line in process.stdout or ():
+                line = line.strip().rstrip(",")
+                if line not in ("", "[", "]"):
+                    yield json.loads(line)
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(
+                    process.returncode, command, stderr=stderr.read()
+                )
+
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "Failed to list '%s': %s", path, exc.stderr.strip() if exc.stderr else "Unknown error"
+        )
+        raise
+
+    except (FileNotFoundError, PermissionError) as exc:
+        logger.error("Error running rclone for '%s': %s", path, exc)
+        raise
+
+
+def parse_modtime(modtime: str) -> float:
+    """Parse an rclone ModTime (RFC 3339, up to nanosecond precision) into a timestamp."""
+    modtime = re.sub(r"(\.\d{6})\d+", r"\1", modtime.replace("Z", "+00:00"))
+    return datetime.fromisoformat(modtime).timestamp()
+
+
+class ListingEntry:  # pylint: disable=too-few-public-methods
+    """A listed object, materialised from a `Listing` row only when accessed."""
+
+    __slots__ = ("path", "size", "modtime", "is_dir", "hash")
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        path: str,
+        size: int,
+        modtime: float,
+        is_dir: bool,
+        hash: Optional[str] = None,  # pylint: disable=redefined-builtin
+    ) -> None:
+        self.path = path
+        self.size = size  # -1 if unknown, e.g. for Google Docs
+        self.modtime = modtime  # timestamp, 0 if not listed
+        self.is_dir = is_dir
+        self.hash = hash  # lowercase, None if not listed or not available
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ListingEntry):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"ListingEntry({fields})"
+
+
+def _pack_hash(file_hash: Optional[str]) -> Union[bytes, str, None]:
+    """Store a hex hash as its raw bytes, half the size (other hashes are kept as is)."""
+    if not file_hash:
+        return None
+    try:
+        return bytes.fromhex(file_hash)
+    except ValueError:
+        return file_hash.lower()
+
+
+def _unpack_hash(packed: Union[bytes, str, None]) -> Optional[str]:
+    return packed.hex() if isinstance(packed, bytes) else packed
+
+
+class Listing:  # pylint: disable=too-many-instance-attributes
+    """Column-wise store of `lsjson` entries, compact enough for millions of objects.
+
+    Instead of one dict per entry, sizes and modtimes are kept in typed arrays, dir flags in
+    a bytearray, hashes as raw bytes and paths as an id into a table of interned dir
+    prefixes plus a name, so each dir prefix is stored once however many objects it holds.
+    Paths are looked up through a {name: row} table per prefix, which shares the names.
+    """
+
+    def __init__(
+        self, entries: Iterable[Dict[str, Any]] = (), hash_type: Optional[str] = None
+    ) -> None:
+        self.hash_type = hash_type.lower() if hash_type else None
+        self._prefix_ids: Dict[str, int] = {}
+        self._prefixes: List[str] = []
+        self._rows: List[Dict[str, int]] = []  # per prefix id, {name: row}
+        self._parents = array("I")
+        self._names: List[str] = []
+        self._sizes = array("q")
+        self._modtimes = array("d")
+        self._is_dir = bytearray()
+        self._hashes: List[Union[bytes, str, None]] = []
+        for entry in entries:
+            self.append(entry)
+
+    @classmethod
+    def from_lsjson(cls, path: str, *flags: str, hash_type: Optional[str] = None) -> "Listing":
+        """Return the listing of `path`, streamed from `rclone lsjson` (see `iter_lsjson`).
+
+        With a hash type, the entries are listed with their hashes of that type.
+        """
+        if hash_type:
+            flags += ("--hash", "--hash-type", hash_type)
+        return cls(iter_lsjson(path, *flags), hash_type)
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Add a parsed `lsjson` entry."""
+        modtime = entry.get("ModTime")
+        file_hash = (entry.get("Hashes") or {}).get(self.hash_type) if self.hash_type else None
+        self.add(
+            entry["Path"],
+            int(entry.get("Size", -1)),
+            parse_modtime(modtime) if modtime else 0.0,
+            bool(entry.get("IsDir")),
+            file_hash,
+        )
+
+    def add(  # pylint: disable=too-many-arguments
+        self, path: str, size: int, modtime: float, is_dir: bool, file_hash: Optional[str] = None
+    ) -> None:
+        """Add an object at `path`, relative to the listed root."""
+        prefix, _, name = path.rpartition("/")
+        if prefix not in self._prefix_ids:
+            self._prefix_ids[prefix] = len(self._prefixes)
+            self._prefixes.append(sys.intern(prefix))
+            self._rows.append({})
+        prefix_id = self._prefix_ids[prefix]
+        self._rows[prefix_id][name] = len(self._names)
+        self._parents.append(prefix_id)
+        self._names.append(name)
+        self._sizes.append(size)
+        self._modtimes.append(modtime)
+        self._is_dir.append(is_dir)
+        self._hashes.append(_pack_hash(file_hash))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def path(self, i: int) -> str:
+        """Return the path of row `i`."""
+        prefix = self._prefixes[self._parents[i]]
+        return f"{prefix}/{self._names[i]}" if prefix else self._names[i]
+
+    def file_hash(self, i: int) -> Optional[str]:
+        """Return the hash of row `i`, or None if it has none."""
+        return _unpack_hash(self._hashes[i])
+
+    def row(self, path: str) -> Optional[int]:
+        """Return the row of the object at `path`, or None if it was not listed."""
+        prefix, _, name = path.rpartition("/")
+        prefix_id = self._prefix_ids.get(prefix)
+        return None if prefix_id is None else self._rows[prefix_id].get(name)
+
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, str) and self.row(path) is not None
+
+    def __getitem__(self, i: int) -> ListingEntry:
+        return ListingEntry(
+            self.path(i),
+            self._sizes[i],
+            self._modtimes[i],
+            bool(self._is_dir[i]),
+            self.file_hash(i),
+        )
+
+    def __iter__(self) -> Iterator[ListingEntry]:
+        return (self[i] for i in range(len(self)))
+
+    def paths(self) -> Iterator[str]:
+        """Yield the path of every listed object."""
+        return (self.path(i) for i in range(len(self)))
+
+    def hashes(self) -> "HashView":
+        """Return a read-only {path: hash} mapping, computed row by row when accessed."""
+        return HashView(self)
+
+    @property
+    def total_size(self) -> int:
+        """Total size of the listed files of known size."""
+        return sum(size for size in self._sizes if size > 0)
+
+
+class HashView(Mapping[str, Optional[str]]):
+    """{path: hash} view of a `Listing`, without materialising any dict."""
+
+    def __init__(self, listing: Listing) -> None:
+        self.listing = listing
+
+    def __getitem__(self, path: str) -> Optional[str]:
+        i = self.listing.row(path)
+        if i is None:
+            raise KeyError(path)
+        return self.listing.file_hash(i)
+
+    def __contains__(self, path: object) -> bool:
+        return path in self.listing
+
+    def __iter__(self) -> Iterator[str]:
+        return self.listing.paths()
+
+    def __len__(self) -> int:
+        return len(self.listing)
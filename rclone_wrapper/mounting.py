@@ -3,6 +3,11 @@
 import logging
 import os
 import subprocess
+from typing import Optional
+
+from rclone_wrapper.bandwidth import mount_flags, register_job
+from rclone_wrapper.remote_control import free_rc_addr, rc_flags
+from rclone_wrapper.warming import WarmUp, warm_up
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +34,21 @@ def is_mounted(mount_point: str) -> bool:
         raise
 
 
-def mount(remote_path: str, mount_point: str, remote: str) -> None:
-    """Mount a remote folder to a local directory using rclone."""
+def mount(
+    remote_path: str,
+    mount_point: str,
+    remote: str,
+    bandwidth: Optional[str] = None,
+    *,
+    warm: Optional[WarmUp] = None,
+) -> None:
+    """Mount a remote folder to a local directory using rclone.
+
+    If a bandwidth policy is given, the mount gets its share of it (see `mount_flags`).
+    If warm-up settings are given, the mount serves rc on a local port, and once it is
+    ready, its VFS cache is loaded with the hot dirs (see `warm_up`). Pre-reading headers
+    needs the read data to be cached too, so the mount then uses `--vfs-cache-mode full`.
+    """
 
     if is_mounted(mount_point):
         logger.error("'%s' is already mounted.", mount_point)
@@ -40,11 +58,13 @@ def mount(remote_path: str, mount_point: str, remote: str) -> None:
         logger.info("Creating mount point directory: '%s'", mount_point)
         os.makedirs(mount_point, exist_ok=True)  # Ensure the directory exists
 
+    rc_addr = free_rc_addr() if warm is not None else None
+    cache_mode = "full" if warm is not None and warm.header_bytes > 0 else "writes"
     logger.info("Mounting '%s:%s' to '%s'...", remote, remote_path, mount_point)
     try:
         # Popen only needs `with` if we plan to `wait()` or `communicate()`
         # Using `with` is not appropriate for long-running processes like `rclone mount`.
-        subprocess.Popen(  # pylint: disable=consider-using-with
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
             [
                 "nohup",
                 "rclone",
@@ -52,18 +72,25 @@ def mount(remote_path: str, mount_point: str, remote: str) -> None:
                 f"{remote}:{remote_path}",
                 mount_point,
                 "--vfs-cache-mode",
-                "writes",
+                cache_mode,
+                *mount_flags(bandwidth),
+                *(rc_flags(rc_addr) if rc_addr is not None else []),
             ],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
             stdin=subprocess.DEVNULL,
             start_new_session=True,
         )
+        if bandwidth is not None:
+            register_job(process.pid)
         logger.info("Mounted '%s' to '%s'", remote_path, mount_point)
     except subprocess.SubprocessError as exc:
         logger.error("Failed to mount '%s' to '%s': %s", remote_path, mount_point, exc)
         raise
 
+    if warm is not None and rc_addr is not None:
+        warm_up(rc_addr, mount_point, warm)
+
 
 def unmount(mount_point: str) -> None:
     """Unmount a local mount point."""
@@ -3,31 +3,67 @@
 import functools
 import logging
 import subprocess
-from typing import List
+from typing import List, Tuple
 
 logger = logging.getLogger(__name__)
 
 
-@functools.lru_cache(maxsize=128)
 def _list_dirs(current_path: str, remote: str) -> List[str]:
-    command = ["rclone", "lsf", f"{remote}:{current_path}", "--dirs-only"]
+    try:
+        names = list_names(current_path, remote)
+    except subprocess.CalledProcessError:
+        return []  # logged by `list_names`
+    return [name.rstrip("/") for name in names if name.endswith("/")]
+
+
+@functools.lru_cache(maxsize=1024)
+def list_names(current_path: str, remote: str) -> Tuple[str, ...]:
+    """Return the names of the objects in a remote dir, with a trailing '/' for dirs.
+
+    A missing dir has no names. Listings are cached (see `clear_caches`).
+    """
+    command = ["rclone", "lsf", f"{remote}:{current_path}"]
     try:
         result = subprocess.run(
             command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
         )
-        return [line.rstrip("/ \n\r") for line in result.stdout.splitlines()]
+        return tuple(line.rstrip("\r") for line in result.stdout.splitlines())
     except subprocess.CalledProcessError as e:
-        logger.error("Failed to list directories for '%s': %s", current_path, e.stderr.strip())
-        return []
+        if "not found" in (e.stderr or "").lower():
+            return ()
+        logger.error("Failed to list '%s': %s", current_path, e.stderr.strip())
+        raise
     except (FileNotFoundError, PermissionError) as exc:
         logger.error("Error running rclone for '%s': %s", current_path, exc)
         raise
 
 
+def remote_exists(
+    remote: str, path: str, mode: str = "file_or_dir", *, fresh: bool = False
+) -> bool:
+    """Return True if `path` exists on the remote, as a dir if mode is 'dir'.
+
+    Answered from a cached listing of the parent dir, so repeated checks of paths in the
+    same dir cost a single rclone call (see `clear_caches`). If `fresh`, the parent dir
+    is listed anew, bypassing (and not filling) the cache.
+    """
+    parent, _, name = path.strip("/").rpartition("/")
+    if not name:
+        return True
+    names = list_names.__wrapped__(parent, remote) if fresh else list_names(parent, remote)
+    return f"{name}/" in names or (mode != "dir" and name in names)
+
+
+def clear_caches() -> None:
+    """Forget the cached listings, e.g. after a transfer changed the remote."""
+    list_names.cache_clear()
+
+
 def navigate(remote: str, start_path: str = "") -> None:
     """
     Interactively navigate the remote directories using rclone.
     The remote and initial path are provided by the caller.
+    Dirs are listed through the cache of `list_names`, so going back up costs no rclone call.
     """
     current_path = start_path
     while True:
@@ -0,0 +1,298 @@
+"""utilities for planning transfers ahead of running them (dry-run with estimates)"""
+
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from rclone_wrapper.bandwidth import throttled
+from rclone_wrapper.batching import copy_files_from, delete_files_from
+from rclone_wrapper.indexing import RemoteIndex
+from rclone_wrapper.listing import Listing, ListingEntry, parse_modtime
+from rclone_wrapper.transferring import (
+    _remote_path_exists,
+    _validate_local_destination,
+    _validate_remote_destination,
+    validate_local_destinations,
+    validate_remote_destinations,
+)
+
+logger = logging.getLogger(__name__)
+
+PLANS_DIR = "plans"
+THROUGHPUT_FILE = "cache/throughput.json"
+THROUGHPUT_HISTORY = 10  # number of recent transfers the throughput is averaged over
+
+KINDS = ("upload", "download", "sync")
+
+
+class PlannedFile(NamedTuple):
+    """A file to transfer, relative to the plan's source root."""
+
+    path: str
+    size: int
+    changed: bool  # False if the file does not exist at the destination yet
+
+
+class TransferPlan(NamedTuple):
+    """Everything needed to run a transfer exactly as it was planned."""
+
+    kind: str
+    remote: str
+    remote_path: str
+    local_path: str
+    src_root: str  # local dir or rclone remote path the file paths are relative to
+    dst: str  # local dir or rclone remote path the files are copied into
+    files: List[PlannedFile]
+    deleted: List[str]  # relative to dst, only ever non-empty for a sync with delete
+    estimated_seconds: Optional[float]
+
+    @property
+    def total_bytes(self) -> int:
+        """Total number of bytes to transfer."""
+        return sum(f.size for f in self.files)
+
+    def summary(self) -> str:
+        """Return a one-line human readable summary of the plan."""
+        changed = sum(f.changed for f in self.files)
+        eta = (
+            "unknown duration (no throughput measured yet)"
+            if self.estimated_seconds is None
+            else f"~{self.estimated_seconds:.0f}s"
+        )
+        return (
+            f"{self.kind} '{self.src_root}' -> '{self.dst}': {len(self.files)} file(s) "
+            f"({len(self.files) - changed} new, {changed} changed), "
+            f"{self.total_bytes} bytes, {len(self.deleted)} to delete, {eta}"
+        )
+
+
+def _files(path: str, index: Optional[RemoteIndex] = None) -> Listing:
+    """Return the listing of the files below `path`, with their size and modtime.
+
+    `path` is local or remote. The recursive listing is streamed into a compact `Listing`,
+    so no dict is kept per file. If an index of the remote of `path` is given, it is read
+    instead of listing the remote.
+    """
+    remote, separator, prefix = path.partition(":")
+    if separator and index is not None and index.remote == remote:
+        prefix = prefix.strip("/")
+        listing = Listing()
+        for entry in index.files(prefix):
+            relative_path = entry.path[len(prefix) :].lstrip("/")
+            listing.add(relative_path, entry.size, parse_modtime(entry.modtime), False)
+        return listing
+    return Listing.from_lsjson(path, "-R", "--files-only", "--fast-list")
+
+
+def _differs(src: ListingEntry, dst: ListingEntry) -> bool:
+    """Return True if two files differ in size or (beyond 1s) in modtime."""
+    return src.size != dst.size or abs(src.modtime - dst.modtime) > 1
+
+
+def _measured_throughput() -> Optional[float]:
+    """Return the average bytes/s of recently executed plans, or None if there are none."""
+    if not os.path.isfile(THROUGHPUT_FILE):
+        return None
+    with open(THROUGHPUT_FILE, "r", encoding="utf-8") as f:
+        history: List[Dict[str, float]] = json.load(f)
+    total_seconds = sum(record["seconds"] for record in history)
+    if total_seconds <= 0:
+        return None
+    return sum(record["bytes"] for record in history) / total_seconds
+
+
+def _record_throughput(num_bytes: int, seconds: float) -> None:
+    """Add a measured transfer to the recent throughput history."""
+    history: List[Dict[str, float]] = []
+    if os.path.isfile(THROUGHPUT_FILE):
+        with open(THROUGHPUT_FILE, "r", encoding="utf-8") as f:
+            history = json.load(f)
+    history = (history + [{"bytes": num_bytes, "seconds": seconds}])[-THROUGHPUT_HISTORY:]
+    os.makedirs(os.path.dirname(THROUGHPUT_FILE), exist_ok=True)
+    with open(THROUGHPUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(history, f)
+
+
+def _plan_files(
+    kind: str, remote_path: str, local_path: str, remote: str, index: Optional[RemoteIndex]
+) -> Optional[Tuple[str, str, str, List[PlannedFile], List[str]]]:
+    """Return (kind, source root, destination, files, destination-only paths) of a transfer.
+
+    Destination-only paths are only looked for in a sync, as candidates for deletion.
+    Returns None if the transfer would be aborted.
+    """
+    local_base = os.path.basename(os.path.normpath(local_path))
+    target = f"{remote}:{remote_path.rstrip('/')}/{local_base}"
+
+    if kind == "download":
+        if not _validate_local_destination(remote_path, local_path):
+            return None
+        src_root = f"{remote}:{remote_path}"
+        dst = os.path.join(local_path, os.path.basename(os.path.normpath(remote_path)))
+        files = [PlannedFile(e.path, e.size, False) for e in _files(src_root, index)]
+        return kind, src_root, dst, files, []
+
+    # a sync to a missing target is a plain upload
+    if kind == "upload" or not _remote_path_exists(target, mode="file_or_dir", index=index):
+        if not _validate_remote_destination(remote_path, local_path, remote, index=index):
+            return None
+        src_root = local_path if os.path.isdir(local_path) else os.path.dirname(local_path)
+        files = [PlannedFile(e.path, e.size, False) for e in _files(local_path)]
+        return "upload", src_root, target, files, []
+
+    if not os.path.isdir(local_path):
+        logger.error("Source '%s' does not exist or is not a directory.", local_path)
+        return None
+    src_files, dst_files = _files(local_path), _files(target, index)
+    files = []
+    for entry in src_files:
+        row = dst_files.row(entry.path)
+        if row is None or _differs(entry, dst_files[row]):
+            files.append(PlannedFile(entry.path, entry.size, row is not None))
+    dst_only = sorted(path for path in dst_files.paths() if path not in src_files)
+    return kind, local_path, target, files, dst_only
+
+
+def plan_transfer(  # pylint: disable=too-many-arguments
+    kind: str,
+    remote_path: str,
+    local_path: str,
+    remote: str,
+    *,
+    delete: bool = False,
+    index: Optional[RemoteIndex] = None,
+) -> Optional[TransferPlan]:
+    """Plan an upload, download or sync without transferring anything.
+
+    Files are enumerated with streamed recursive `lsjson` listings (or the remote index if given)
+    and, for a sync, compared by size and modtime. The duration is estimated from the
+    throughput of recently executed plans.
+
+    Returns None if the transfer would be aborted by the same guardrails as the transfer
+    itself, see `upload`, `download` and `sync`.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown transfer kind '{kind}', expected one of {KINDS}.")
+
+    planned = _plan_files(kind, remote_path, local_path, remote, index)
+    if planned is None:
+        return None
+    kind, src_root, dst, files, dst_only = planned
+
+    throughput = _measured_throughput()
+    total_bytes = sum(f.size for f in files)
+    plan = TransferPlan(
+        kind,
+        remote,
+        remote_path,
+        local_path,
+        src_root,
+        dst,
+        sorted(files),
+        dst_only if delete else [],
+        None if throughput is None else total_bytes / throughput,
+    )
+    logger.info("Planned %s", plan.summary())
+    return plan
+
+
+def save_plan(plan: TransferPlan, plan_file: Optional[str] = None) -> str:
+    """Write the plan as JSON and return the path of the written file."""
+    if plan_file is None:
+        os.makedirs(PLANS_DIR, exist_ok=True)
+        current_time = datetime.now().strftime("%Y%m%dT%H%M%S")
+        plan_file = os.path.join(PLANS_DIR, f"{current_time}_{plan.kind}_plan.json")
+    data = plan._asdict()
+    data["files"] = [f._asdict() for f in plan.files]
+    with open(plan_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    logger.info("Plan stored in '%s'.", plan_file)
+    return plan_file
+
+
+def load_plan(plan_file: str) -> TransferPlan:
+    """Read a plan written by `save_plan`."""
+    with open(plan_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["files"] = [PlannedFile(**f) for f in data["files"]]
+    return TransferPlan(**data)
+
+
+def execute_plan(
+    plan: TransferPlan, *, validate: bool = True, bandwidth: Optional[str] = None
+) -> bool:
+    """Transfer exactly the files of the plan, and record the measured throughput.
+
+    Upload and download plans are re-validated first (unless the caller just did), so a
+    destination created since the plan was made is still never overwritten. If a bandwidth
+    policy is given, the transfer gets its share of it (see `throttled`). Returns False
+    if aborted.
+    """
+    if (
+        validate
+        and plan.kind == "upload"
+        and not _validate_remote_destination(plan.remote_path, plan.local_path, plan.remote)
+    ):
+        return False
+    if (
+        validate
+        and plan.kind == "download"
+        and not _validate_local_destination(plan.remote_path, plan.local_path)
+    ):
+        return False
+
+    logger.info("Executing %s", plan.summary())
+    start = time.monotonic()
+    try:
+        if plan.files:
+            with throttled(bandwidth) as flags:
+                copy_files_from(plan.src_root, plan.dst, [f.path for f in plan.files], flags)
+        if plan.deleted:
+            delete_files_from(plan.dst, plan.deleted)
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "Failed to execute the %s plan: %s",
+            plan.kind,
+            exc.stderr.strip() if exc.stderr else "Unknown error",
+        )
+        raise
+
+    if plan.total_bytes:
+        _record_throughput(plan.total_bytes, time.monotonic() - start)
+    logger.info("Plan executed successfully.")
+    return True
+
+
+def _validate_plans(plans: Sequence[TransferPlan]) -> List[bool]:
+    """Re-validate the destinations of upload and download plans in bulk, per remote."""
+    valid = [True] * len(plans)
+    batches: Dict[Tuple[str, str], List[int]] = {}  # {(kind, remote): plan positions}
+    for i, plan in enumerate(plans):
+        if plan.kind in ("upload", "download"):
+            batches.setdefault((plan.kind, plan.remote), []).append(i)
+    for (kind, remote), indices in batches.items():
+        pairs = [(plans[i].remote_path, plans[i].local_path) for i in indices]
+        if kind == "upload":
+            results = validate_remote_destinations(pairs, remote)
+        else:
+            results = validate_local_destinations(pairs)
+        for i, result in zip(indices, results):
+            valid[i] = result
+    return valid
+
+
+def execute_plans(plans: Sequence[TransferPlan], *, bandwidth: Optional[str] = None) -> List[bool]:
+    """Execute plans one after the other, validating all their destinations up front.
+
+    See `validate_remote_destinations` and `validate_local_destinations`: destinations shared
+    by many plans are listed once. Returns whether each plan was executed.
+    """
+    valid = _validate_plans(plans)
+    return [
+        execute_plan(plan, validate=False, bandwidth=bandwidth) if ok else False
+        for plan, ok in zip(plans, valid)
+    ]
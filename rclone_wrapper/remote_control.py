@@ -0,0 +1,50 @@
+"""utilities for controlling running rclone processes through their remote control (rc) API"""
+
+import json
+import logging
+import socket
+import subprocess
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def free_rc_addr() -> str:
+    """Return a localhost address with a currently free port for an rclone rc server."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+def rc_flags(rc_addr: str) -> List[str]:
+    """Return the rclone flags serving the rc API on the local `rc_addr`.
+
+    Auth is left on: the methods used here (e.g. 'core/bwlimit', 'vfs/refresh') do not need
+    it, while the ones that do (e.g. 'config/dump', 'operations/*') stay closed to the
+    other local processes.
+    """
+    return ["--rc", "--rc-addr", rc_addr]
+
+
+def rc_call(rc_addr: str, command: str, **params: Any) -> Dict[str, Any]:
+    """Run the rc `command` (e.g. 'core/bwlimit') on the rclone serving `rc_addr`."""
+    args = [f"{key}={value}" for key, value in params.items()]
+    try:
+        result = subprocess.run(
+            ["rclone", "rc", "--url", f"http://{rc_addr}/", command, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        response: Dict[str, Any] = json.loads(result.stdout or "{}")
+        return response
+
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "rc call '%s' on '%s' failed: %s",
+            command,
+            rc_addr,
+            exc.stderr.strip() if exc.stderr else "Unknown error",
+        )
+        raise
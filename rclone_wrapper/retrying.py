@@ -0,0 +1,149 @@
+"""utilities for retrying only the files an rclone copy failed on"""
+
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Sequence
+
+from rclone_wrapper.batching import copy_files_from
+
+logger = logging.getLogger(__name__)
+
+RETRIES = 3
+BACKOFF_BASE = 2.0  # seconds, doubled on every retry
+FAILURES_DIR = "results"
+
+# rclone's own --retries re-run the whole copy: they are turned off (--low-level-retries are
+# kept), and only the failed files are retried here instead. No --progress: with it, rclone
+# prints its log through the progress display on stdout, and the failures are not on stderr
+_COPY_FLAGS = ["--use-json-log", "--retries", "1"]
+
+_TRANSIENT = re.compile(
+    r"rate ?limit|ratelimitexceeded|too many requests|\b429\b|\b5\d\d\b|internal error|"
+    r"backend ?error|service unavailable|timeout|timed out|deadline exceeded|"
+    r"connection (reset|refused)|broken pipe|unexpected eof|temporar",
+    re.IGNORECASE,
+)
+
+
+class FailedObject(NamedTuple):
+    """A file rclone failed to copy, relative to the copy's source."""
+
+    path: str
+    error: str
+    transient: bool  # worth retrying, e.g. rate limits, 5xx and timeouts
+
+
+class TransferError(subprocess.CalledProcessError):
+    """An rclone copy that still failed on some files after retrying them."""
+
+    def __init__(
+        self, returncode: int, cmd: List[str], stderr: str, failures: List[FailedObject]
+    ) -> None:
+        super().__init__(returncode, cmd, stderr=stderr)
+        self.failures = failures
+
+
+def is_transient(error: str) -> bool:
+    """Return True if an rclone error message looks like a temporary failure."""
+    return _TRANSIENT.search(error) is not None
+
+
+def parse_failures(stderr: str) -> List[FailedObject]:
+    """Return the failed files reported in the JSON log (`--use-json-log`) of rclone.
+
+    If a file failed several times, its last error is kept.
+    """
+    failures: Dict[str, FailedObject] = {}
+    for line in stderr.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(entry, dict) or entry.get("level") != "error":
+            continue
+        if entry.get("object"):
+            error = str(entry.get("msg", ""))
+            failures[entry["object"]] = FailedObject(entry["object"], error, is_transient(error))
+    return list(failures.values())
+
+
+def _backoff(attempt: int) -> float:
+    """Return the delay before retry `attempt` (0-based): exponential, with random jitter."""
+    delay: float = BACKOFF_BASE * 2**attempt
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _report(failures: List[FailedObject]) -> str:
+    """Store the failures as JSON under results/ and return the path of the report."""
+    os.makedirs(FAILURES_DIR, exist_ok=True)
+    current_time = datetime.now().strftime("%Y%m%dT%H%M%S")
+    report_file = os.path.join(FAILURES_DIR, f"{current_time}_failures.json")
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump([failure._asdict() for failure in failures], f, indent=2)
+    return report_file
+
+
+def copy_with_retries(src: str, dst: str, flags: Sequence[str] = ()) -> None:
+    """Copy `src` into `dst` with rclone, then retry only the files that failed transiently.
+
+    Failed files are read from rclone's JSON log and retried up to RETRIES times with
+    exponential backoff and jitter. If some files still failed, they are stored in a
+    report under results/ and a TransferError listing them is raised. If rclone failed
+    without naming any file, its CalledProcessError is raised as is.
+    """
+    command = ["rclone", "copy", "--checksum", *_COPY_FLAGS, *flags, src, dst]
+    try:
+        subprocess.run(command, check=True, stderr=subprocess.PIPE, text=True)
+        return
+    except subprocess.CalledProcessError as exc:
+        failures = parse_failures(exc.stderr or "")
+        if not failures:
+            raise
+        last_error = exc
+
+    permanent = [failure for failure in failures if not failure.transient]
+    transient = [failure for failure in failures if failure.transient]
+    for attempt in range(RETRIES):
+        if not transient:
+            break
+        delay = _backoff(attempt)
+        logger.warning(
+            "%d file(s) failed transiently, retrying them in %.1fs (%d/%d)...",
+            len(transient),
+            delay,
+            attempt + 1,
+            RETRIES,
+        )
+        time.sleep(delay)
+        try:
+            if [failure.path for failure in transient] == [os.path.basename(src.rstrip("/"))]:
+                subprocess.run(command, check=True, stderr=subprocess.PIPE, text=True)  # a file
+            else:
+                copy_files_from(
+                    src,
+                    dst,
+                    [failure.path for failure in transient],
+                    [*_COPY_FLAGS, *flags],
+                    progress=False,
+                )
+            transient = []
+        except subprocess.CalledProcessError as exc:
+            last_error = exc
+            failures = parse_failures(exc.stderr or "") or transient
+            permanent += [failure for failure in failures if not failure.transient]
+            transient = [failure for failure in failures if failure.transient]
+
+    remaining = permanent + transient
+    if not remaining:
+        logger.info("All failed files were copied on retry.")
+        return
+    for failure in remaining:
+        logger.error("Failed to copy '%s': %s", failure.path, failure.error)
+    logger.error("%d file(s) failed, see '%s'.", len(remaining), _report(remaining))
+    raise TransferError(last_error.returncode, command, last_error.stderr, remaining)
@@ -0,0 +1,72 @@
+"""utilities for finding remote files and dirs by name, from the local remote index"""
+
+import fnmatch
+import logging
+import re
+from typing import Callable, List, Match, Optional
+
+from rclone_wrapper.indexing import IndexEntry, RemoteIndex
+
+logger = logging.getLogger(__name__)
+
+MODES = ("glob", "substring", "regex")
+KINDS = ("file", "dir")
+
+
+def _name(path: str) -> str:
+    return path.rpartition("/")[2]
+
+
+def _literal_prefix(pattern: str) -> str:
+    """Return the part of a glob pattern before its first wildcard."""
+    return re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+
+def search(  # pylint: disable=too-many-arguments
+    index: RemoteIndex,
+    pattern: str,
+    mode: str = "glob",
+    *,
+    prefix: str = "",
+    kind: Optional[str] = None,
+    refresh: bool = False,
+) -> List[IndexEntry]:
+    """Find the files and dirs below the remote dir `prefix` whose name matches `pattern`.
+
+    `mode` is 'glob' (fnmatch syntax, matching the whole name), 'substring' or 'regex'
+    (matching anywhere in the name), always case-insensitively. The query is answered from
+    the index as is, which is refreshed first (incrementally, see `RemoteIndex.refresh`)
+    only if `refresh` is True. A glob starting with a literal, e.g. 'report*', only reads
+    the names in that range of the index's name column. `kind` restricts the results to
+    'file' or 'dir' entries. Results are sorted by path.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown search mode '{mode}', expected one of {MODES}.")
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f"Unknown kind '{kind}', expected one of {KINDS}.")
+    if refresh:
+        index.refresh(prefix)
+
+    name_prefix = ""
+    find: Callable[[str], Optional[Match[str]]]
+    if mode == "glob":
+        pattern = pattern.casefold()
+        name_prefix = _literal_prefix(pattern)
+        find = re.compile(fnmatch.translate(pattern)).match
+    elif mode == "substring":
+        find = re.compile(re.escape(pattern.casefold())).search
+    else:
+        find = re.compile(pattern, re.IGNORECASE).search
+    found = [
+        entry
+        for entry in index.by_name(name_prefix, prefix)
+        if find(_name(entry.path).casefold()) and (kind is None or entry.is_dir == (kind == "dir"))
+    ]
+    logger.info(
+        "Found %d match(es) of '%s' in the index of '%s:%s'.",
+        len(found),
+        pattern,
+        index.remote,
+        prefix.strip("/"),
+    )
+    return found
@@ -1,47 +1,58 @@
 """utilities for transferring files/dirs between local and remote using rclone"""
 
+import functools
 import logging
 import os
 import subprocess
+import tempfile
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from rclone_wrapper.bandwidth import throttled
+from rclone_wrapper.batching import copy_files_from, delete_files_from
+from rclone_wrapper.deduplication import copy_deduplicated, local_hashes
+from rclone_wrapper.indexing import RemoteIndex
+from rclone_wrapper.navigation import list_names, remote_exists
+from rclone_wrapper.retrying import copy_with_retries
+from rclone_wrapper.verification import VerificationReport, verified_download, verified_upload
 
 logger = logging.getLogger(__name__)
 
 
-def _remote_path_exists(remote_path: str, mode: str) -> bool:
+class Delta(NamedTuple):
+    """Relative paths that differ between a source and a destination dir."""
+
+    new: List[str]  # only in source
+    changed: List[str]  # in both, with different content
+    deleted: List[str]  # only in destination
+
+
+def _remote_path_exists(remote_path: str, mode: str, index: Optional[RemoteIndex] = None) -> bool:
     """Return True if `remote_path` exists on the remote
 
     If mode is 'dir', check if the path exists as a directory.
     If mode is 'file_or_dir', check if the path exists as a file or directory.
+    If an index of the remote is given, answer from it instead of querying the remote,
+    else from a fresh listing of the parent dir: the listings cached for `ls`/`exists` may
+    miss what another transfer or client just wrote.
     """
-    try:
-        command = ["rclone", "lsd" if mode == "dir" else "lsf", remote_path]
-        result = subprocess.run(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
-        )
-        return True if mode == "dir" else bool(result.stdout.strip())
+    remote, _, path = remote_path.partition(":")
+    if index is not None and index.remote == remote:
+        return index.exists(path, mode)
+    return remote_exists(remote, path, mode, fresh=True)
 
-    except subprocess.CalledProcessError as exc:
-        stderr = exc.stderr.lower() if exc.stderr else ""
-        if "not found" in stderr:
-            return False
-        logger.error("Error checking remote path: %s", stderr)
-        raise
 
-    except (FileNotFoundError, PermissionError) as exc:
-        logger.error("Error accessing remote path '%s': %s", remote_path, exc)
-        raise
-
-
-def _validate_remote_destination(remote_path: str, local_path: str, remote: str) -> bool:
+def _validate_remote_destination(
+    remote_path: str, local_path: str, remote: str, index: Optional[RemoteIndex] = None
+) -> bool:
     """Return True if the remote destination is valid for uploading."""
-    if not _remote_path_exists(f"{remote}:{remote_path}", mode="dir"):
+    if not _remote_path_exists(f"{remote}:{remote_path}", mode="dir", index=index):
         logger.error("Destination '%s:%s' does not exist.", remote, remote_path)
         return False
 
     local_path_base = os.path.basename(os.path.normpath(local_path))
     target_path = f"{remote_path.rstrip('/')}/{local_path_base}"
 
-    if _remote_path_exists(f"{remote}:{target_path}", mode="file_or_dir"):
+    if _remote_path_exists(f"{remote}:{target_path}", mode="file_or_dir", index=index):
         logger.error(
             "A file/dir named '%s' already exists under destination '%s:%s'.",
             local_path_base,
@@ -53,30 +64,116 @@ def _validate_remote_destination(remote_path: str, local_path: str, remote: str)
     return True
 
 
-def upload(remote_path: str, local_path: str, remote: str) -> None:
+def _remote_names(remote: str, remote_dir: str) -> Dict[str, bool]:
+    """Return {name: is a dir} of the objects in a remote dir (none if it does not exist).
+
+    The dir is listed fresh, bypassing the cache of `list_names`.
+    """
+    names = list_names.__wrapped__(remote_dir, remote)
+    return {name.rstrip("/"): name.endswith("/") for name in names}
+
+
+def validate_remote_destinations(uploads: Sequence[Tuple[str, str]], remote: str) -> List[bool]:
+    """Validate many (remote_path, local_path) uploads at once, see `_validate_remote_destination`.
+
+    Instead of two rclone calls per upload, each distinct parent of the destinations is
+    listed once (to check that the destination is a dir), and then each distinct destination
+    once (to check for its targets), each with a fresh `list_names`. An upload whose
+    target another upload of the batch already takes is invalid as well.
+    """
+    dests = {remote_path.strip("/") for remote_path, _ in uploads}
+    parents = {
+        parent: _remote_names(remote, parent)
+        for parent in {dest.rpartition("/")[0] for dest in dests if dest}
+    }
+
+    def is_dir(dest: str) -> bool:
+        parent, _, name = dest.rpartition("/")
+        return not dest or parents[parent].get(name) is True
+
+    dest_names = {dest: _remote_names(remote, dest) for dest in dests if is_dir(dest)}
+    taken: Set[Tuple[str, str]] = set()
+    valid = []
+    for remote_path, local_path in uploads:
+        dest = remote_path.strip("/")
+        local_path_base = os.path.basename(os.path.normpath(local_path))
+        if dest not in dest_names:
+            logger.error("Destination '%s:%s' does not exist.", remote, remote_path)
+        elif local_path_base in dest_names[dest] or (dest, local_path_base) in taken:
+            logger.error(
+                "A file/dir named '%s' already exists under destination '%s:%s'.",
+                local_path_base,
+                remote,
+                remote_path,
+            )
+        else:
+            taken.add((dest, local_path_base))
+            valid.append(True)
+            continue
+        valid.append(False)
+    return valid
+
+
+def upload(  # pylint: disable=too-many-arguments
+    remote_path: str,
+    local_path: str,
+    remote: str,
+    *,
+    dedup_root: Optional[str] = None,
+    index: Optional[RemoteIndex] = None,
+    bandwidth: Optional[str] = None,
+    verify: bool = False,
+) -> Optional[VerificationReport]:
     """Uploads a local file/dir to a remote destination.
 
     It makes a copy of the local_path file/dir under the remote_path.
 
+    If dedup_root is given, files whose content already exists anywhere under that remote
+    dir are server-side copied instead of being uploaded again.
+    If an index of the remote is given, destination checks and dedup lookups read from it.
+    If a bandwidth policy is given, the upload gets its share of it (see `throttled`).
+    Files that failed transiently are retried on their own (see `copy_with_retries`).
+    If verify is True, the upload is checked from hashes computed while it runs (see
+    `verified_upload`), or from those computed for dedup_root, and its VerificationReport
+    is returned, otherwise None.
+
     Abort if:
     * a dir as remote_path does not exist.
     * remote_path already contains a dir/file with the same basename as local_path.
     """
-    if not _validate_remote_destination(remote_path, local_path, remote):
-        return
+    if not _validate_remote_destination(remote_path, local_path, remote, index=index):
+        return None
 
     local_path_base = os.path.basename(os.path.normpath(local_path))
     target_path = f"{remote_path.rstrip('/')}/{local_path_base}"
+    target = f"{remote}:{target_path}"
 
-    logger.info("Uploading '%s' to '%s:%s'...", local_path, remote, target_path)
+    logger.info("Uploading '%s' to '%s'...", local_path, target)
+    report = None
     try:
-        subprocess.run(
-            ["rclone", "copy", "--progress", "--checksum", local_path, f"{remote}:{target_path}"],
-            check=True,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
+        with throttled(bandwidth) as flags:
+            copy: Callable[[], object]
+            hashes = None
+            if dedup_root is None:
+                copy = functools.partial(copy_with_retries, local_path, target, flags)
+            else:
+                if verify:  # hashed once, for both the dedup lookups and the verification
+                    hashes = local_hashes(local_path)
+                copy = functools.partial(
+                    copy_deduplicated,
+                    local_path,
+                    target,
+                    f"{remote}:{dedup_root}",
+                    index=index,
+                    flags=flags,
+                    hashes=hashes,
+                )
+            if verify:
+                report = verified_upload(copy, local_path, target, hashes=hashes)
+            else:
+                copy()
         logger.info("Upload completed successfully.")
+        return report
 
     except subprocess.CalledProcessError as exc:
         logger.error(
@@ -107,30 +204,83 @@ def _validate_local_destination(remote_path: str, local_path: str) -> bool:
     return True
 
 
-def download(remote_path: str, local_path: str, remote: str) -> None:
+def _local_names(local_dir: str) -> Optional[Set[str]]:
+    """Return the names of the objects in a local dir, or None if it is not a dir."""
+    try:
+        with os.scandir(local_dir) as entries:
+            return {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def validate_local_destinations(downloads: Sequence[Tuple[str, str]]) -> List[bool]:
+    """Validate many (remote_path, local_path) downloads at once, see `_validate_local_destination`.
+
+    Each distinct local destination is scanned only once, however it is spelled ('dir' and
+    'dir/' are the same dir). A download whose target another download of the batch already
+    takes is invalid as well.
+    """
+    local_dirs = {os.path.normpath(local_path) for _, local_path in downloads}
+    dir_names = {local_dir: _local_names(local_dir) for local_dir in local_dirs}
+    taken: Set[Tuple[str, str]] = set()
+    valid = []
+    for remote_path, local_path in downloads:
+        local_dir = os.path.normpath(local_path)
+        names = dir_names[local_dir]
+        remote_path_base = os.path.basename(os.path.normpath(remote_path))
+        if names is None:
+            logger.error("Destination '%s' does not exist or is not a directory.", local_path)
+        elif remote_path_base in names or (local_dir, remote_path_base) in taken:
+            logger.error(
+                "A file/dir named '%s' already exists under '%s'.", remote_path_base, local_path
+            )
+        else:
+            taken.add((local_dir, remote_path_base))
+            valid.append(True)
+            continue
+        valid.append(False)
+    return valid
+
+
+def download(
+    remote_path: str,
+    local_path: str,
+    remote: str,
+    bandwidth: Optional[str] = None,
+    *,
+    verify: bool = False,
+) -> Optional[VerificationReport]:
     """Download a remote file/dir to a local destination.
 
     It makes a copy of the remote_path file/dir under the local_path.
+    If a bandwidth policy is given, the download gets its share of it (see `throttled`).
+    Files that failed transiently are retried on their own (see `copy_with_retries`).
+    If verify is True, the download is checked from hashes computed while it runs (see
+    `verified_download`) and its VerificationReport is returned, otherwise None.
 
     Abort if:
     * a dir as local_path does not exist.
     * local_path already contains a file/dir with the same basename as remote_path.
     """
     if not _validate_local_destination(remote_path, local_path):
-        return
+        return None
 
     remote_path_base = os.path.basename(os.path.normpath(remote_path))
     target_path = os.path.join(local_path, remote_path_base)
 
     logger.info("Downloading '%s:%s' to '%s'...", remote, remote_path, target_path)
+    report = None
     try:
-        subprocess.run(
-            ["rclone", "copy", "--progress", "--checksum", f"{remote}:{remote_path}", target_path],
-            check=True,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
+        with throttled(bandwidth) as flags:
+            copy = functools.partial(
+                copy_with_retries, f"{remote}:{remote_path}", target_path, flags
+            )
+            if verify:
+                report = verified_download(copy, f"{remote}:{remote_path}", target_path)
+            else:
+                copy()
         logger.info("Download completed successfully.")
+        return report
 
     except subprocess.CalledProcessError as exc:
         logger.error(
@@ -141,3 +291,119 @@ def download(remote_path: str, local_path: str, remote: str) -> None:
             exc.stderr.strip() if exc.stderr else "Unknown error",
         )
         raise
+
+
+def _compute_delta(src: str, dst: str) -> Delta:
+    """Return the difference between the dirs `src` and `dst` (local or remote).
+
+    rclone writes its report to a temporary file, which is then read line by line, so the
+    (possibly huge) list of identical files is never held in memory.
+    """
+    with tempfile.NamedTemporaryFile("r", suffix=".txt", encoding="utf-8") as report:
+        command = ["rclone", "check", src, dst, "--checksum", "--combined", report.name]
+        try:
+            result = subprocess.run(
+                command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False
+            )
+        except (FileNotFoundError, PermissionError) as exc:
+            logger.error("Error comparing '%s' and '%s': %s", src, dst, exc)
+            raise
+
+        delta = Delta([], [], [])
+        buckets = {"-": delta.new, "*": delta.changed, "+": delta.deleted}
+        failed: List[str] = []
+        for line in report:
+            marker, _, path = line.rstrip("\n").partition(" ")
+            if marker in buckets:
+                buckets[marker].append(path)
+            elif marker == "!":
+                failed.append(path)
+
+    # rclone check exits non-zero whenever there are differences, but not only then
+    if failed or (result.returncode != 0 and not any(delta)):
+        logger.error("Error comparing '%s' and '%s': %s", src, dst, result.stderr.strip())
+        raise subprocess.CalledProcessError(result.returncode, command, stderr=result.stderr)
+    return delta
+
+
+def _local_files(local_path: str) -> List[str]:
+    """Return the paths, relative to the dir `local_path`, of all files below it."""
+    return sorted(
+        os.path.relpath(os.path.join(dir_path, file_name), local_path)
+        for dir_path, _, file_names in os.walk(local_path)
+        for file_name in file_names
+    )
+
+
+def sync(
+    remote_path: str,
+    local_path: str,
+    remote: str,
+    delete: bool = False,
+    bandwidth: Optional[str] = None,
+) -> Optional[Delta]:
+    """Bring the remote copy of a local dir up to date, transferring only what changed.
+
+    The remote copy is the dir under remote_path with the same basename as local_path, as
+    created by `upload`. If it does not exist yet, this is a plain upload. Otherwise, new and
+    changed files are copied and, only if delete is True, files that no longer exist locally
+    are deleted from the remote copy. Nothing outside of the remote copy is touched.
+    If a bandwidth policy is given, the transfer gets its share of it (see `throttled`).
+
+    Abort if:
+    * local_path is not a dir.
+    * a dir as remote_path does not exist.
+
+    Returns the transferred delta, or None if aborted.
+    """
+    if not os.path.isdir(local_path):
+        logger.error("Source '%s' does not exist or is not a directory.", local_path)
+        return None
+
+    if not _remote_path_exists(f"{remote}:{remote_path}", mode="dir"):
+        logger.error("Destination '%s:%s' does not exist.", remote, remote_path)
+        return None
+
+    local_path_base = os.path.basename(os.path.normpath(local_path))
+    target_path = f"{remote_path.rstrip('/')}/{local_path_base}"
+    target = f"{remote}:{target_path}"
+
+    if not _remote_path_exists(target, mode="file_or_dir"):
+        logger.info("'%s' does not exist yet, uploading it in full.", target)
+        upload(remote_path, local_path, remote, bandwidth=bandwidth)
+        return Delta(_local_files(local_path), [], [])
+
+    if not _remote_path_exists(target, mode="dir"):
+        logger.error("'%s' exists but is not a directory.", target)
+        return None
+
+    delta = _compute_delta(local_path, target)
+    logger.info(
+        "Syncing '%s' to '%s': %d new, %d changed, %d deleted locally.",
+        local_path,
+        target,
+        len(delta.new),
+        len(delta.changed),
+        len(delta.deleted),
+    )
+    try:
+        if delta.new or delta.changed:
+            with throttled(bandwidth) as flags:
+                copy_files_from(local_path, target, sorted(delta.new + delta.changed), flags)
+        if delta.deleted and delete:
+            logger.info("Deleting %d file(s) from '%s'...", len(delta.deleted), target)
+            delete_files_from(target, delta.deleted)
+        elif delta.deleted:
+            logger.info("Keeping %d file(s) missing locally (no --delete).", len(delta.deleted))
+        logger.info("Sync completed successfully.")
+
+    except subprocess.CalledProcessError as exc:
+        logger.error(
+            "Failed to sync '%s' to '%s': %s",
+            local_path,
+            target,
+            exc.stderr.strip() if exc.stderr else "Unknown error",
+        )
+        raise
+
+    return delta
@@ -0,0 +1,53 @@
+"""utilities for breaking down the disk usage of a remote/local tree per directory"""
+
+import logging
+from typing import Dict, List, NamedTuple
+
+from rclone_wrapper.listing import iter_lsjson
+
+logger = logging.getLogger(__name__)
+
+
+class DirUsage(NamedTuple):
+    """Total size and number of files of a dir and everything below it."""
+
+    path: str  # relative to the listed root, "" for the root itself
+    size: int
+    files: int
+
+
+def disk_usage(path: str) -> Dict[str, DirUsage]:
+    """Return the usage of `path` (local or remote) and of every dir below it, by dir path.
+
+    The tree is listed with a single streamed `rclone lsjson -R --fast-list` call. Each
+    file is only added to its parent dir; the totals are then rolled up the tree, deepest
+    dirs first, so every dir is visited once whatever the depth of the tree.
+    """
+    sizes: Dict[str, int] = {"": 0}
+    counts: Dict[str, int] = {"": 0}
+    flags = ("-R", "--files-only", "--fast-list", "--no-modtime", "--no-mimetype")
+    for entry in iter_lsjson(path, *flags):
+        parent = entry["Path"].rpartition("/")[0]
+        sizes[parent] = sizes.get(parent, 0) + max(int(entry.get("Size", 0)), 0)
+        counts[parent] = counts.get(parent, 0) + 1
+
+    # dirs without files of their own, e.g. 'a' of 'a/b/c.txt', were not seen yet
+    for dir_path in list(sizes):
+        while dir_path:
+            dir_path = dir_path.rpartition("/")[0]
+            if dir_path in sizes:
+                break
+            sizes[dir_path], counts[dir_path] = 0, 0
+
+    for dir_path in sorted(sizes, key=lambda p: p.count("/") + bool(p), reverse=True):
+        if dir_path:
+            parent = dir_path.rpartition("/")[0]
+            sizes[parent] += sizes[dir_path]
+            counts[parent] += counts[dir_path]
+    return {p: DirUsage(p, size, counts[p]) for p, size in sizes.items()}
+
+
+def heaviest(usage: Dict[str, DirUsage], top: int = 20) -> List[DirUsage]:
+    """Return the `top` largest dirs below the root, at any depth, largest first."""
+    dirs = (entry for entry in usage.values() if entry.path)
+    return sorted(dirs, key=lambda entry: (-entry.size, entry.path))[:top]
@@ -0,0 +1,145 @@
+"""utilities for verifying transfers from hashes computed alongside them"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, List, Mapping, NamedTuple, Optional
+
+from rclone_wrapper.deduplication import local_hashes
+from rclone_wrapper.listing import Listing
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = "results"
+
+
+class VerificationReport(NamedTuple):
+    """Outcome of checking the files of a transfer against the hashes of their copies."""
+
+    source: str
+    target: str
+    hash_type: str
+    verified: int  # number of files whose hashes match
+    missing: List[str]  # files of the source absent from the target
+    mismatched: List[str]  # files whose hashes differ
+    unhashed: List[str]  # files the remote has no hash of this type for, left unchecked
+
+    @property
+    def ok(self) -> bool:
+        """True if no file is missing or differs, and some file was checked at all.
+
+        Unhashed files are not failures, unless no file could be verified: a remote without
+        hashes of this type would otherwise pass every transfer unchecked.
+        """
+        return not self.missing and not self.mismatched and (self.verified > 0 or not self.unhashed)
+
+
+def remote_hashes(remote_root: str, hash_type: str = "md5") -> Mapping[str, Optional[str]]:
+    """Return {relative path: hash} of the files at `remote_root`, from one `lsjson --hash`.
+
+    The hash is None for the files the remote has no hash of that type for. A file as
+    `remote_root` is relative to its parent, like in `local_hashes`. The listing is kept
+    in a compact `Listing`, which the returned mapping reads from.
+    """
+    return Listing.from_lsjson(remote_root, "-R", "--files-only", hash_type=hash_type).hashes()
+
+
+def compare_hashes(
+    source: str,
+    target: str,
+    expected: Mapping[str, Optional[str]],
+    actual: Mapping[str, Optional[str]],
+    hash_type: str = "md5",
+) -> VerificationReport:
+    """Check the {relative path: hash} of the source's files against those of the target."""
+    verified, missing, mismatched, unhashed = 0, [], [], []
+    for path, expected_hash in expected.items():
+        if path not in actual:
+            missing.append(path)
+        elif expected_hash is None or actual[path] is None:
+            unhashed.append(path)
+        elif expected_hash != actual[path]:
+            mismatched.append(path)
+        else:
+            verified += 1
+    # only the failures are sorted, never the whole listing
+    return VerificationReport(
+        source, target, hash_type, verified, sorted(missing), sorted(mismatched), sorted(unhashed)
+    )
+
+
+def _report(report: VerificationReport) -> VerificationReport:
+    """Log the outcome of a verification and store it as JSON under results/."""
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    current_time = datetime.now().strftime("%Y%m%dT%H%M%S")
+    report_file = os.path.join(REPORTS_DIR, f"{current_time}_verification.json")
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report._asdict(), f, indent=2)
+
+    for path in report.missing:
+        logger.error("'%s' is missing from '%s'.", path, report.target)
+    for path in report.mismatched:
+        logger.error("'%s' differs between '%s' and '%s'.", path, report.source, report.target)
+    if report.unhashed:
+        logger.warning(
+            "%d file(s) could not be checked, the remote has no %s hash for them.",
+            len(report.unhashed),
+            report.hash_type,
+        )
+    log = logger.info if report.ok else logger.error
+    log(
+        "Verified %d file(s) of '%s', %d missing, %d mismatched, see '%s'.",
+        report.verified,
+        report.target,
+        len(report.missing),
+        len(report.mismatched),
+        report_file,
+    )
+    return report
+
+
+def verified_upload(
+    copy: Callable[[], object],
+    local_path: str,
+    target: str,
+    hash_type: str = "md5",
+    *,
+    hashes: Optional[Mapping[str, str]] = None,
+) -> VerificationReport:
+    """Run `copy` of `local_path` into the remote `target`, and verify what it uploaded.
+
+    The local files are hashed while the copy runs, so they are read while rclone reads
+    them too (and mostly from the page cache), then compared against a single recursive
+    listing of the target with its hashes. Nothing is re-read once the copy ended.
+    If the local `hashes` were already computed (e.g. to deduplicate the upload), they are
+    used instead.
+    """
+    if hashes is None:
+        with ThreadPoolExecutor(1) as pool:
+            hashing = pool.submit(local_hashes, local_path, hash_type)
+            copy()
+            hashes = hashing.result()
+    else:
+        copy()
+    remote = remote_hashes(target, hash_type)
+    return _report(compare_hashes(local_path, target, hashes, remote, hash_type))
+
+
+def verified_download(
+    copy: Callable[[], object], source: str, local_target: str, hash_type: str = "md5"
+) -> VerificationReport:
+    """Run `copy` of the remote `source` into `local_target`, and verify what it downloaded.
+
+    The source is listed with its hashes once, while the copy runs, and the downloaded
+    files are hashed right after they were written (mostly from the page cache). Unlike
+    for uploads, this reads every downloaded file once more: it only saves the separate
+    listing of a `compare` pass, by overlapping it with the copy.
+    """
+    with ThreadPoolExecutor(1) as pool:
+        listing = pool.submit(remote_hashes, source, hash_type)
+        copy()
+        remote = listing.result()
+    local = local_hashes(local_target, hash_type)
+    return _report(compare_hashes(source, local_target, remote, local, hash_type))
@@ -0,0 +1,133 @@
+"""utilities for pre-warming the VFS cache of an rclone mount"""
+
+import functools
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from rclone_wrapper.remote_control import rc_call
+
+logger = logging.getLogger(__name__)
+
+MOUNT_TIMEOUT = 30.0  # seconds to wait for a new mount to show up
+HEADER_WORKERS = 8  # files whose header is read at once, as each read waits on the remote
+
+
+class WarmUp(NamedTuple):
+    """What to load into the VFS cache of a new mount before it is used."""
+
+    paths: List[str]  # hot dirs, relative to the mounted remote path ("" for its root)
+    depth: Optional[int] = None  # levels below each hot dir to load, None for all
+    header_bytes: int = 0  # bytes to pre-read from each file of the loaded dirs, 0 for none
+
+
+def wait_until_mounted(mount_point: str, timeout: float = MOUNT_TIMEOUT) -> bool:
+    """Return True once `mount_point` is a mount point, or False after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while subprocess.run(["mountpoint", "-q", mount_point], check=False).returncode != 0:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def _dir_params(dirs: Sequence[str]) -> Dict[str, str]:
+    """Return the 'dir', 'dir2', ... parameters of a `vfs/refresh` rc call."""
+    return {"dir" if i == 0 else f"dir{i + 1}": d for i, d in enumerate(dirs)}
+
+
+def _subdirs(mount_point: str, dirs: Sequence[str]) -> List[str]:
+    """Return the dirs one level below `dirs`, relative to the mount point."""
+    subdirs = []
+    for d in dirs:
+        with os.scandir(os.path.join(mount_point, d)) as entries:
+            subdirs += [os.path.join(d, e.name) for e in entries if e.is_dir(follow_symlinks=False)]
+    return subdirs
+
+
+def refresh_dirs(
+    rc_addr: str,
+    mount_point: str,
+    paths: Sequence[str],
+    depth: Optional[int] = None,
+    *,
+    walk: bool = True,
+) -> List[str]:
+    """Load the listings of the hot dirs `paths` into the VFS cache, down to `depth` levels.
+
+    Without a depth, each hot dir is refreshed recursively in a single `vfs/refresh` rc
+    call. Otherwise, the dirs of one level are refreshed with one call and then listed
+    (from the cache) to find the next level. Returns the refreshed dirs; without a depth
+    and with `walk` False, only the hot dirs, as finding the dirs below them means walking
+    the whole mounted tree.
+    """
+    paths = [path.strip("/") for path in paths]
+    if depth is None:
+        rc_call(rc_addr, "vfs/refresh", recursive="true", **_dir_params(paths))
+        if not walk:
+            return paths
+        return [
+            os.path.relpath(dir_path, mount_point)
+            for path in paths
+            for dir_path, _, _ in os.walk(os.path.join(mount_point, path))
+        ]
+    refreshed: List[str] = []
+    level = list(paths)
+    for _ in range(depth + 1):
+        if not level:
+            break
+        rc_call(rc_addr, "vfs/refresh", **_dir_params(level))
+        refreshed += level
+        level = _subdirs(mount_point, level)
+    return refreshed
+
+
+def _read_header(path: str, num_bytes: int) -> bool:
+    try:
+        with open(path, "rb") as f:
+            f.read(num_bytes)
+        return True
+    except OSError as exc:
+        logger.warning("Could not pre-read '%s': %s", path, exc)
+        return False
+
+
+def read_headers(mount_point: str, dirs: Sequence[str], num_bytes: int) -> int:
+    """Read the first `num_bytes` of each file in `dirs` (not below), return the number read.
+
+    With `--vfs-cache-mode full`, the read bytes stay in the VFS cache.
+    """
+    files = []
+    for d in dirs:
+        with os.scandir(os.path.join(mount_point, d)) as entries:
+            files += [e.path for e in entries if e.is_file(follow_symlinks=False)]
+    with ThreadPoolExecutor(HEADER_WORKERS) as pool:
+        return sum(pool.map(functools.partial(_read_header, num_bytes=num_bytes), files))
+
+
+def warm_up(rc_addr: str, mount_point: str, settings: WarmUp) -> None:
+    """Pre-warm the VFS cache of the mount serving rc on `rc_addr`, as soon as it is ready.
+
+    Failures are only logged: a cold cache is slow, but the mount still works.
+    """
+    if not wait_until_mounted(mount_point):
+        logger.warning("'%s' did not show up in time, skipping the warm-up.", mount_point)
+        return
+    start = time.monotonic()
+    try:
+        dirs = refresh_dirs(
+            rc_addr,
+            mount_point,
+            settings.paths,
+            settings.depth,
+            walk=settings.header_bytes > 0,  # only headers need the dirs below the hot ones
+        )
+        logger.info("Loaded %d dir(s) in %.1fs.", len(dirs), time.monotonic() - start)
+        if settings.header_bytes > 0:
+            num_files = read_headers(mount_point, dirs, settings.header_bytes)
+            logger.info("Pre-read %d file header(s) in %.1fs.", num_files, time.monotonic() - start)
+    except (subprocess.CalledProcessError, OSError) as exc:
+        logger.warning("Could not warm up '%s': %s", mount_point, exc)
@@ -0,0 +1,246 @@
+"""utilities for continuously uploading the changes of a local dir using inotify and rclone"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import select
+import struct
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from rclone_wrapper.bandwidth import throttled
+from rclone_wrapper.batching import copy_files_from
+from rclone_wrapper.retrying import _backoff
+from rclone_wrapper.transferring import _remote_path_exists
+
+logger = logging.getLogger(__name__)
+
+# see `man inotify`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+MAX_RETRY_DELAY = 300.0  # seconds, cap of the backoff between retries of a failed batch
+
+
+class _Inotify:
+    """Minimal ctypes binding of the Linux inotify API."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init failed: {os.strerror(errno)}")
+
+    def add_watch(self, path: str) -> int:
+        """Watch `path` (a dir) and return its watch descriptor."""
+        wd: int = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed: {os.strerror(errno)}", path)
+        return wd
+
+    def read_events(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """Return the pending (wd, mask, name) events, waiting at most `timeout` seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        return parse_events(os.read(self.fd, 64 * 1024))
+
+    def close(self) -> None:
+        """Release the inotify instance and all of its watches."""
+        os.close(self.fd)
+
+
+def parse_events(buffer: bytes) -> List[Tuple[int, int, str]]:
+    """Parse a buffer read from an inotify fd into (wd, mask, name) events."""
+    events: List[Tuple[int, int, str]] = []
+    offset = 0
+    while offset < len(buffer):
+        wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+        offset += _EVENT_HEADER.size
+        name = buffer[offset : offset + length].rstrip(b"\0")
+        offset += length
+        events.append((wd, mask, os.fsdecode(name)))
+    return events
+
+
+class _Watcher(threading.Thread):
+    """Thread that queues the paths (relative to `root`) of files written under `root`.
+
+    The queue is bounded: when the uploader falls behind, `put` blocks, the watcher stops
+    draining inotify and, if the kernel queue overflows too, the whole tree is re-queued.
+    """
+
+    def __init__(self, root: str, events: "queue.Queue[str]", stop: threading.Event) -> None:
+        super().__init__(name="rclone-wrapper-watcher", daemon=True)
+        self.root = root
+        self.events = events
+        self.stop = stop
+        self.inotify = _Inotify()
+        self.dirs: Dict[int, str] = {}
+        self.error: Optional[OSError] = None  # what stopped the thread, if it failed
+        self._add_tree(root, queue_files=False)
+
+    def _put(self, path: str) -> None:
+        while not self.stop.is_set():
+            try:
+                self.events.put(os.path.relpath(path, self.root), timeout=0.5)
+                return
+            except queue.Full:
+                logger.debug("Upload queue is full, waiting...")
+
+    def _add_tree(self, top: str, queue_files: bool) -> None:
+        """Watch `top` and every dir below it, optionally queueing the files found in them.
+
+        Files created in a new dir before it is watched are only found by this walk.
+        """
+        for dir_path, _, file_names in os.walk(top):
+            self.dirs[self.inotify.add_watch(dir_path)] = dir_path
+            if queue_files:
+                for file_name in file_names:
+                    self._put(os.path.join(dir_path, file_name))
+
+    def handle(self, wd: int, mask: int, name: str) -> None:
+        """Queue or start watching the object an inotify event is about."""
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflowed, re-queueing all of '%s'.", self.root)
+            self._add_tree(self.root, queue_files=True)
+            return
+        if wd not in self.dirs:
+            return
+        path = os.path.join(self.dirs[wd], name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path, queue_files=True)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._put(path)
+
+    def run(self) -> None:
+        try:
+            while not self.stop.is_set():
+                for wd, mask, name in self.inotify.read_events(timeout=0.5):
+                    self.handle(wd, mask, name)
+        except OSError as exc:  # e.g. ENOSPC once the limit of inotify watches is reached
+            self.error = exc
+        finally:
+            self.stop.set()  # no more events would arrive, the uploader stops too
+            self.inotify.close()
+
+
+def collect_batch(
+    events: "queue.Queue[str]",
+    debounce: float,
+    max_batch: int,
+    stop: threading.Event,
+    *,
+    deadline: Optional[float] = None,
+) -> Set[str]:
+    """Collect queued paths until none arrived for `debounce` seconds, or `max_batch` of them.
+
+    Blocks until at least one path is queued, unless `stop` is set or the `time.monotonic()`
+    `deadline` passed.
+    """
+    batch: Set[str] = set()
+    while not batch:
+        if stop.is_set() or (deadline is not None and time.monotonic() >= deadline):
+            return batch
+        try:
+            batch.add(events.get(timeout=0.5))
+        except queue.Empty:
+            continue
+    while len(batch) < max_batch:
+        try:
+            batch.add(events.get(timeout=debounce))
+        except queue.Empty:
+            break
+    return batch
+
+
+def watch(  # pylint: disable=too-many-arguments, too-many-locals
+    remote_path: str,
+    local_path: str,
+    remote: str,
+    *,
+    debounce: float = 5.0,
+    max_batch: int = 10000,
+    max_pending: int = 100000,
+    stop: Optional[threading.Event] = None,
+    bandwidth: Optional[str] = None,
+) -> None:
+    """Continuously upload the files written under a local dir, in debounced batches.
+
+    Files are copied into the dir under remote_path with the same basename as local_path,
+    like `upload` and `sync` do. Each batch of changes is pushed with a single
+    `rclone copy --files-from` call. Deletions are not propagated. A batch that failed to
+    upload is retried with the next one, or on its own after an exponential backoff (up to
+    MAX_RETRY_DELAY) if no change arrives meanwhile. Runs until `stop` is set or interrupted,
+    or until watching fails (e.g. at the limit of inotify watches), whose OSError is raised.
+    If a bandwidth policy is given, each batch gets its share of it (see `throttled`).
+
+    Abort if:
+    * local_path is not a dir.
+    * a dir as remote_path does not exist.
+    """
+    if not os.path.isdir(local_path):
+        logger.error("Source '%s' does not exist or is not a directory.", local_path)
+        return
+
+    if not _remote_path_exists(f"{remote}:{remote_path}", mode="dir"):
+        logger.error("Destination '%s:%s' does not exist.", remote, remote_path)
+        return
+
+    local_path_base = os.path.basename(os.path.normpath(local_path))
+    target = f"{remote}:{remote_path.rstrip('/')}/{local_path_base}"
+
+    stop = stop or threading.Event()
+    events: "queue.Queue[str]" = queue.Queue(maxsize=max_pending)
+    watcher = _Watcher(local_path, events, stop)
+    watcher.start()
+    logger.info("Watching '%s' for changes to upload to '%s'...", local_path, target)
+
+    failed: Set[str] = set()
+    attempts, retry_at = 0, 0.0
+    try:
+        while not stop.is_set():
+            collected = collect_batch(
+                events, debounce, max_batch, stop, deadline=retry_at if failed else None
+            )
+            if not collected and time.monotonic() < retry_at:
+                continue
+            batch = collected | failed
+            batch = {path for path in batch if os.path.isfile(os.path.join(local_path, path))}
+            if not batch:
+                continue
+            start = time.monotonic()
+            try:
+                with throttled(bandwidth) as flags:
+                    copy_files_from(local_path, target, sorted(batch), flags)
+                failed, attempts, retry_at = set(), 0, 0.0
+                logger.info("Uploaded %d file(s) in %.1fs.", len(batch), time.monotonic() - start)
+            except subprocess.CalledProcessError as exc:
+                delay = min(_backoff(attempts), MAX_RETRY_DELAY)
+                failed, attempts, retry_at = batch, attempts + 1, time.monotonic() + delay
+                logger.error(
+                    "Failed to upload %d file(s), retrying in %.0fs or with the next batch: %s",
+                    len(batch),
+                    delay,
+                    exc.stderr.strip() if exc.stderr else "Unknown error",
+                )
+        if watcher.error is not None:
+            logger.error("Stopped watching '%s': %s", local_path, watcher.error)
+            raise watcher.error
+    except KeyboardInterrupt:
+        logger.info("Stopped watching '%s'.", local_path)
+    finally:
+        stop.set()
+        watcher.join()
@@ -1,12 +1,22 @@
 # pylint: disable=missing-module-docstring, missing-function-docstring
 import glob
+import json
 import logging
+import logging.handlers
 import os
+import sys
+import threading
+from unittest.mock import patch
 
 import pytest
 from pytest import FixtureRequest
 
-from logger_wrapper.logger_wrapper import setup_logger
+from logger_wrapper.logger_wrapper import (
+    JsonLinesFormatter,
+    _active,
+    setup_logger,
+    shutdown_logger,
+)
 
 
 @pytest.fixture
@@ -52,6 +62,7 @@ def test_setup_logging_log_file_content(request: FixtureRequest) -> None:
     logger = setup_logger(level=logging.INFO, dir_path=log_dir)
     test_message = "This is a test log message."
     logger.info(test_message)
+    shutdown_logger()  # records are written by a background thread, wait for it
     log_files = glob.glob(os.path.join(log_dir, "*.log"))
     with open(log_files[0], "r", encoding="utf-8") as log_file:
         log_content = log_file.read()
@@ -65,3 +76,96 @@ def test_setup_logging_name_appendix(request: FixtureRequest) -> None:
     log_files = glob.glob(os.path.join(log_dir, f"*_{name_appendix}.log"))
     assert len(log_files) == 1
     assert os.path.isfile(log_files[0])
+
+
+def _queue_handlers() -> list[logging.Handler]:
+    return [
+        handler
+        for handler in logging.getLogger().handlers
+        if isinstance(handler, logging.handlers.QueueHandler)
+    ]
+
+
+def test_setup_logging_is_idempotent(request: FixtureRequest) -> None:
+    log_dir = request.getfixturevalue("log_directory")
+    setup_logger(dir_path=log_dir)
+    setup_logger(dir_path=log_dir)
+    assert len(_queue_handlers()) == 1
+    assert len(glob.glob(os.path.join(log_dir, "*.log"))) == 1
+    setup_logger(dir_path=log_dir, name_appendix="other")  # replaces the previous setup
+    assert len(_queue_handlers()) == 1
+    shutdown_logger()
+    assert not _queue_handlers()
+    shutdown_logger()  # nothing left to shut down
+
+
+@pytest.mark.parametrize(
+    "kwargs, handler_type",
+    [
+        ({"max_bytes": 1024, "backup_count": 2}, logging.handlers.RotatingFileHandler),
+        ({"when": "midnight", "backup_count": 7}, logging.handlers.TimedRotatingFileHandler),
+    ],
+)
+def test_setup_logging_rotation(
+    request: FixtureRequest, kwargs: dict[str, object], handler_type: type
+) -> None:
+    log_dir = request.getfixturevalue("log_directory")
+    for _ in range(2):  # e.g. two runs of the CLI
+        setup_logger(dir_path=log_dir, name_appendix="app", **kwargs)  # type: ignore[arg-type]
+        assert any(isinstance(handler, handler_type) for handler in _active["root"].handlers)
+        logging.getLogger().info("run")
+        shutdown_logger()
+    assert os.listdir(log_dir) == ["app.log"]  # runs append to the same, rotated file
+    with open(os.path.join(log_dir, "app.log"), "r", encoding="utf-8") as log_file:
+        assert len(log_file.readlines()) == 2
+
+
+def test_setup_logging_json_lines(request: FixtureRequest) -> None:
+    log_dir = request.getfixturevalue("log_directory")
+    logger = setup_logger(dir_path=log_dir, name_appendix="json", json_lines=True)
+    logger.info("transferred %s", "a.txt")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed")
+    shutdown_logger()
+    log_files = glob.glob(os.path.join(log_dir, "*_json.log"))
+    with open(log_files[0], "r", encoding="utf-8") as log_file:
+        entries = [json.loads(line) for line in log_file]
+    assert entries[0]["message"] == "transferred a.txt"
+    assert entries[0]["name"] == "json"
+    assert entries[0]["level"] == "INFO"
+    assert entries[1]["message"] == "failed"
+    assert "ValueError: boom" in entries[1]["exc_info"]
+
+
+def test_records_are_formatted_by_the_listener(request: FixtureRequest) -> None:
+    log_dir = request.getfixturevalue("log_directory")
+    logger = setup_logger(dir_path=log_dir, name_appendix="queued", json_lines=True)
+    formatting_threads = []
+    original_format = JsonLinesFormatter.format
+
+    def fake_format(self: JsonLinesFormatter, record: logging.LogRecord) -> str:
+        formatting_threads.append(threading.get_ident())
+        return original_format(self, record)
+
+    with (
+        patch.object(JsonLinesFormatter, "format", fake_format),
+        patch.object(logging.handlers.QueueHandler, "format") as mock_queue_format,
+    ):
+        logger.info("moved %s", "a.txt")
+        shutdown_logger()
+    mock_queue_format.assert_not_called()
+    assert formatting_threads
+    assert threading.get_ident() not in formatting_threads  # not in the logging thread
+
+
+def test_json_lines_formatter_exc_info() -> None:
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("x", logging.ERROR, __file__, 1, "failed", None, None)
+        record.exc_info = sys.exc_info()
+    entry = json.loads(JsonLinesFormatter("app").format(record))
+    assert entry["message"] == "failed"
+    assert "ValueError: boom" in entry["exc_info"]
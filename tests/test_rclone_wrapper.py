@@ -1,28 +1,126 @@
-# pylint: disable=missing-module-docstring, missing-function-docstring
+# pylint: disable=missing-module-docstring, missing-function-docstring, too-many-lines
+import errno
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import struct
 import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
 from types import SimpleNamespace
-from typing import List
-from unittest.mock import MagicMock, mock_open, patch
+from typing import Any, Dict, List, Optional, Set
+from unittest.mock import MagicMock, call, mock_open, patch
 
 import pytest
-
+from pytest import FixtureRequest
+
+from rclone_wrapper.bandwidth import (
+    _keep_share,
+    active_jobs,
+    current_limit,
+    fixed_shares,
+    mount_flags,
+    parse_rate,
+    parse_timetable,
+    register_job,
+    split_timetable,
+    throttled,
+)
+from rclone_wrapper.batching import copy_files_from, delete_files_from
 from rclone_wrapper.comparison import compare_folders
 from rclone_wrapper.configuration import read_config
+from rclone_wrapper.daemon import (
+    _expire_caches,
+    _RequestHandler,
+    _Server,
+    _ThreadStdout,
+    forward,
+    is_running,
+    serve,
+)
+from rclone_wrapper.deduplication import (
+    copy_deduplicated,
+    local_hashes,
+    remote_hash_index,
+    server_side_copies,
+    server_side_copy,
+)
+from rclone_wrapper.fanout import upload_to_remotes
+from rclone_wrapper.indexing import IndexEntry, RemoteIndex
+from rclone_wrapper.listing import (
+    Listing,
+    ListingEntry,
+    iter_lsjson,
+    join_path,
+    lsjson,
+    parse_modtime,
+)
 from rclone_wrapper.mounting import is_mounted, mount, unmount
-from rclone_wrapper.navigation import _list_dirs, navigate
+from rclone_wrapper.navigation import _list_dirs, clear_caches, list_names, navigate
+from rclone_wrapper.navigation import remote_exists as cached_remote_exists
+from rclone_wrapper.planning import (
+    PlannedFile,
+    TransferPlan,
+    _measured_throughput,
+    _record_throughput,
+    execute_plan,
+    execute_plans,
+    load_plan,
+    plan_transfer,
+    save_plan,
+)
+from rclone_wrapper.remote_control import free_rc_addr, rc_call, rc_flags
+from rclone_wrapper.retrying import (
+    FailedObject,
+    TransferError,
+    _backoff,
+    copy_with_retries,
+    is_transient,
+    parse_failures,
+)
+from rclone_wrapper.searching import search
 from rclone_wrapper.transferring import (
+    Delta,
+    _compute_delta,
     _remote_path_exists,
     _validate_local_destination,
     _validate_remote_destination,
     download,
+    sync,
     upload,
+    validate_local_destinations,
+    validate_remote_destinations,
+)
+from rclone_wrapper.usage import DirUsage, disk_usage, heaviest
+from rclone_wrapper.verification import VerificationReport, compare_hashes, remote_hashes
+from rclone_wrapper.warming import (
+    WarmUp,
+    read_headers,
+    refresh_dirs,
+    wait_until_mounted,
+    warm_up,
+)
+from rclone_wrapper.watching import (
+    IN_CLOSE_WRITE,
+    IN_ISDIR,
+    IN_Q_OVERFLOW,
+    _Inotify,
+    _Watcher,
+    collect_batch,
+    parse_events,
+    watch,
 )
 
 
 @pytest.fixture(autouse=True)
 def clear_list_dirs_cache() -> None:
-    """Automatically clear `_list_dirs` cache before each test."""
-    _list_dirs.cache_clear()
+    """Automatically clear the cached listings before each test."""
+    clear_caches()
 
 
 @pytest.mark.parametrize(
@@ -60,6 +158,33 @@ def test_list_dirs_permission_error() -> None:
             _list_dirs("", "gdrive")
 
 
+def test_list_names_and_remote_exists() -> None:
+    with patch("subprocess.run", return_value=MagicMock(stdout="sub/\na.txt\n")) as mock_run:
+        assert list_names("data", "gdrive") == ("sub/", "a.txt")
+        assert cached_remote_exists("gdrive", "/data/sub/", "dir")
+        assert cached_remote_exists("gdrive", "data/a.txt")
+        assert not cached_remote_exists("gdrive", "data/a.txt", "dir")
+        assert not cached_remote_exists("gdrive", "data/b.txt")
+        assert cached_remote_exists("gdrive", "/")
+        mock_run.assert_called_once()  # the listing of "data" is cached
+        clear_caches()
+        list_names("data", "gdrive")
+        assert mock_run.call_count == 2
+
+
+def test_list_names_failure() -> None:
+    not_found = subprocess.CalledProcessError(3, "rclone", stderr="directory not found")
+    with patch("subprocess.run", side_effect=not_found):
+        assert not cached_remote_exists("gdrive", "missing/a.txt")
+    with (
+        patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "rclone", "x", "io")),
+        patch("rclone_wrapper.navigation.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            list_names("other", "gdrive")
+        mock_logger.assert_called_once()
+
+
 def test_navigate(monkeypatch: pytest.MonkeyPatch) -> None:
     inputs = iter(["0", "..", "q"])
     monkeypatch.setattr("builtins.input", lambda: next(inputs))
@@ -301,50 +426,46 @@ def test_compare_folders_exception() -> None:
 
 
 @pytest.mark.parametrize(
-    "mode, error_message, expected",
+    "remote_path, mode, expected",
     [
-        ("dir", "directory not found", False),  # Directory does not exist
-        ("file_or_dir", "object not found", False),  # Generic not found case
+        ("remote:data/sub", "dir", True),  # Directory exists
+        ("remote:data/a.txt", "file_or_dir", True),  # File exists
+        ("remote:data/a.txt", "dir", False),  # Not a directory
+        ("remote:data/missing", "file_or_dir", False),  # Does not exist
+        ("remote:", "dir", True),  # Root of the remote
     ],
 )
-def test_remote_path_exists_not_found(mode: str, error_message: str, expected: bool) -> None:
-    with patch(
-        "subprocess.run",
-        side_effect=subprocess.CalledProcessError(1, "rclone", stderr=error_message),
-    ):
-        assert _remote_path_exists("remote:path", mode) == expected
+def test_remote_path_exists(remote_path: str, mode: str, expected: bool) -> None:
+    with patch("subprocess.run", _fake_lsf({"remote:data": ["sub/", "a.txt"]})):
+        assert _remote_path_exists(remote_path, mode) == expected
 
 
-@pytest.mark.parametrize(
-    "mode, stdout, expected",
-    [
-        ("dir", "12345 folder_name\n", True),  # Directory exists
-        ("file_or_dir", "file.txt\n", True),  # File or directory exists
-    ],
-)
-def test_remote_path_exists_found(mode: str, stdout: str, expected: bool) -> None:
-    with patch(
-        "subprocess.run",
-        return_value=MagicMock(returncode=0, stdout=stdout, stderr=""),
-    ):
-        assert _remote_path_exists("remote:path", mode) == expected
+def test_remote_path_exists_fresh() -> None:
+    mock_run = _fake_lsf({"remote:data": ["sub/", "a.txt"]})
+    with patch("subprocess.run", mock_run):
+        assert cached_remote_exists("remote", "data/a.txt")
+        assert _remote_path_exists("remote:data/sub", "dir")
+        assert _remote_path_exists("remote:data/a.txt", "file_or_dir")
+        assert cached_remote_exists("remote", "data/sub", "dir")
+    # the guardrails of a transfer neither read nor fill the listings cached for `ls`/`exists`
+    assert [args[0][2] for args, _ in mock_run.call_args_list] == ["remote:data"] * 3
 
 
 @pytest.mark.parametrize(
-    "mode, error_type",
+    "error_type",
     [
-        ("dir", subprocess.CalledProcessError(1, "rclone", stderr="some error")),
-        ("file_or_dir", FileNotFoundError("rclone not found")),
-        ("dir", PermissionError("permission denied")),
+        subprocess.CalledProcessError(1, "rclone", stderr="some error"),
+        FileNotFoundError("rclone not found"),
+        PermissionError("permission denied"),
     ],
 )
-def test_remote_path_exists_errors(mode: str, error_type: Exception) -> None:
+def test_remote_path_exists_errors(error_type: Exception) -> None:
     with (
         patch("subprocess.run", side_effect=error_type),
-        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+        patch("rclone_wrapper.navigation.logger.error") as mock_logger,
     ):
         with pytest.raises(type(error_type)):
-            _remote_path_exists("remote:path", mode)
+            _remote_path_exists("remote:path", "dir")
         mock_logger.assert_called()  # Ensure an error was logged
 
 
@@ -374,6 +495,66 @@ def test_validate_remote_destination(
             mock_logger.assert_not_called()  # No errors should be logged for valid destinations
 
 
+def _fake_lsf(listings: Dict[str, Any]) -> MagicMock:
+    """Fake `subprocess.run` of `rclone lsf`: {remote dir: [names, dirs ending in /]}."""
+
+    def run(command: List[str], **_: Any) -> MagicMock:
+        listing = listings.get(command[2])
+        if not isinstance(listing, list):
+            raise subprocess.CalledProcessError(3, command, stderr=listing or "dir not found")
+        return MagicMock(stdout="".join(f"{name}\n" for name in listing))
+
+    return MagicMock(side_effect=run)
+
+
+def test_validate_remote_destinations() -> None:
+    listings: Dict[str, Any] = {
+        "gdrive:": ["rp/", "nowhere.txt"],
+        "gdrive:rp": ["a/", "b/", "f.txt"],
+        "gdrive:rp/a": ["taken"],
+        "gdrive:rp/b": [],
+    }
+    uploads = [
+        ("rp/a", "/local/new"),  # valid
+        ("/rp/a/", "/local/taken"),  # target exists
+        ("rp/b", "/local/new/"),  # valid
+        ("rp/b", "/other/new"),  # target taken by the previous upload
+        ("rp/f.txt", "/local/x"),  # destination is a file
+        ("rp/c", "/local/x"),  # destination does not exist
+        ("nowhere/c", "/local/x"),  # parent does not exist
+        ("", "/local/x"),  # root of the remote
+    ]
+    listings["gdrive:nowhere"] = "directory not found"
+    mock_run = _fake_lsf(listings)
+    with (
+        patch("subprocess.run", mock_run),
+        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+    ):
+        valid = validate_remote_destinations(uploads, "gdrive")
+    assert valid == [True, False, True, False, False, False, False, True]
+    assert mock_logger.call_count == 5
+    listed = sorted(args[0][2] for args, _ in mock_run.call_args_list)
+    # every parent and destination dir listed once, however many uploads share it
+    assert listed == ["gdrive:", "gdrive:nowhere", "gdrive:rp", "gdrive:rp/a", "gdrive:rp/b"]
+
+
+def test_validate_remote_destinations_error() -> None:
+    with (
+        patch("subprocess.run", _fake_lsf({"gdrive:": "permission denied"})),
+        patch("rclone_wrapper.navigation.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            validate_remote_destinations([("rp", "/local/x")], "gdrive")
+        mock_logger.assert_called_once()
+    with (
+        patch("subprocess.run", side_effect=FileNotFoundError("rclone")),
+        patch("rclone_wrapper.navigation.logger.error") as mock_logger,
+    ):
+        with pytest.raises(FileNotFoundError):
+            validate_remote_destinations([("rp", "/local/x")], "gdrive")
+        mock_logger.assert_called_once()
+
+
 def test_upload_invalid_destination() -> None:
     with (
         patch("rclone_wrapper.transferring._validate_remote_destination", return_value=False),
@@ -394,8 +575,10 @@ def test_upload_success() -> None:
             [
                 "rclone",
                 "copy",
-                "--progress",
                 "--checksum",
+                "--use-json-log",
+                "--retries",
+                "1",
                 "/local/path",
                 "gdrive:remote_path/path",
             ],
@@ -445,6 +628,26 @@ def test_validate_local_destination(
             mock_logger.assert_not_called()
 
 
+def test_validate_local_destinations(tmp_path: str) -> None:
+    _write(os.path.join(tmp_path, "dst", "taken"))
+    dst, file = os.path.join(tmp_path, "dst"), os.path.join(tmp_path, "dst", "taken")
+    downloads = [
+        ("rp/new", dst),  # valid
+        ("rp/taken/", dst),  # target exists
+        ("other/new", dst),  # target taken by the first download
+        ("more/new", dst + os.sep),  # same dir spelled differently, target taken too
+        ("rp/x", file),  # destination is a file
+        ("rp/x", os.path.join(tmp_path, "missing")),  # destination does not exist
+    ]
+    with (
+        patch("os.scandir", wraps=os.scandir) as mock_scandir,
+        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+    ):
+        assert validate_local_destinations(downloads) == [True, False, False, False, False, False]
+    assert mock_logger.call_count == 5
+    assert mock_scandir.call_count == 3  # each destination scanned once
+
+
 def test_download_invalid_destination() -> None:
     with (
         patch("rclone_wrapper.transferring._validate_local_destination", return_value=False),
@@ -466,8 +669,10 @@ def test_download_success() -> None:
             [
                 "rclone",
                 "copy",
-                "--progress",
                 "--checksum",
+                "--use-json-log",
+                "--retries",
+                "1",
                 "gdrive:remote_path",
                 "/local/path/remote_path",
             ],
@@ -492,3 +697,1879 @@ def test_download_failure() -> None:
 
         mock_run.assert_called_once()
         mock_logger.assert_called()
+
+
+def test_compare_hashes() -> None:
+    expected = {"a": "h1", "b": "h2", "c": "h3", "d": None}
+    report = compare_hashes("/src", "gdrive:dst", expected, {"a": "h1", "b": "hx", "d": "h4"})
+    assert report == VerificationReport("/src", "gdrive:dst", "md5", 1, ["c"], ["b"], ["d"])
+    assert not report.ok
+    assert compare_hashes("/src", "gdrive:dst", {"a": "h1", "d": None}, {"a": "h1", "d": "h4"}).ok
+    assert not compare_hashes("/src", "gdrive:dst", {"d": None}, {"d": "h4"}).ok  # nothing checked
+
+
+def test_remote_hashes() -> None:
+    entries = [{"Path": "a", "Hashes": {"md5": "ABC"}}, {"Path": "sub/b"}]
+    with patch("rclone_wrapper.listing.iter_lsjson", return_value=entries) as mock_ls:
+        assert remote_hashes("gdrive:dst") == {"a": "abc", "sub/b": None}
+        mock_ls.assert_called_once_with(
+            "gdrive:dst", "-R", "--files-only", "--hash", "--hash-type", "md5"
+        )
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_upload_verify() -> None:
+    hashed_during_copy = []
+
+    def copy(*_: Any) -> None:
+        hashed_during_copy.append(mock_hashes.called)
+
+    with (
+        patch("rclone_wrapper.transferring._validate_remote_destination", return_value=True),
+        patch("rclone_wrapper.transferring.copy_with_retries", side_effect=copy),
+        patch(
+            "rclone_wrapper.verification.local_hashes",
+            return_value={"a": "h1", "b": "h2", "c": "h3"},
+        ) as mock_hashes,
+        patch(
+            "rclone_wrapper.listing.iter_lsjson",
+            return_value=[
+                {"Path": "a", "Hashes": {"md5": "h1"}},
+                {"Path": "c", "Hashes": {"md5": "hx"}},
+            ],
+        ) as mock_ls,
+        patch("rclone_wrapper.verification.logger.error") as mock_logger,
+    ):
+        report = upload("rp", "/local/data", "gdrive", verify=True)
+    assert report is not None and report.verified == 1
+    assert (report.missing, report.mismatched) == (["b"], ["c"])
+    assert hashed_during_copy == [True]  # the source was hashed alongside the copy
+    mock_hashes.assert_called_once_with("/local/data", "md5")
+    assert mock_ls.call_args.args[0] == "gdrive:rp/data"
+    assert mock_logger.call_count == 3
+    with open(os.path.join("results", os.listdir("results")[0]), encoding="utf-8") as f:
+        assert json.load(f)["mismatched"] == ["c"]
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_download_verify() -> None:
+    with (
+        patch("rclone_wrapper.transferring._validate_local_destination", return_value=True),
+        patch("rclone_wrapper.transferring.copy_with_retries") as mock_copy,
+        patch("rclone_wrapper.verification.local_hashes", return_value={"a": "h1"}) as mock_hashes,
+        patch("rclone_wrapper.listing.iter_lsjson", return_value=[{"Path": "a"}]) as mock_ls,
+        patch("rclone_wrapper.verification.logger.warning") as mock_logger,
+    ):
+        report = download("rp/data", "/local", "gdrive", verify=True)
+    # the remote has no md5 at all, so nothing was verified
+    assert report is not None and not report.ok and report.unhashed == ["a"]
+    mock_copy.assert_called_once_with("gdrive:rp/data", "/local/data", [])
+    mock_hashes.assert_called_once_with("/local/data", "md5")
+    assert mock_ls.call_args.args[0] == "gdrive:rp/data"
+    mock_logger.assert_called_once()
+
+
+def test_upload_deduplicated() -> None:
+    with (
+        patch("rclone_wrapper.transferring._validate_remote_destination", return_value=True),
+        patch("rclone_wrapper.transferring.copy_deduplicated") as mock_copy,
+        patch("subprocess.run") as mock_run,
+    ):
+        upload("remote_path", "/local/path", "gdrive", dedup_root="datasets")
+        mock_copy.assert_called_once_with(
+            "/local/path",
+            "gdrive:remote_path/path",
+            "gdrive:datasets",
+            index=None,
+            flags=[],
+            hashes=None,
+        )
+        mock_run.assert_not_called()
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_upload_deduplicated_verify() -> None:
+    hashes = {"a": "h1"}
+    with (
+        patch("rclone_wrapper.transferring._validate_remote_destination", return_value=True),
+        patch("rclone_wrapper.transferring.local_hashes", return_value=hashes) as mock_hashes,
+        patch("rclone_wrapper.transferring.copy_deduplicated") as mock_copy,
+        patch("rclone_wrapper.verification.local_hashes") as mock_verify_hashes,
+        patch("rclone_wrapper.listing.iter_lsjson", return_value=[]),
+        patch("rclone_wrapper.verification.logger.error"),
+    ):
+        report = upload("rp", "/local/data", "gdrive", dedup_root="datasets", verify=True)
+    # the source is hashed once, for both the dedup lookups and the verification
+    mock_hashes.assert_called_once_with("/local/data")
+    assert mock_copy.call_args.kwargs["hashes"] is hashes
+    mock_verify_hashes.assert_not_called()
+    assert report is not None and report.missing == ["a"]
+
+
+@pytest.mark.parametrize(
+    "root, relative_path, expected",
+    [
+        ("gdrive:", "a/b.txt", "gdrive:a/b.txt"),
+        ("gdrive:data/", "a/b.txt", "gdrive:data/a/b.txt"),
+        ("gdrive:data", "", "gdrive:data"),
+    ],
+)
+def test_join_path(root: str, relative_path: str, expected: str) -> None:
+    assert join_path(root, relative_path) == expected
+
+
+def test_lsjson() -> None:
+    stdout = '[{"Path": "a.txt", "Size": 3, "IsDir": false}]'
+    with patch("subprocess.run", return_value=MagicMock(stdout=stdout)) as mock_run:
+        assert lsjson("gdrive:data", "-R") == [{"Path": "a.txt", "Size": 3, "IsDir": False}]
+        assert mock_run.call_args[0][0] == ["rclone", "lsjson", "gdrive:data", "-R"]
+
+
+@pytest.mark.parametrize(
+    "error_type",
+    [
+        subprocess.CalledProcessError(1, "rclone", stderr="directory not found"),
+        FileNotFoundError("rclone not found"),
+    ],
+)
+def test_lsjson_errors(error_type: Exception) -> None:
+    with (
+        patch("subprocess.run", side_effect=error_type),
+        patch("rclone_wrapper.listing.logger.error") as mock_logger,
+    ):
+        with pytest.raises(type(error_type)):
+            lsjson("gdrive:data")
+        mock_logger.assert_called()
+
+
+def test_local_hashes() -> None:
+    stdout = "ABC123  a.txt\nabc999  sub/b.txt\n\n"
+    with patch("subprocess.run", return_value=MagicMock(stdout=stdout)):
+        assert local_hashes("/local/data") == {"a.txt": "abc123", "sub/b.txt": "abc999"}
+
+
+def test_local_hashes_failure() -> None:
+    with (
+        patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "rclone")),
+        patch("rclone_wrapper.deduplication.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            local_hashes("/local/data")
+        mock_logger.assert_called()
+
+
+def test_remote_hash_index() -> None:
+    entries = [
+        {"Path": "x/a.txt", "Hashes": {"md5": "H1"}},
+        {"Path": "y/a.txt", "Hashes": {"md5": "h1"}},
+        {"Path": "b.txt", "Hashes": {"md5": "h2"}},
+        {"Path": "no_hash.txt"},
+    ]
+    with patch("rclone_wrapper.deduplication.iter_lsjson", return_value=entries) as mock_lsjson:
+        assert remote_hash_index("gdrive:data") == {"h1": "x/a.txt", "h2": "b.txt"}
+        mock_lsjson.assert_called_once_with(
+            "gdrive:data", "-R", "--files-only", "--hash", "--hash-type", "md5"
+        )
+
+
+def test_server_side_copy() -> None:
+    with patch("subprocess.run") as mock_run:
+        server_side_copy("gdrive:a.txt", "gdrive:b/a.txt")
+        assert mock_run.call_args[0][0] == ["rclone", "copyto", "gdrive:a.txt", "gdrive:b/a.txt"]
+
+
+def test_server_side_copy_failure() -> None:
+    with (
+        patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "rclone")),
+        patch("rclone_wrapper.deduplication.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            server_side_copy("gdrive:a.txt", "gdrive:b/a.txt")
+        mock_logger.assert_called()
+
+
+def test_copy_deduplicated() -> None:
+    hashes = {"known.txt": "h1", "new.txt": "h2", "new_copy.txt": "h2"}
+    with (
+        patch("rclone_wrapper.deduplication.local_hashes", return_value=hashes),
+        patch("rclone_wrapper.deduplication.remote_hash_index", return_value={"h1": "old/k.txt"}),
+        patch("os.path.isdir", return_value=True),
+        patch("subprocess.run") as mock_run,
+        patch("rclone_wrapper.deduplication.server_side_copy") as mock_copy,
+    ):
+        result = copy_deduplicated("/local/data", "gdrive:dst/data", "gdrive:")
+        assert result == (1, 2)
+        command = mock_run.call_args[0][0]
+        assert command[-2:] == ["/local/data", "gdrive:dst/data"]
+        assert "--files-from" in command
+        mock_copy.assert_any_call("gdrive:old/k.txt", "gdrive:dst/data/known.txt")
+        mock_copy.assert_any_call("gdrive:dst/data/new.txt", "gdrive:dst/data/new_copy.txt")
+
+
+def test_copy_deduplicated_nothing_to_upload() -> None:
+    with (
+        patch("rclone_wrapper.deduplication.local_hashes") as mock_hashes,
+        patch("rclone_wrapper.deduplication.remote_hash_index", return_value={"h1": "a.txt"}),
+        patch("os.path.isdir", return_value=False),
+        patch("rclone_wrapper.deduplication.copy_files_from") as mock_copy,
+    ):
+        hashes = {"a.txt": "h1"}
+        assert copy_deduplicated(
+            "/local/a.txt", "gdrive:dst/a.txt", "gdrive:src", hashes=hashes
+        ) == (0, 1)
+        mock_hashes.assert_not_called()  # given hashes are not computed again
+        mock_copy.assert_called_once_with("gdrive:src", "gdrive:dst/a.txt", ["a.txt"])
+
+
+def test_server_side_copies() -> None:
+    copies = [
+        ("gdrive:ds/a.bin", "gdrive:x/ds/a.bin"),
+        ("gdrive:ds/b.bin", "gdrive:x/ds/b.bin"),
+        ("gdrive:top.bin", "gdrive:x/top.bin"),
+        ("gdrive:ds/a.bin", "gdrive:x/renamed.bin"),
+    ]
+    with (
+        patch("rclone_wrapper.deduplication.copy_files_from") as mock_files_from,
+        patch("rclone_wrapper.deduplication.server_side_copy") as mock_copy,
+    ):
+        server_side_copies(copies)
+    # one call per (source dir, destination dir), instead of one copyto per file
+    assert sorted(mock_files_from.call_args_list) == [
+        call("gdrive:", "gdrive:x", ["top.bin"]),
+        call("gdrive:ds", "gdrive:x/ds", ["a.bin", "b.bin"]),
+    ]
+    mock_copy.assert_called_once_with("gdrive:ds/a.bin", "gdrive:x/renamed.bin")
+    with (
+        patch(
+            "rclone_wrapper.deduplication.copy_files_from",
+            side_effect=subprocess.CalledProcessError(1, "rclone"),
+        ),
+        pytest.raises(subprocess.CalledProcessError),
+    ):
+        server_side_copies(copies[:1])
+
+
+def _entry(
+    path: str, is_dir: bool = False, modtime: str = "2024-01-01T00:00:00Z", md5: str = ""
+) -> Dict[str, Any]:
+    return {
+        "Path": path,
+        "Size": -1 if is_dir else 3,
+        "ModTime": modtime,
+        "IsDir": is_dir,
+        "Hashes": {"md5": md5} if md5 else {},
+    }
+
+
+@pytest.fixture
+def remote_index(tmp_path: str) -> RemoteIndex:
+    """Return an index of 'gdrive' populated with a small tree."""
+    index = RemoteIndex("gdrive", db_path=os.path.join(tmp_path, "index.sqlite"))
+    entries = [
+        _entry("data", is_dir=True),
+        _entry("data/a.txt", md5="H1"),
+        _entry("data/sub", is_dir=True),
+        _entry("data/sub/b.txt", md5="h2"),
+        _entry("top.txt", md5="h1"),
+    ]
+    with (
+        patch("rclone_wrapper.indexing.iter_lsjson", return_value=iter(entries)) as mock_lsjson,
+        patch("rclone_wrapper.indexing.UPSERT_BATCH", 2),  # written in 3 transactions
+    ):
+        index.refresh()
+        assert "-R" in mock_lsjson.call_args[0]
+    return index
+
+
+def test_remote_index_default_location(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    index = RemoteIndex("gdrive")
+    index.close()
+    assert os.path.isfile(os.path.join(tmp_path, "cache", "gdrive.sqlite"))
+
+
+def test_remote_index_lookups(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    assert index.get("/data/a.txt/") == IndexEntry(
+        "data/a.txt", 3, "2024-01-01T00:00:00Z", "h1", False
+    )
+    assert index.get("missing") is None
+    assert index.exists("", "dir")
+    assert index.exists("data/sub", "dir")
+    assert not index.exists("data/a.txt", "dir")
+    assert index.exists("data/a.txt", "file_or_dir")
+    assert [entry.path for entry in index.files("data")] == ["data/a.txt", "data/sub/b.txt"]
+    assert [entry.is_dir for entry in index.entries("data")] == [False, True, False]
+    assert index.hash_index("data") == {"h1": "a.txt", "h2": "sub/b.txt"}
+    assert index.hash_index() == {"h1": "data/a.txt", "h2": "data/sub/b.txt"}
+    assert len(index.hash_index("data/sub")) == 1 and "h1" not in index.hash_index("data/sub")
+
+
+def test_remote_index_case_sensitive_dirs(tmp_path: str) -> None:
+    index = RemoteIndex("gdrive", db_path=os.path.join(tmp_path, "index.sqlite"))
+    entries = [
+        _entry("Data", is_dir=True),
+        _entry("Data/a.txt", md5="h1"),
+        _entry("data", is_dir=True),
+        _entry("data/b.txt", md5="h2"),
+        _entry("Data0.txt", md5="h3"),
+    ]
+    with patch("rclone_wrapper.indexing.iter_lsjson", return_value=entries):
+        index.refresh()
+    # sibling dirs whose names only differ in case are distinct on the remote
+    assert [entry.path for entry in index.entries("Data")] == ["Data/a.txt"]
+    assert index.hash_index("Data") == {"h1": "a.txt"}
+    with index._conn:  # pylint: disable=protected-access
+        index._delete_tree("Data")  # pylint: disable=protected-access
+    assert index.get("data/b.txt") is not None and index.get("Data0.txt") is not None
+    assert index.get("Data/a.txt") is None
+    index.close()
+
+
+def test_remote_index_refresh_only_moved_dirs(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    listings = {
+        "gdrive:": [
+            _entry("data", is_dir=True, modtime="2024-01-02T00:00:00Z"),
+            _entry("new", is_dir=True),
+        ],
+        "gdrive:data": [_entry("sub", is_dir=True), _entry("c.txt", md5="h3")],
+        "gdrive:new": [_entry("d.txt", md5="h4")],
+    }
+
+    def fake_lsjson(path: str, *_: str) -> List[Dict[str, Any]]:
+        return listings[path]
+
+    with patch("rclone_wrapper.indexing.iter_lsjson", side_effect=fake_lsjson) as mock_lsjson:
+        index.refresh()
+    listed = [call[0][0] for call in mock_lsjson.call_args_list]
+    assert listed == ["gdrive:", "gdrive:data", "gdrive:new"]  # "data/sub" did not move
+    assert index.get("top.txt") is None
+    assert index.get("data/a.txt") is None
+    assert index.get("data/c.txt") is not None
+    assert index.get("data/sub/b.txt") is not None
+    assert index.get("new/d.txt") is not None
+
+
+def test_remote_index_full_refresh(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    # "data/sub/b.txt" overwritten in place and "data/sub/new.txt" added: "sub" did not move
+    listings = {
+        "gdrive:": [_entry("data", is_dir=True), _entry("top.txt", md5="h1")],
+        "gdrive:data": [
+            _entry("a.txt", md5="h1"),
+            _entry("sub", is_dir=True),
+            _entry("sub/b.txt", md5="h9"),
+            _entry("sub/new.txt", md5="h5"),
+        ],
+    }
+
+    def fake_lsjson(path: str, *flags: str) -> List[Dict[str, Any]]:
+        return [e for e in listings[path] if "-R" in flags or "/" not in e["Path"]]
+
+    with (
+        patch("rclone_wrapper.indexing.iter_lsjson", side_effect=fake_lsjson) as mock_lsjson,
+        patch("rclone_wrapper.indexing.UPSERT_BATCH", 2),
+    ):
+        index.refresh("data")
+        assert index.hash_index("data") == {"h1": "a.txt", "h2": "sub/b.txt"}  # missed
+        index.refresh("data", full=True)
+        assert "-R" in mock_lsjson.call_args[0]
+    assert index.hash_index("data") == {"h1": "a.txt", "h9": "sub/b.txt", "h5": "sub/new.txt"}
+    listings["gdrive:data"] = [_entry("sub", is_dir=True)]
+    with patch("rclone_wrapper.indexing.iter_lsjson", side_effect=fake_lsjson):
+        index.refresh("data", full=True)
+    assert [entry.path for entry in index.entries("data")] == ["data/sub"]  # rest swept
+    assert index.get("top.txt") is not None  # only the refreshed subtree is
+    index.close()
+
+
+def test_remote_index_refresh_sub_path(tmp_path: str) -> None:
+    db_path = os.path.join(tmp_path, "index.sqlite")
+    index = RemoteIndex("gdrive", db_path=db_path)
+    listings = {
+        "gdrive:": [_entry("datasets", is_dir=True), _entry("top.txt")],
+        "gdrive:datasets": [_entry("v1", is_dir=True), _entry("v1/a.txt")],
+    }
+
+    def fake_lsjson(path: str, *_: str) -> List[Dict[str, Any]]:
+        # the index is not locked while listing, other processes can write to it
+        other = sqlite3.connect(db_path, timeout=0)
+        other.execute("BEGIN IMMEDIATE")
+        other.rollback()
+        other.close()
+        return listings[path]
+
+    with patch("rclone_wrapper.indexing.iter_lsjson", side_effect=fake_lsjson):
+        index.refresh("/datasets/")
+        assert index.exists("datasets", "dir")
+        assert _validate_remote_destination("datasets", "/local/data", "gdrive", index=index)
+        assert not _validate_remote_destination("datasets", "/local/v1", "gdrive", index=index)
+        index.refresh("top.txt")  # a file, nothing to list below it
+        assert index.exists("top.txt", "file_or_dir")
+        listings["gdrive:"] = []
+        index.refresh("datasets")  # gone from the remote
+    assert not index.exists("datasets", "dir")
+    assert index.get("datasets/v1/a.txt") is None
+    index.close()
+
+
+def _name_index(tmp_path: str, *paths: str) -> RemoteIndex:
+    index = RemoteIndex("gdrive", db_path=os.path.join(tmp_path, "names.sqlite"))
+    entries = [_entry(path, is_dir="." not in path) for path in paths]
+    with patch("rclone_wrapper.indexing.iter_lsjson", return_value=entries):
+        index.refresh()
+    return index
+
+
+@pytest.mark.parametrize(
+    "pattern, mode, expected",
+    [
+        ("report*", "glob", ["a/Report_2024.pdf", "b/report.txt"]),
+        ("*.TXT", "glob", ["b/report.txt", "notes.txt"]),
+        ("rep?rt.*", "glob", ["b/report.txt"]),
+        ("report", "glob", []),
+        ("PORT", "substring", ["a/Report_2024.pdf", "b/report.txt"]),
+        ("a.b", "substring", []),
+        (r"_\d{4}\.", "regex", ["a/Report_2024.pdf"]),
+        ("^[ab]$", "regex", ["a", "b"]),
+    ],
+)
+def test_search_modes(tmp_path: str, pattern: str, mode: str, expected: List[str]) -> None:
+    index = _name_index(tmp_path, "a", "a/Report_2024.pdf", "b", "b/report.txt", "notes.txt")
+    assert [entry.path for entry in search(index, pattern, mode)] == expected
+    with pytest.raises(ValueError):
+        search(index, "a", "fuzzy")
+    index.close()
+
+
+def test_index_by_name(tmp_path: str) -> None:
+    index = _name_index(tmp_path, "x/AB.txt", "abc.txt", "abd.txt", "b.txt", "aa.txt")
+    assert [entry.path for entry in index.by_name("aB")] == ["abc.txt", "abd.txt", "x/AB.txt"]
+    assert [entry.path for entry in index.by_name("ab", "x")] == ["x/AB.txt"]
+    assert not list(index.by_name("c"))
+    index.close()
+    conn = sqlite3.connect(os.path.join(tmp_path, "names.sqlite"))
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT path FROM objects WHERE name >= 'ab' AND name < 'ac'"
+    ).fetchall()
+    assert "objects_name" in str(plan)  # a name range is an index lookup, not a scan
+    conn.close()
+
+
+def test_search(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    with (
+        patch.object(index, "refresh") as mock_refresh,
+        patch("rclone_wrapper.indexing.iter_lsjson") as mock_lsjson,
+    ):
+        assert [entry.path for entry in search(index, "*.txt", refresh=True)] == [
+            "data/a.txt",
+            "data/sub/b.txt",
+            "top.txt",
+        ]
+        assert [entry.path for entry in search(index, "*.txt", prefix="data/sub")] == [
+            "data/sub/b.txt"
+        ]
+        assert [entry.path for entry in search(index, "SUB", "substring", kind="dir")] == [
+            "data/sub"
+        ]
+        assert search(index, "sub", "substring", kind="file") == []
+        mock_refresh.assert_called_once_with("")  # only refreshed when asked to
+        mock_lsjson.assert_not_called()
+
+
+def test_search_invalid_kind(request: FixtureRequest) -> None:
+    with pytest.raises(ValueError):
+        search(request.getfixturevalue("remote_index"), "*", kind="link")
+
+
+def test_remote_path_exists_from_index(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    with patch("subprocess.run") as mock_run:
+        assert _remote_path_exists("gdrive:data/sub", "dir", index=index)
+        assert not _remote_path_exists("gdrive:data/x", "file_or_dir", index=index)
+        mock_run.assert_not_called()
+
+
+def test_remote_hash_index_from_index(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    with patch("rclone_wrapper.deduplication.iter_lsjson") as mock_lsjson:
+        assert remote_hash_index("gdrive:data", index=index) == {
+            "h1": "a.txt",
+            "h2": "sub/b.txt",
+        }
+        mock_lsjson.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "hashes, expected",
+    [
+        ({"a.txt": "h1", "sub/b.txt": "h2"}, True),
+        ({"a.txt": "h9", "extra.txt": "h1"}, False),
+    ],
+)
+def test_compare_folders_with_index(
+    request: FixtureRequest, hashes: Dict[str, str], expected: bool
+) -> None:
+    index = request.getfixturevalue("remote_index")
+    with (
+        patch("rclone_wrapper.comparison.local_hashes", return_value=hashes),
+        patch("subprocess.run") as mock_run,
+        patch("builtins.open", mock_open()) as mock_file,
+    ):
+        assert compare_folders("/local/data", "gdrive:data", index=index) == expected
+        mock_run.assert_not_called()
+    if not expected:
+        written = "".join(call[0][0] for call in mock_file().write.call_args_list)
+        assert "* a.txt" in written
+        assert "- extra.txt" in written
+        assert "+ sub/b.txt" in written
+
+
+def test_copy_files_from() -> None:
+    def fake_run(command: List[str], **_: Any) -> MagicMock:
+        with open(command[command.index("--files-from") + 1], encoding="utf-8") as f:
+            assert f.read() == "a.txt\nsub/b.txt\n"
+        return MagicMock(returncode=0)
+
+    with patch("subprocess.run", side_effect=fake_run) as mock_run:
+        copy_files_from("/local/data", "gdrive:data", ["a.txt", "sub/b.txt"])
+        assert mock_run.call_args[0][0][-2:] == ["/local/data", "gdrive:data"]
+        assert "--progress" in mock_run.call_args[0][0]
+        copy_files_from("/local/data", "gdrive:data", ["a.txt", "sub/b.txt"], progress=False)
+        assert "--progress" not in mock_run.call_args[0][0]
+
+
+def test_delete_files_from() -> None:
+    with patch("subprocess.run") as mock_run:
+        delete_files_from("gdrive:data", ["a.txt"])
+        command = mock_run.call_args[0][0]
+        assert command[:2] == ["rclone", "delete"]
+        assert command[-1] == "gdrive:data"
+
+
+def _rclone_check(returncode: int, report: str, stderr: str = "") -> Any:
+    """Return a fake subprocess.run writing `report` to the --combined file of rclone check."""
+
+    def fake_run(command: List[str], **_: Any) -> MagicMock:
+        with open(command[command.index("--combined") + 1], "w", encoding="utf-8") as f:
+            f.write(report)
+        return MagicMock(returncode=returncode, stderr=stderr)
+
+    return fake_run
+
+
+def test_compute_delta() -> None:
+    report = "= same.txt\n- new.txt\n* changed.txt\n+ gone.txt\n"
+    with patch("subprocess.run", side_effect=_rclone_check(1, report)):
+        assert _compute_delta("/local/data", "gdrive:data") == Delta(
+            ["new.txt"], ["changed.txt"], ["gone.txt"]
+        )
+
+
+@pytest.mark.parametrize(
+    "returncode, stdout",
+    [
+        (1, "- new.txt\n! broken.txt\n"),  # a file could not be checked
+        (3, ""),  # the check itself failed
+    ],
+)
+def test_compute_delta_errors(returncode: int, stdout: str) -> None:
+    with (
+        patch("subprocess.run", side_effect=_rclone_check(returncode, stdout, "error")),
+        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            _compute_delta("/local/data", "gdrive:data")
+        mock_logger.assert_called()
+
+
+def test_compute_delta_file_not_found() -> None:
+    with (
+        patch("subprocess.run", side_effect=FileNotFoundError("rclone not found")),
+        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+    ):
+        with pytest.raises(FileNotFoundError):
+            _compute_delta("/local/data", "gdrive:data")
+        mock_logger.assert_called()
+
+
+@pytest.mark.parametrize(
+    "is_dir, exists",
+    [
+        (False, []),  # local path is not a dir
+        (True, [False]),  # remote destination does not exist
+        (True, [True, True, False]),  # target exists but is a file
+    ],
+)
+def test_sync_aborts(is_dir: bool, exists: List[bool]) -> None:
+    with (
+        patch("os.path.isdir", return_value=is_dir),
+        patch("rclone_wrapper.transferring._remote_path_exists", side_effect=exists),
+        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+        patch("subprocess.run") as mock_run,
+    ):
+        assert sync("remote_path", "/local/data", "gdrive") is None
+        mock_logger.assert_called()
+        mock_run.assert_not_called()
+
+
+def test_sync_uploads_missing_target(tmp_path: str) -> None:
+    os.makedirs(os.path.join(tmp_path, "data", "sub"))
+    for name in ["a.txt", os.path.join("sub", "b.txt")]:
+        with open(os.path.join(tmp_path, "data", name), "w", encoding="utf-8") as f:
+            f.write(name)
+    with (
+        patch("rclone_wrapper.transferring._remote_path_exists", side_effect=[True, False]),
+        patch("rclone_wrapper.transferring.upload") as mock_upload,
+    ):
+        local_path = os.path.join(tmp_path, "data")
+        delta = sync("remote_path", local_path, "gdrive")
+        mock_upload.assert_called_once_with("remote_path", local_path, "gdrive", bandwidth=None)
+        assert delta == Delta(["a.txt", os.path.join("sub", "b.txt")], [], [])
+
+
+@pytest.mark.parametrize("delete", [False, True])
+def test_sync_transfers_delta(delete: bool) -> None:
+    delta = Delta(["new.txt"], ["changed.txt"], ["gone.txt"])
+    with (
+        patch("os.path.isdir", return_value=True),
+        patch("rclone_wrapper.transferring._remote_path_exists", return_value=True),
+        patch("rclone_wrapper.transferring._compute_delta", return_value=delta),
+        patch("rclone_wrapper.transferring.copy_files_from") as mock_copy,
+        patch("rclone_wrapper.transferring.delete_files_from") as mock_delete,
+    ):
+        assert sync("remote_path", "/local/data", "gdrive", delete=delete) == delta
+        mock_copy.assert_called_once_with(
+            "/local/data", "gdrive:remote_path/data", ["changed.txt", "new.txt"], []
+        )
+        if delete:
+            mock_delete.assert_called_once_with("gdrive:remote_path/data", ["gone.txt"])
+        else:
+            mock_delete.assert_not_called()
+
+
+def test_sync_failure() -> None:
+    with (
+        patch("os.path.isdir", return_value=True),
+        patch("rclone_wrapper.transferring._remote_path_exists", return_value=True),
+        patch("rclone_wrapper.transferring._compute_delta", return_value=Delta(["a"], [], [])),
+        patch(
+            "rclone_wrapper.transferring.copy_files_from",
+            side_effect=subprocess.CalledProcessError(1, "rclone", stderr="Sync failed"),
+        ),
+        patch("rclone_wrapper.transferring.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            sync("remote_path", "/local/data", "gdrive")
+        mock_logger.assert_called()
+
+
+@pytest.fixture
+def planning_dirs(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Run planning in a temporary working dir, so plans and throughput land there."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _listing(sizes: Dict[str, int], modtime: str = "2024-01-01T00:00:00Z") -> List[Any]:
+    return [{"Path": path, "Size": size, "ModTime": modtime} for path, size in sizes.items()]
+
+
+def test_parse_modtime() -> None:
+    assert parse_modtime("1970-01-01T00:00:01.123456789Z") == pytest.approx(1.123456)
+    assert parse_modtime("1970-01-01T01:00:00+01:00") == 0
+
+
+def test_plan_transfer_unknown_kind() -> None:
+    with pytest.raises(ValueError):
+        plan_transfer("move", "remote_path", "/local/data", "gdrive")
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_plan_upload() -> None:
+    with (
+        patch("rclone_wrapper.planning._validate_remote_destination", return_value=True),
+        patch("os.path.isdir", return_value=True),
+        patch("rclone_wrapper.listing.iter_lsjson", return_value=_listing({"b": 2, "a": 1})),
+    ):
+        plan = plan_transfer("upload", "remote_path", "/local/data", "gdrive")
+    assert plan is not None
+    assert plan.src_root == "/local/data"
+    assert plan.dst == "gdrive:remote_path/data"
+    assert plan.files == [PlannedFile("a", 1, False), PlannedFile("b", 2, False)]
+    assert plan.total_bytes == 3
+    assert plan.estimated_seconds is None
+    assert "2 file(s) (2 new, 0 changed), 3 bytes" in plan.summary()
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_plan_download_from_index(request: FixtureRequest) -> None:
+    index = request.getfixturevalue("remote_index")
+    with (
+        patch("rclone_wrapper.planning._validate_local_destination", return_value=True),
+        patch("rclone_wrapper.listing.iter_lsjson") as mock_lsjson,
+    ):
+        plan = plan_transfer("download", "data", "/local", "gdrive", index=index)
+        mock_lsjson.assert_not_called()
+    assert plan is not None
+    assert plan.dst == os.path.join("/local", "data")
+    assert [f.path for f in plan.files] == ["a.txt", "sub/b.txt"]
+
+
+@pytest.mark.parametrize("kind", ["upload", "download"])
+def test_plan_transfer_invalid_destination(kind: str) -> None:
+    with (
+        patch("rclone_wrapper.planning._validate_remote_destination", return_value=False),
+        patch("rclone_wrapper.planning._validate_local_destination", return_value=False),
+    ):
+        assert plan_transfer(kind, "remote_path", "/local/data", "gdrive") is None
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_plan_sync_missing_target_is_upload() -> None:
+    with (
+        patch("rclone_wrapper.planning._remote_path_exists", return_value=False),
+        patch("rclone_wrapper.planning._validate_remote_destination", return_value=True),
+        patch("os.path.isdir", return_value=False),
+        patch("rclone_wrapper.listing.iter_lsjson", return_value=_listing({"a.txt": 1})),
+    ):
+        plan = plan_transfer("sync", "remote_path", "/local/a.txt", "gdrive")
+    assert plan is not None
+    assert plan.kind == "upload"
+    assert plan.src_root == "/local"
+
+
+@pytest.mark.usefixtures("planning_dirs")
+@pytest.mark.parametrize("delete, expected_deleted", [(False, []), (True, ["gone"])])
+def test_plan_sync(delete: bool, expected_deleted: List[str]) -> None:
+    src = _listing({"same": 1, "resized": 2, "touched": 3, "new": 4})
+    src[2]["ModTime"] = "2024-01-02T00:00:00Z"
+    dst = _listing({"same": 1, "resized": 1, "touched": 3, "gone": 5})
+    with (
+        patch("rclone_wrapper.planning._remote_path_exists", return_value=True),
+        patch("os.path.isdir", return_value=True),
+        patch("rclone_wrapper.listing.iter_lsjson", side_effect=[src, dst]),
+    ):
+        plan = plan_transfer("sync", "remote_path", "/local/data", "gdrive", delete=delete)
+    assert plan is not None
+    assert plan.files == [
+        PlannedFile("new", 4, False),
+        PlannedFile("resized", 2, True),
+        PlannedFile("touched", 3, True),
+    ]
+    assert plan.deleted == expected_deleted
+
+
+def test_plan_sync_source_not_a_dir() -> None:
+    with (
+        patch("rclone_wrapper.planning._remote_path_exists", return_value=True),
+        patch("os.path.isdir", return_value=False),
+        patch("rclone_wrapper.planning.logger.error") as mock_logger,
+    ):
+        assert plan_transfer("sync", "remote_path", "/local/data", "gdrive") is None
+        mock_logger.assert_called()
+
+
+def _plan(kind: str = "sync", deleted: Optional[List[str]] = None) -> TransferPlan:
+    files = [PlannedFile("a.txt", 100, False)]
+    src_root, dst = "/local/data", "gdrive:rp/data"
+    return TransferPlan(kind, "gdrive", "rp", src_root, src_root, dst, files, deleted or [], None)
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_save_and_load_plan() -> None:
+    plan = _plan(deleted=["gone.txt"])
+    plan_file = save_plan(plan)
+    assert plan_file.startswith("plans")
+    assert load_plan(plan_file) == plan
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_execute_plan_records_throughput() -> None:
+    with (
+        patch("rclone_wrapper.planning.copy_files_from") as mock_copy,
+        patch("rclone_wrapper.planning.delete_files_from") as mock_delete,
+        patch("time.monotonic", side_effect=[0.0, 2.0]),
+    ):
+        assert execute_plan(_plan(deleted=["gone.txt"]))
+        mock_copy.assert_called_once_with("/local/data", "gdrive:rp/data", ["a.txt"], [])
+        mock_delete.assert_called_once_with("gdrive:rp/data", ["gone.txt"])
+    with (
+        patch("rclone_wrapper.planning._validate_remote_destination", return_value=True),
+        patch("os.path.isdir", return_value=True),
+        patch("rclone_wrapper.listing.iter_lsjson", return_value=_listing({"a": 1})),
+    ):
+        plan = plan_transfer("upload", "remote_path", "/local/data", "gdrive")
+    assert plan is not None
+    assert plan.estimated_seconds == pytest.approx(0.02)  # 1 byte at the measured 50 bytes/s
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_throughput_history() -> None:
+    assert _measured_throughput() is None
+    _record_throughput(0, 0.0)
+    assert _measured_throughput() is None  # nothing measured over no time
+    for _ in range(12):
+        _record_throughput(300, 1.0)
+    assert _measured_throughput() == 300  # the zero-time record aged out of the history
+
+
+@pytest.mark.parametrize("kind", ["upload", "download"])
+def test_execute_plan_revalidates(kind: str) -> None:
+    with (
+        patch("rclone_wrapper.planning._validate_remote_destination", return_value=False),
+        patch("rclone_wrapper.planning._validate_local_destination", return_value=False),
+        patch("rclone_wrapper.planning.copy_files_from") as mock_copy,
+    ):
+        assert not execute_plan(_plan(kind))
+        mock_copy.assert_not_called()
+
+
+@pytest.mark.usefixtures("jobs_dir")
+def test_execute_plans() -> None:
+    upload_plan = _plan("upload")
+    plans = [upload_plan, _plan("download"), _plan("sync"), upload_plan._replace(remote="s3")]
+    with (
+        patch(
+            "rclone_wrapper.planning.validate_remote_destinations", side_effect=[[True], [False]]
+        ) as mock_remote,
+        patch(
+            "rclone_wrapper.planning.validate_local_destinations", return_value=[False]
+        ) as mock_local,
+        patch("rclone_wrapper.planning._validate_remote_destination") as mock_validate,
+        patch("rclone_wrapper.planning.copy_files_from") as mock_copy,
+        patch("rclone_wrapper.planning._record_throughput"),
+    ):
+        assert execute_plans(plans, bandwidth="2M") == [True, False, True, False]
+        assert mock_remote.call_args_list == [
+            call([("rp", "/local/data")], "gdrive"),
+            call([("rp", "/local/data")], "s3"),
+        ]
+        mock_local.assert_called_once_with([("rp", "/local/data")])
+        mock_validate.assert_not_called()  # not validated again plan by plan
+        assert mock_copy.call_count == 2
+        assert mock_copy.call_args[0][3][:2] == ["--bwlimit", "2048K"]
+
+
+def test_execute_plan_failure() -> None:
+    with (
+        patch(
+            "rclone_wrapper.planning.copy_files_from",
+            side_effect=subprocess.CalledProcessError(1, "rclone", stderr="failed"),
+        ),
+        patch("rclone_wrapper.planning.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            execute_plan(_plan())
+        mock_logger.assert_called()
+
+
+def _write(path: str, content: str = "data") -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_parse_events() -> None:
+    buffer = struct.pack("iIII", 1, IN_CLOSE_WRITE, 0, 8) + b"a.txt\0\0\0"
+    buffer += struct.pack("iIII", 2, IN_Q_OVERFLOW, 0, 0)
+    assert parse_events(buffer) == [(1, IN_CLOSE_WRITE, "a.txt"), (2, IN_Q_OVERFLOW, "")]
+
+
+def test_inotify_errors(tmp_path: str) -> None:
+    inotify = _Inotify()
+    with pytest.raises(OSError):
+        inotify.add_watch(os.path.join(tmp_path, "missing"))
+    assert not inotify.read_events(timeout=0)
+    inotify.close()
+    with (
+        patch("ctypes.CDLL", return_value=MagicMock(inotify_init=MagicMock(return_value=-1))),
+        pytest.raises(OSError),
+    ):
+        _Inotify()
+
+
+def test_watcher_queues_written_files(tmp_path: str) -> None:
+    _write(os.path.join(tmp_path, "existing.txt"))
+    events: "queue.Queue[str]" = queue.Queue()
+    stop = threading.Event()
+    watcher = _Watcher(str(tmp_path), events, stop)
+    watcher.start()
+    _write(os.path.join(tmp_path, "a.txt"))
+    _write(os.path.join(tmp_path, "sub", "b.txt"))
+    queued = collect_batch(events, debounce=0.5, max_batch=10, stop=stop)
+    stop.set()
+    watcher.join()
+    assert queued == {"a.txt", os.path.join("sub", "b.txt")}
+
+
+def test_watcher_handle(tmp_path: str) -> None:
+    _write(os.path.join(tmp_path, "a.txt"))
+    events: "queue.Queue[str]" = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    watcher = _Watcher(str(tmp_path), events, stop)
+    watcher.handle(999, IN_CLOSE_WRITE, "unknown_watch.txt")
+    watcher.handle(1, IN_ISDIR | IN_CLOSE_WRITE, "not_created")
+    assert events.empty()
+    watcher.handle(0, IN_Q_OVERFLOW, "")  # re-queues the whole tree
+    assert events.get_nowait() == "a.txt"
+    watcher.events = MagicMock()
+    watcher.events.put.side_effect = [queue.Full, None]
+    watcher.handle(0, IN_Q_OVERFLOW, "")  # blocks on a full queue once, then succeeds
+    assert watcher.events.put.call_count == 2
+    stop.set()
+    watcher.handle(0, IN_Q_OVERFLOW, "")  # dropped once stopped
+    assert watcher.events.put.call_count == 2
+    watcher.inotify.close()
+
+
+def test_collect_batch() -> None:
+    events: "queue.Queue[str]" = queue.Queue()
+    for path in ["a", "b", "a", "c"]:
+        events.put(path)
+    stop = threading.Event()
+    assert collect_batch(events, debounce=0.01, max_batch=2, stop=stop) == {"a", "b"}
+    assert collect_batch(events, debounce=0.01, max_batch=10, stop=stop) == {"a", "c"}
+    waiting = MagicMock()
+    waiting.get.side_effect = [queue.Empty, "d", queue.Empty]
+    assert collect_batch(waiting, debounce=0.01, max_batch=10, stop=stop) == {"d"}
+    assert collect_batch(events, debounce=0.01, max_batch=10, stop=stop, deadline=0.0) == set()
+    stop.set()
+    assert collect_batch(events, debounce=0.01, max_batch=10, stop=stop) == set()
+
+
+@pytest.mark.parametrize(
+    "is_dir, exists",
+    [
+        (False, []),  # local path is not a dir
+        (True, [False]),  # remote destination does not exist
+    ],
+)
+def test_watch_aborts(is_dir: bool, exists: List[bool]) -> None:
+    with (
+        patch("os.path.isdir", return_value=is_dir),
+        patch("rclone_wrapper.watching._remote_path_exists", side_effect=exists),
+        patch("rclone_wrapper.watching._Watcher") as mock_watcher,
+        patch("rclone_wrapper.watching.logger.error") as mock_logger,
+    ):
+        watch("remote_path", "/local/data", "gdrive")
+        mock_watcher.assert_not_called()
+        mock_logger.assert_called()
+
+
+@pytest.mark.usefixtures("jobs_dir")
+def test_watch_uploads_batches(tmp_path: str) -> None:
+    for name in ["a.txt", "b.txt"]:
+        _write(os.path.join(tmp_path, "data", name))
+    batches: List[Set[str]] = [{"a.txt", "deleted.txt"}, {"b.txt"}, set()]
+    stop = threading.Event()
+    uploaded: List[List[str]] = []
+
+    def fake_copy(_: str, dst: str, paths: List[str], flags: List[str]) -> None:
+        assert dst == "gdrive:remote_path/data"
+        assert flags[:2] == ["--bwlimit", "1024K"]
+        uploaded.append(paths)
+        if len(uploaded) == 1:
+            raise subprocess.CalledProcessError(1, "rclone", stderr="rate limited")
+
+    def fake_collect(*_: Any, **__: Any) -> Set[str]:
+        batch = batches.pop(0)
+        if not batches:
+            stop.set()
+        return batch
+
+    with (
+        patch("rclone_wrapper.watching._remote_path_exists", return_value=True),
+        patch("rclone_wrapper.watching._Watcher", return_value=MagicMock(error=None)),
+        patch("rclone_wrapper.watching.collect_batch", side_effect=fake_collect),
+        patch("rclone_wrapper.watching.copy_files_from", side_effect=fake_copy),
+    ):
+        watch("remote_path", os.path.join(tmp_path, "data"), "gdrive", stop=stop, bandwidth="1M")
+    assert uploaded == [["a.txt"], ["a.txt", "b.txt"]]  # the failed batch is retried
+
+
+def test_watch_retries_failed_batch_without_new_events(tmp_path: str) -> None:
+    _write(os.path.join(tmp_path, "data", "a.txt"))
+    stop = threading.Event()
+    uploaded: List[List[str]] = []
+    deadlines: List[Optional[float]] = []
+
+    def fake_copy(_: str, __: str, paths: List[str], ___: List[str]) -> None:
+        uploaded.append(paths)
+        if len(uploaded) == 1:
+            raise subprocess.CalledProcessError(1, "rclone", stderr="rate limited")
+        stop.set()
+
+    def fake_collect(*_: Any, deadline: Optional[float] = None) -> Set[str]:
+        deadlines.append(deadline)
+        return {"a.txt"} if deadline is None else set()  # no new event after the first
+
+    with (
+        patch("rclone_wrapper.watching._remote_path_exists", return_value=True),
+        patch("rclone_wrapper.watching._Watcher", return_value=MagicMock(error=None)),
+        patch("rclone_wrapper.watching.collect_batch", side_effect=fake_collect),
+        patch("rclone_wrapper.watching.copy_files_from", side_effect=fake_copy),
+        patch("rclone_wrapper.watching._backoff", return_value=0.05),
+    ):
+        watch("remote_path", os.path.join(tmp_path, "data"), "gdrive", stop=stop)
+    assert uploaded == [["a.txt"], ["a.txt"]]  # retried on its own once the backoff elapsed
+    assert deadlines[0] is None and deadlines[1] is not None
+
+
+def test_watch_stops_when_watcher_fails(tmp_path: str) -> None:
+    with (
+        patch("rclone_wrapper.watching._remote_path_exists", return_value=True),
+        patch(
+            "rclone_wrapper.watching._Inotify.read_events",
+            side_effect=OSError(errno.ENOSPC, "No space left on device"),
+        ),
+        patch("rclone_wrapper.watching.copy_files_from") as mock_copy,
+        patch("rclone_wrapper.watching.logger.error") as mock_logger,
+    ):
+        with pytest.raises(OSError, match="No space left"):
+            watch("remote_path", str(tmp_path), "gdrive")
+        mock_copy.assert_not_called()
+        mock_logger.assert_called_once()
+
+
+def test_watch_keyboard_interrupt(tmp_path: str) -> None:
+    with (
+        patch("rclone_wrapper.watching._remote_path_exists", return_value=True),
+        patch("rclone_wrapper.watching._Watcher") as mock_watcher,
+        patch("rclone_wrapper.watching.collect_batch", side_effect=KeyboardInterrupt),
+    ):
+        watch("remote_path", str(tmp_path), "gdrive")
+        mock_watcher.return_value.join.assert_called_once()
+
+
+@pytest.fixture
+def jobs_dir(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Keep the registry of running jobs in a temporary dir."""
+    monkeypatch.setattr("rclone_wrapper.bandwidth.JOBS_DIR", os.path.join(tmp_path, "jobs"))
+    return os.path.join(tmp_path, "jobs")
+
+
+def test_free_rc_addr() -> None:
+    host, _, port = free_rc_addr().partition(":")
+    assert host == "127.0.0.1"
+    assert int(port) > 0
+    assert rc_flags("127.0.0.1:5572") == ["--rc", "--rc-addr", "127.0.0.1:5572"]
+
+
+def test_rc_call() -> None:
+    with patch("subprocess.run", return_value=MagicMock(stdout='{"rate": "1M"}')) as mock_run:
+        assert rc_call("127.0.0.1:5572", "core/bwlimit", rate="1M") == {"rate": "1M"}
+        assert mock_run.call_args[0][0] == [
+            "rclone",
+            "rc",
+            "--url",
+            "http://127.0.0.1:5572/",
+            "core/bwlimit",
+            "rate=1M",
+        ]
+
+
+def test_rc_call_failure() -> None:
+    with (
+        patch("subprocess.run", side_effect=subprocess.CalledProcessError(1, "rclone")),
+        patch("rclone_wrapper.remote_control.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            rc_call("127.0.0.1:5572", "core/bwlimit")
+        mock_logger.assert_called()
+
+
+@pytest.mark.parametrize(
+    "rate, expected",
+    [("off", None), ("512", 512 * 1024), ("2.5M", 2.5 * 1024**2), ("1Gi", 1024**3), ("10B", 10)],
+)
+def test_parse_rate(rate: str, expected: Optional[float]) -> None:
+    assert parse_rate(rate) == expected
+
+
+@pytest.mark.parametrize("spec", ["fast", "8,1M", "08:00", "08:00,1M bad"])
+def test_parse_timetable_invalid(spec: str) -> None:
+    with pytest.raises(ValueError):
+        parse_timetable(spec)
+
+
+def test_timetable() -> None:
+    timetable = parse_timetable("18:00,off 08:00,2M")
+    assert timetable == [(8 * 60, 2 * 1024**2), (18 * 60, None)]
+    assert current_limit(timetable, datetime(2024, 1, 1, 7, 59)) is None
+    assert current_limit(timetable, datetime(2024, 1, 1, 12, 0)) == 2 * 1024**2
+    assert current_limit(parse_timetable("1M")) == 1024**2
+    assert split_timetable(timetable, 4) == "08:00,512K 18:00,off"
+    assert split_timetable(parse_timetable("1K"), 4) == "00:00,1K"  # never below 1K
+
+
+@pytest.mark.usefixtures("jobs_dir")
+def test_job_registry() -> None:
+    assert active_jobs() == 0
+    assert register_job(os.getpid(), "127.0.0.1:5572").endswith(f"{os.getpid()}_5572.json")
+    register_job(2**22 + 1)  # above the max pid, so never running
+    with patch("os.kill", side_effect=[None, PermissionError]):
+        assert active_jobs() == 2  # someone else's process is still running
+    assert active_jobs() == 1  # the finished job is forgotten
+    broken_file = os.path.join(os.path.dirname(register_job(1)), "broken.json")
+    with open(broken_file, "w", encoding="utf-8") as f:
+        f.write("{")
+    with patch("os.kill"):
+        assert active_jobs() == 2  # the half-written entry is skipped
+
+
+@pytest.mark.usefixtures("jobs_dir")
+def test_throttled() -> None:
+    with throttled(None) as flags:
+        assert not flags
+    with (
+        patch("rclone_wrapper.bandwidth.free_rc_addr", return_value="127.0.0.1:5572"),
+        patch("rclone_wrapper.bandwidth.REBALANCE_INTERVAL", 0.01),
+        patch("rclone_wrapper.bandwidth.rc_call"),
+    ):
+        register_job(os.getpid() + 1 if os.getpid() < 2**22 else 1)
+        with patch("rclone_wrapper.bandwidth._is_alive", return_value=True):
+            with throttled("2M") as flags:
+                assert flags[:2] == ["--bwlimit", "1024K"]  # shared with the other job
+                assert "127.0.0.1:5572" in flags
+                assert active_jobs() == 2
+            assert active_jobs() == 1
+
+
+def test_keep_share() -> None:
+    stop = threading.Event()
+    shares = iter(["1M", "1M", "2M", "4M"])
+
+    def fake_share(_: Any) -> str:
+        share = next(shares)
+        if share == "4M":
+            stop.set()
+        return share
+
+    with (
+        patch("rclone_wrapper.bandwidth.REBALANCE_INTERVAL", 0.001),
+        patch("rclone_wrapper.bandwidth._share", side_effect=fake_share),
+        patch(
+            "rclone_wrapper.bandwidth.rc_call",
+            side_effect=[None, subprocess.CalledProcessError(1, "rclone")],
+        ) as mock_rc_call,
+    ):
+        _keep_share([(0, None)], "127.0.0.1:5572", "1M", stop)
+    assert [call.kwargs["rate"] for call in mock_rc_call.call_args_list] == ["2M", "4M"]
+
+
+@pytest.mark.usefixtures("jobs_dir")
+def test_mount_flags() -> None:
+    assert not mount_flags(None)
+    register_job(os.getpid())
+    assert mount_flags("08:00,2M 18:00,off") == ["--bwlimit", "08:00,1024K 18:00,off"]
+
+
+def test_mount_with_bandwidth() -> None:
+    with (
+        patch("rclone_wrapper.mounting.is_mounted", return_value=False),
+        patch("os.path.exists", return_value=True),
+        patch("subprocess.Popen") as mock_popen,
+        patch("rclone_wrapper.mounting.mount_flags", return_value=["--bwlimit", "1M"]),
+        patch("rclone_wrapper.mounting.register_job") as mock_register,
+    ):
+        mount("remote_folder", "/mnt/test", "gdrive", bandwidth="1M")
+        assert mock_popen.call_args[0][0][-2:] == ["--bwlimit", "1M"]
+        mock_register.assert_called_once_with(mock_popen.return_value.pid)
+
+
+@pytest.mark.parametrize("dedup_root", [None, "datasets"])
+def test_upload_throttled(dedup_root: Optional[str]) -> None:
+    with (
+        patch("rclone_wrapper.transferring._validate_remote_destination", return_value=True),
+        patch("rclone_wrapper.transferring.throttled") as mock_throttled,
+        patch("subprocess.run") as mock_run,
+        patch("rclone_wrapper.transferring.copy_deduplicated") as mock_copy,
+    ):
+        mock_throttled.return_value.__enter__.return_value = ["--bwlimit", "1M"]
+        upload("remote_path", "/local/path", "gdrive", dedup_root=dedup_root, bandwidth="2M")
+        mock_throttled.assert_called_once_with("2M")
+        if dedup_root is None:
+            assert mock_run.call_args[0][0][6:8] == ["--bwlimit", "1M"]
+        else:
+            assert mock_copy.call_args.kwargs["flags"] == ["--bwlimit", "1M"]
+
+
+def test_download_throttled() -> None:
+    with (
+        patch("rclone_wrapper.transferring._validate_local_destination", return_value=True),
+        patch("rclone_wrapper.transferring.throttled") as mock_throttled,
+        patch("subprocess.run") as mock_run,
+    ):
+        mock_throttled.return_value.__enter__.return_value = ["--bwlimit", "1M"]
+        download("remote_path", "/local/path", "gdrive", bandwidth="2M")
+        assert mock_run.call_args[0][0][6:8] == ["--bwlimit", "1M"]
+
+
+def _json_log(
+    *objects: str, msg: str = "Failed to copy: googleapi: Error 403: rateLimitExceeded"
+) -> str:
+    lines = ['{"level":"info","msg":"Copied (new)","object":"ok.txt"}', "not json", "[]"]
+    lines += [f'{{"level":"error","msg":"{msg}","object":"{obj}"}}' for obj in objects]
+    lines.append('{"level":"error","msg":"Attempt 1/3 failed with 1 errors"}')
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        ("googleapi: Error 403: User Rate Limit Exceeded", True),
+        ("HTTP error 503 (503 Service Unavailable)", True),
+        ("read tcp: connection reset by peer", True),
+        ("context deadline exceeded", True),
+        ("googleapi: Error 404: File not found", False),
+        ("permission denied", False),
+    ],
+)
+def test_is_transient(error: str, expected: bool) -> None:
+    assert is_transient(error) is expected
+
+
+def test_parse_failures() -> None:
+    stderr = _json_log("a.txt", "b.txt") + "\n" + _json_log("a.txt", msg="permission denied")
+    assert parse_failures(stderr) == [
+        FailedObject("a.txt", "permission denied", False),
+        FailedObject("b.txt", "Failed to copy: googleapi: Error 403: rateLimitExceeded", True),
+    ]
+
+
+def test_backoff() -> None:
+    with patch("random.uniform", side_effect=lambda low, high: high):
+        assert [_backoff(attempt) for attempt in range(3)] == [2.0, 4.0, 8.0]
+
+
+def test_copy_with_retries_success() -> None:
+    with patch("subprocess.run") as mock_run:
+        copy_with_retries("/local/dir", "gdrive:dir", ["--bwlimit", "1M"])
+        mock_run.assert_called_once_with(
+            [
+                "rclone",
+                "copy",
+                "--checksum",
+                "--use-json-log",
+                "--retries",
+                "1",
+                "--bwlimit",
+                "1M",
+                "/local/dir",
+                "gdrive:dir",
+            ],
+            check=True,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+
+def test_copy_with_retries_no_failed_object() -> None:
+    error = subprocess.CalledProcessError(1, "rclone", stderr="directory not found")
+    with patch("subprocess.run", side_effect=error), patch("time.sleep") as mock_sleep:
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            copy_with_retries("/local/dir", "gdrive:dir")
+        assert exc_info.value is error
+        mock_sleep.assert_not_called()
+
+
+def test_copy_with_retries_retries_failed_files() -> None:
+    error = subprocess.CalledProcessError(1, "rclone", stderr=_json_log("a.txt", "sub/b.txt"))
+    retry_error = subprocess.CalledProcessError(1, "rclone", stderr=_json_log("a.txt"))
+    with (
+        patch("subprocess.run", side_effect=error),
+        patch(
+            "rclone_wrapper.retrying.copy_files_from", side_effect=[retry_error, None]
+        ) as mock_copy,
+        patch("time.sleep") as mock_sleep,
+    ):
+        copy_with_retries("/local/dir", "gdrive:dir", ["--bwlimit", "1M"])
+        assert mock_copy.call_args_list[0][0] == (
+            "/local/dir",
+            "gdrive:dir",
+            ["a.txt", "sub/b.txt"],
+            ["--use-json-log", "--retries", "1", "--bwlimit", "1M"],
+        )
+        assert mock_copy.call_args_list[0][1] == {"progress": False}  # log kept on stderr
+        assert mock_copy.call_args_list[1][0][2] == ["a.txt"]
+        assert mock_sleep.call_count == 2
+
+
+def test_copy_with_retries_single_file() -> None:
+    error = subprocess.CalledProcessError(1, "rclone", stderr=_json_log("file.txt"))
+    with (
+        patch("subprocess.run", side_effect=[error, None]) as mock_run,
+        patch("rclone_wrapper.retrying.copy_files_from") as mock_copy,
+        patch("time.sleep"),
+    ):
+        copy_with_retries("/local/file.txt", "gdrive:dir")
+        assert mock_run.call_count == 2
+        mock_copy.assert_not_called()
+
+
+@pytest.mark.usefixtures("planning_dirs")
+def test_copy_with_retries_gives_up() -> None:
+    error = subprocess.CalledProcessError(
+        1, "rclone", stderr=_json_log("a.txt") + "\n" + _json_log("b.txt", msg="not found")
+    )
+    retry_error = subprocess.CalledProcessError(1, "rclone", stderr="unexpected EOF")
+    with (
+        patch("subprocess.run", side_effect=error),
+        patch("rclone_wrapper.retrying.copy_files_from", side_effect=retry_error) as mock_copy,
+        patch("time.sleep"),
+        patch("rclone_wrapper.retrying.logger.error") as mock_logger,
+    ):
+        with pytest.raises(TransferError) as exc_info:
+            copy_with_retries("/local/dir", "gdrive:dir")
+        assert mock_copy.call_count == 3
+        assert [failure.path for failure in exc_info.value.failures] == ["b.txt", "a.txt"]
+        assert exc_info.value.stderr == "unexpected EOF"
+        assert mock_logger.call_count == 3
+        reports = os.listdir("results")
+        assert len(reports) == 1 and reports[0].endswith("_failures.json")
+
+
+def _popen(stdout: str, returncode: int = 0, stderr: str = "") -> MagicMock:
+    """Return a mock of subprocess.Popen whose process prints `stdout` and `stderr`."""
+
+    def fake_popen(*_: Any, **kwargs: Any) -> MagicMock:
+        kwargs["stderr"].write(stderr)
+        process = MagicMock()
+        process.__enter__.return_value = process
+        process.stdout = stdout.splitlines(keepends=True)
+        process.wait.return_value = returncode
+        process.returncode = returncode
+        return process
+
+    return MagicMock(side_effect=fake_popen)
+
+
+def test_iter_lsjson() -> None:
+    stdout = '[\n{"Path":"a.txt","Size":1},\n{"Path":"b/c.txt","Size":2}\n]\n'
+    with patch("subprocess.Popen", _popen(stdout)) as mock_popen:
+        entries = iter_lsjson("gdrive:data", "-R")
+        mock_popen.assert_not_called()  # lazily, on the first next()
+        assert [entry["Path"] for entry in entries] == ["a.txt", "b/c.txt"]
+        assert mock_popen.call_args[0][0] == ["rclone", "lsjson", "gdrive:data", "-R"]
+
+
+def test_iter_lsjson_failure() -> None:
+    with (
+        patch("subprocess.Popen", _popen("[\n", returncode=3, stderr="directory not found")),
+        patch("rclone_wrapper.listing.logger.error") as mock_logger,
+    ):
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            list(iter_lsjson("gdrive:missing"))
+        assert exc_info.value.stderr == "directory not found"
+        mock_logger.assert_called_once()
+
+
+def test_iter_lsjson_rclone_not_found() -> None:
+    with (
+        patch("subprocess.Popen", side_effect=FileNotFoundError("rclone")),
+        patch("rclone_wrapper.listing.logger.error") as mock_logger,
+    ):
+        with pytest.raises(FileNotFoundError):
+            list(iter_lsjson("gdrive:data"))
+        mock_logger.assert_called_once()
+
+
+def test_disk_usage() -> None:
+    files = [
+        {"Path": "top.txt", "Size": 1},
+        {"Path": "a/b/c/deep.bin", "Size": 100},
+        {"Path": "a/b/c/deep2.bin", "Size": 50},
+        {"Path": "a/b/mid.bin", "Size": 10},
+        {"Path": "a/b/doc", "Size": -1},  # e.g. Google Docs have no size
+        {"Path": "x/y.bin", "Size": 20},
+    ]
+    with patch("rclone_wrapper.usage.iter_lsjson", return_value=iter(files)) as mock_list:
+        usage = disk_usage("gdrive:data")
+        assert "--fast-list" in mock_list.call_args[0]
+    assert usage == {
+        "": DirUsage("", 181, 6),
+        "a": DirUsage("a", 160, 4),
+        "a/b": DirUsage("a/b", 160, 4),
+        "a/b/c": DirUsage("a/b/c", 150, 2),
+        "x": DirUsage("x", 20, 1),
+    }
+    assert heaviest(usage, top=3) == [usage["a"], usage["a/b"], usage["a/b/c"]]
+
+
+def test_disk_usage_empty() -> None:
+    with patch("rclone_wrapper.usage.iter_lsjson", return_value=iter([])):
+        usage = disk_usage("gdrive:empty")
+    assert usage == {"": DirUsage("", 0, 0)}
+    assert not heaviest(usage)
+
+
+class _FakeRcat:
+    """Stands in for an `rclone rcat` process, keeping what is piped into it by target."""
+
+    received: Dict[str, bytes] = {}
+    commands: Dict[str, List[str]] = {}
+    failing: Set[str] = set()
+
+    def __init__(self, command: List[str], stderr: Any, **_: Any) -> None:
+        self.target = command[-1]
+        self.commands[self.target] = command
+        self.fails = self.target.partition(":")[0] in self.failing
+        self.stdin = self
+        self.data = b""
+        if self.fails:
+            stderr.write("googleapi: Error 403: storageQuotaExceeded")
+
+    def write(self, chunk: bytes) -> None:
+        if self.fails:
+            raise BrokenPipeError
+        self.data += chunk
+
+    def close(self) -> None:
+        if self.fails:
+            raise BrokenPipeError
+        self.received[self.target] = self.data
+
+    def wait(self) -> int:
+        return 1 if self.fails else 0
+
+
+@pytest.fixture
+def fake_rcat() -> Any:
+    """Replace `rclone rcat` processes by _FakeRcat, and accept every destination."""
+    _FakeRcat.received = {}
+    _FakeRcat.commands = {}
+    _FakeRcat.failing = set()
+    with (
+        patch("subprocess.Popen", _FakeRcat),
+        patch("rclone_wrapper.fanout._validate_remote_destination", return_value=True),
+        patch("rclone_wrapper.fanout.CHUNK_SIZE", 4),
+    ):
+        yield _FakeRcat
+
+
+def test_upload_to_remotes(tmp_path: str, request: FixtureRequest) -> None:
+    rcat = request.getfixturevalue("fake_rcat")
+    rcat.failing = {"s3"}
+    source = os.path.join(tmp_path, "photos")
+    os.makedirs(os.path.join(source, "2024"))
+    _write(os.path.join(source, "a.jpg"), "0123456789")
+    _write(os.path.join(source, "2024", "b.jpg"), "xyz")
+    with (
+        patch("builtins.open", wraps=open) as mock_open_,
+        patch("rclone_wrapper.fanout.logger.error") as mock_logger,
+    ):
+        reports = upload_to_remotes("backup/", source, ["gdrive", "s3"])
+        opened = [call[0][0] for call in mock_open_.call_args_list if call[0][1:] == ("rb",)]
+        assert sorted(opened) == [
+            os.path.join(source, "2024", "b.jpg"),
+            os.path.join(source, "a.jpg"),
+        ]  # each file read once for both remotes
+        assert mock_logger.call_count == 2
+    assert rcat.received == {
+        "gdrive:backup/photos/a.jpg": b"0123456789",
+        "gdrive:backup/photos/2024/b.jpg": b"xyz",
+    }
+    assert reports is not None
+    assert reports["gdrive"] == ("gdrive", "gdrive:backup/photos", 2, 13, {})
+    assert reports["s3"].files == 0
+    assert reports["s3"].failed == {
+        "2024/b.jpg": "googleapi: Error 403: storageQuotaExceeded",
+        "a.jpg": "googleapi: Error 403: storageQuotaExceeded",
+    }
+
+
+def test_upload_to_remotes_single_file(tmp_path: str, request: FixtureRequest) -> None:
+    rcat = request.getfixturevalue("fake_rcat")
+    source = os.path.join(tmp_path, "notes.txt")
+    _write(source, "hello")
+    os.utime(source, (0, 1700000000.5))
+    reports = upload_to_remotes("backup", source, ["gdrive", "s3"])
+    assert rcat.received == {
+        "gdrive:backup/notes.txt": b"hello",
+        "s3:backup/notes.txt": b"hello",
+    }
+    assert rcat.commands["s3:backup/notes.txt"][4:7] == [
+        "--metadata",
+        "--metadata-set",
+        "mtime=2023-11-14T22:13:20.500000+00:00",
+    ]  # keeps the local modtime, so a later sync does not see the file as changed
+    assert reports is not None and reports["s3"].bytes == 5
+
+
+def test_upload_to_remotes_unreadable_file(tmp_path: str, request: FixtureRequest) -> None:
+    rcat = request.getfixturevalue("fake_rcat")
+    source = os.path.join(tmp_path, "notes.txt")
+    _write(source, "hello")
+    with (
+        patch("builtins.open", side_effect=PermissionError("denied")),
+        patch("rclone_wrapper.fanout.logger.error"),
+    ):
+        reports = upload_to_remotes("backup", source, ["gdrive"])
+    assert reports is not None
+    assert reports["gdrive"].failed["notes.txt"].startswith("Could not read")
+    assert rcat.received == {"gdrive:backup/notes.txt": b""}
+
+
+def test_upload_to_remotes_files_at_once(tmp_path: str, request: FixtureRequest) -> None:
+    request.getfixturevalue("fake_rcat")
+    source = os.path.join(tmp_path, "data")
+    for number in range(6):
+        _write(os.path.join(source, f"{number}.txt"))
+    running: List[int] = [0]  # number of files in flight, after each start and end
+    lock = threading.Lock()
+
+    def fake_fan_out(path: str, *_: Any) -> Dict[str, str]:
+        with lock:
+            running.append(running[-1] + 1)
+        time.sleep(0.05)
+        with lock:
+            running.append(running[-1] - 1)
+        return {"s3": "failed"} if path.endswith("4.txt") else {}
+
+    with (
+        patch("rclone_wrapper.fanout._fan_out_file", side_effect=fake_fan_out),
+        patch("rclone_wrapper.fanout.FILE_WORKERS", 3),
+        patch("rclone_wrapper.fanout.logger.info") as mock_info,
+        patch("rclone_wrapper.fanout.logger.error"),
+    ):
+        reports = upload_to_remotes("backup", source, ["gdrive", "s3"])
+    assert 1 < max(running) <= 3  # several files in flight, never more than FILE_WORKERS
+    assert reports is not None and list(reports["s3"].failed) == ["4.txt"]
+    assert reports["gdrive"].files == 6
+    progress = [c[0][3] for c in mock_info.call_args_list if c[0][0].startswith("[")]
+    assert progress == [f"{number}.txt" for number in range(6)]  # recorded in order
+
+
+@pytest.mark.usefixtures("fake_rcat")
+def test_upload_to_remotes_aborts(tmp_path: str) -> None:
+    with patch("rclone_wrapper.fanout.logger.error") as mock_logger:
+        assert upload_to_remotes("backup", os.path.join(tmp_path, "missing"), ["gdrive"]) is None
+        mock_logger.assert_called_once()
+    with (
+        patch("rclone_wrapper.fanout._validate_remote_destination", side_effect=[True, False]),
+        patch("rclone_wrapper.fanout.logger.error") as mock_logger,
+        patch("subprocess.Popen") as mock_popen,
+    ):
+        assert upload_to_remotes("backup", str(tmp_path), ["gdrive", "s3"]) is None
+        mock_popen.assert_not_called()
+        assert "s3" in mock_logger.call_args[0][1]
+
+
+@pytest.mark.usefixtures("jobs_dir")
+def test_fixed_shares() -> None:
+    with fixed_shares(None, 2) as flags:
+        assert not flags
+    register_job(os.getpid())
+    with fixed_shares("08:00,3M 18:00,off", 2) as flags:
+        assert flags == ["--bwlimit", "08:00,1024K 18:00,off"]
+        assert active_jobs() == 3  # the other transfers see both streams
+        with fixed_shares("3M", 2):  # e.g. another fanout served by the daemon
+            assert active_jobs() == 5
+    assert active_jobs() == 1
+
+
+def test_fanout_rcat_exit_status(tmp_path: str, request: FixtureRequest) -> None:
+    request.getfixturevalue("fake_rcat")
+    source = os.path.join(tmp_path, "notes.txt")
+    _write(source, "hello")
+    with (
+        patch.object(_FakeRcat, "wait", return_value=2),
+        patch("rclone_wrapper.fanout.logger.error"),
+    ):
+        reports = upload_to_remotes("backup", source, ["gdrive"])
+    assert reports is not None
+    assert reports["gdrive"].failed == {"notes.txt": "rclone exited with status 2"}
+
+
+def test_listing() -> None:
+    entries = [
+        {"Path": "a", "Size": -1, "ModTime": "1970-01-01T00:00:10Z", "IsDir": True},
+        {"Path": "a/x.txt", "Size": 3, "ModTime": "1970-01-01T00:00:20Z", "Hashes": {}},
+        {"Path": "a/y.txt", "Size": 4, "ModTime": "1970-01-01T00:00:30Z"},
+        {"Path": "top.txt", "Size": 5, "Hashes": {"md5": "0A1B"}},
+    ]
+    with patch("rclone_wrapper.listing.iter_lsjson", return_value=iter(entries)) as mock_list:
+        listing = Listing.from_lsjson("gdrive:data", "-R", hash_type="MD5")
+        mock_list.assert_called_once_with("gdrive:data", "-R", "--hash", "--hash-type", "MD5")
+    assert len(listing) == 4
+    assert listing[0] == ListingEntry("a", -1, 10.0, True)
+    assert list(listing)[1:] == [
+        ListingEntry("a/x.txt", 3, 20.0, False),
+        ListingEntry("a/y.txt", 4, 30.0, False),
+        ListingEntry("top.txt", 5, 0.0, False, "0a1b"),
+    ]
+    assert listing.total_size == 12
+    # "a/x.txt" and "a/y.txt" share the single stored "a" prefix
+    assert listing._prefixes == ["", "a"]  # pylint: disable=protected-access
+    assert repr(listing[3]) == (
+        "ListingEntry(path='top.txt', size=5, modtime=0.0, is_dir=False, hash='0a1b')"
+    )
+    assert listing[3] != ("top.txt", 5, 0.0, False)
+    assert listing.row("a/y.txt") == 2 and listing.row("b/y.txt") is None
+    assert "a/x.txt" in listing and "a/z.txt" not in listing and 1 not in listing
+
+
+def test_listing_hashes() -> None:
+    listing = Listing()
+    listing.add("a.txt", 1, 0.0, False, "ABCD")
+    listing.add("sub/b.txt", 1, 0.0, False, "not-hex")
+    listing.add("sub/c.txt", 1, 0.0, False)
+    hashes = listing.hashes()
+    assert hashes == {"a.txt": "abcd", "sub/b.txt": "not-hex", "sub/c.txt": None}
+    assert len(hashes) == 3 and "sub/c.txt" in hashes
+    with pytest.raises(KeyError):
+        hashes["missing.txt"]  # pylint: disable=pointless-statement
+
+
+@pytest.fixture
+def daemon_socket(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Return a socket path in a temporary dir, with prints of requests sent to the client."""
+    monkeypatch.setattr("sys.stdout", _ThreadStdout(sys.stdout))
+    return os.path.join(tmp_path, "d.sock")
+
+
+def _fake_command(argv: List[str]) -> int:
+    if argv == ["boom"]:
+        raise RuntimeError("boom")
+    if argv == ["bad-args"]:
+        sys.exit(2)
+    print("listed", " ".join(argv))
+    logging.getLogger("rclone_wrapper.test").warning("careful")
+    return 3
+
+
+def test_daemon_forward(request: FixtureRequest, capsys: pytest.CaptureFixture[str]) -> None:
+    socket_path = request.getfixturevalue("daemon_socket")
+    with _Server(socket_path, _fake_command) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        assert is_running(socket_path)
+        assert forward(["ls", "-r", "data"], socket_path) == 3
+        assert forward(["bad-args"], socket_path) == 2
+        with patch("rclone_wrapper.daemon.logger.exception"):
+            assert forward(["boom"], socket_path) == 1
+        server.shutdown()
+        thread.join()
+    captured = capsys.readouterr()
+    assert captured.out == "listed ls -r data\n"
+    assert "WARNING - careful" in captured.err
+
+
+def test_daemon_transfers_wait_for_a_slot(request: FixtureRequest) -> None:
+    socket_path = request.getfixturevalue("daemon_socket")
+    with _Server(socket_path, lambda argv: 0) as server:
+        server.transfers = threading.BoundedSemaphore(1)
+        server.transfers.acquire()  # pylint: disable=consider-using-with
+        threading.Timer(0.05, server.transfers.release).start()
+        messages: List[Dict[str, Any]] = []
+        with (
+            patch.object(logging.getLogger(), "level", logging.INFO),
+            patch("rclone_wrapper.daemon.clear_caches") as mock_clear,
+        ):
+            assert server.dispatch(["upload", "-r", "backup"], messages.append) == 0
+            mock_clear.assert_called_once()
+        assert any("waiting" in message.get("log", "") for message in messages)
+
+
+def test_daemon_malformed_request(request: FixtureRequest) -> None:
+    socket_path = request.getfixturevalue("daemon_socket")
+    with _Server(socket_path, _fake_command) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(b"[]\n")
+            assert sock.makefile("r").readlines()[-1] == '{"exit": 2}\n'
+        server.shutdown()
+        thread.join()
+
+
+def test_daemon_client_gone() -> None:
+    handler = _RequestHandler.__new__(_RequestHandler)
+    handler.wfile = MagicMock(write=MagicMock(side_effect=BrokenPipeError))
+    handler._send({"out": "lost"})  # pylint: disable=protected-access
+
+
+def test_forward_without_daemon(tmp_path: str) -> None:
+    socket_path = os.path.join(tmp_path, "d.sock")
+    assert forward(["ls"], socket_path) is None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(socket_path)  # a socket file nobody listens on, as left by a killed daemon
+    assert not is_running(socket_path)
+    assert forward(["ls"], socket_path) is None
+
+
+def test_forward_connection_closed(tmp_path: str) -> None:
+    socket_path = os.path.join(tmp_path, "d.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(socket_path)
+        listener.listen()
+
+        def accept_and_close() -> None:
+            connection, _ = listener.accept()
+            connection.close()
+
+        threading.Thread(target=accept_and_close, daemon=True).start()
+        with patch("rclone_wrapper.daemon.logger.error") as mock_logger:
+            assert forward(["ls"], socket_path) == 1
+            mock_logger.assert_called_once()
+
+
+def test_serve(tmp_path: str) -> None:
+    socket_path = os.path.join(tmp_path, "cache", "d.sock")
+    stdout = sys.stdout
+    with patch("rclone_wrapper.daemon._Server.serve_forever", side_effect=KeyboardInterrupt):
+        serve(_fake_command, socket_path)
+    assert sys.stdout is stdout
+    assert not os.path.exists(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(socket_path)  # stale socket file of a killed daemon
+    with patch("rclone_wrapper.daemon._Server.serve_forever", side_effect=KeyboardInterrupt):
+        serve(_fake_command, socket_path)
+    assert not os.path.exists(socket_path)
+
+
+def test_serve_already_running(tmp_path: str) -> None:
+    socket_path = os.path.join(tmp_path, "d.sock")
+    with (
+        patch("rclone_wrapper.daemon.is_running", return_value=True),
+        patch("rclone_wrapper.daemon._Server") as mock_server,
+        patch("rclone_wrapper.daemon.logger.error") as mock_logger,
+    ):
+        serve(_fake_command, socket_path)
+        mock_server.assert_not_called()
+        mock_logger.assert_called_once()
+
+
+def test_thread_stdout_passthrough() -> None:
+    stdout = MagicMock(write=MagicMock(return_value=5))
+    thread_stdout = _ThreadStdout(stdout)
+    assert thread_stdout.write("hello") == 5
+    thread_stdout.flush()
+    stdout.flush.assert_called_once()
+
+
+def test_expire_caches() -> None:
+    with patch("rclone_wrapper.daemon.clear_caches") as mock_clear:
+        _expire_caches(MagicMock(wait=MagicMock(side_effect=[False, True])))
+        mock_clear.assert_called_once()
+
+
+@pytest.fixture
+def mounted_tree(tmp_path: str) -> str:
+    """Return a dir standing in for a mount point, with a small tree of hot dirs."""
+    for path in ["hot/a.bin", "hot/sub/b.bin", "hot/sub/deep/c.bin", "cold/d.bin"]:
+        _write(os.path.join(tmp_path, path), "0123456789")
+    return str(tmp_path)
+
+
+def test_refresh_dirs_recursive(request: FixtureRequest) -> None:
+    mount_point = request.getfixturevalue("mounted_tree")
+    with patch("rclone_wrapper.warming.rc_call") as mock_rc:
+        dirs = refresh_dirs("127.0.0.1:5572", mount_point, ["hot", "/cold/"])
+        mock_rc.assert_called_once_with(
+            "127.0.0.1:5572", "vfs/refresh", recursive="true", dir="hot", dir2="cold"
+        )
+    assert sorted(dirs) == ["cold", "hot", "hot/sub", "hot/sub/deep"]
+    with patch("rclone_wrapper.warming.rc_call"), patch("os.walk") as mock_walk:
+        assert refresh_dirs("127.0.0.1:5572", mount_point, ["hot/"], walk=False) == ["hot"]
+        mock_walk.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "depth, expected_calls",
+    [
+        (0, [{"dir": "hot"}]),
+        (1, [{"dir": "hot"}, {"dir": "hot/sub"}]),
+        (5, [{"dir": "hot"}, {"dir": "hot/sub"}, {"dir": "hot/sub/deep"}]),
+    ],
+)
+def test_refresh_dirs_by_level(
+    depth: int, expected_calls: List[Dict[str, str]], request: FixtureRequest
+) -> None:
+    mount_point = request.getfixturevalue("mounted_tree")
+    with patch("rclone_wrapper.warming.rc_call") as mock_rc:
+        refresh_dirs("127.0.0.1:5572", mount_point, ["hot"], depth)
+    assert [call.kwargs for call in mock_rc.call_args_list] == expected_calls
+
+
+def test_read_headers(request: FixtureRequest) -> None:
+    mount_point = request.getfixturevalue("mounted_tree")
+    assert read_headers(mount_point, ["hot", "hot/sub"], 4) == 2
+    with (
+        patch("builtins.open", side_effect=OSError("Input/output error")),
+        patch("rclone_wrapper.warming.logger.warning") as mock_logger,
+    ):
+        assert read_headers(mount_point, ["hot"], 4) == 0
+        mock_logger.assert_called_once()
+
+
+def test_wait_until_mounted() -> None:
+    with (
+        patch("subprocess.run", side_effect=[MagicMock(returncode=32), MagicMock(returncode=0)]),
+        patch("time.sleep") as mock_sleep,
+    ):
+        assert wait_until_mounted("/mnt/test")
+        mock_sleep.assert_called_once()
+    with (
+        patch("subprocess.run", return_value=MagicMock(returncode=32)),
+        patch("time.monotonic", side_effect=[0.0, 100.0]),
+    ):
+        assert not wait_until_mounted("/mnt/test", timeout=1.0)
+
+
+def test_warm_up(request: FixtureRequest) -> None:
+    mount_point = request.getfixturevalue("mounted_tree")
+    with (
+        patch("rclone_wrapper.warming.wait_until_mounted", return_value=True),
+        patch("rclone_wrapper.warming.rc_call"),
+        patch("rclone_wrapper.warming.read_headers", return_value=3) as mock_read,
+    ):
+        warm_up("127.0.0.1:5572", mount_point, WarmUp(["hot"], None, 512))
+        assert sorted(mock_read.call_args[0][1]) == ["hot", "hot/sub", "hot/sub/deep"]
+        assert mock_read.call_args[0][2] == 512
+        with patch("os.walk") as mock_walk:
+            warm_up("127.0.0.1:5572", mount_point, WarmUp(["hot"]))
+            mock_walk.assert_not_called()  # no headers to read, so no walk through the mount
+        mock_read.assert_called_once()
+
+
+def test_warm_up_failures() -> None:
+    with (
+        patch("rclone_wrapper.warming.wait_until_mounted", return_value=False),
+        patch("rclone_wrapper.warming.rc_call") as mock_rc,
+        patch("rclone_wrapper.warming.logger.warning") as mock_logger,
+    ):
+        warm_up("127.0.0.1:5572", "/mnt/test", WarmUp(["hot"]))
+        mock_rc.assert_not_called()
+        mock_logger.assert_called_once()
+    with (
+        patch("rclone_wrapper.warming.wait_until_mounted", return_value=True),
+        patch(
+            "rclone_wrapper.warming.rc_call",
+            side_effect=subprocess.CalledProcessError(1, "rclone", stderr="dir not found"),
+        ),
+        patch("rclone_wrapper.warming.logger.warning") as mock_logger,
+    ):
+        warm_up("127.0.0.1:5572", "/mnt/test", WarmUp(["missing"]))
+        mock_logger.assert_called_once()
+
+
+@pytest.mark.parametrize("header_bytes, cache_mode", [(0, "writes"), (4096, "full")])
+def test_mount_with_warm_up(header_bytes: int, cache_mode: str) -> None:
+    settings = WarmUp(["hot"], 1, header_bytes)
+    with (
+        patch("rclone_wrapper.mounting.is_mounted", return_value=False),
+        patch("os.path.exists", return_value=True),
+        patch("subprocess.Popen") as mock_popen,
+        patch("rclone_wrapper.mounting.free_rc_addr", return_value="127.0.0.1:5572"),
+        patch("rclone_wrapper.mounting.warm_up") as mock_warm_up,
+    ):
+        mount("remote_folder", "/mnt/test", "gdrive", warm=settings)
+        command = mock_popen.call_args[0][0]
+        assert command[command.index("--vfs-cache-mode") + 1] == cache_mode
+        assert command[-3:] == ["--rc", "--rc-addr", "127.0.0.1:5572"]
+        mock_warm_up.assert_called_once_with("127.0.0.1:5572", "/mnt/test", settings)